@@ -0,0 +1,90 @@
+"""
+Per-keystroke latency of series autocomplete at a large series count,
+comparing the old linear substring scan with SearchIndex.
+
+Run from the bot directory:
+    python -m benchmarks.autocomplete_search --series 100000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from librarian.dependable.search import SearchIndex
+
+_syllables = ['ka', 'shi', 'no', 'ma', 'ri', 'to', 'ra', 'ken', 'yu', 'sei',
+              'ha', 'mi', 'ko', 'ro', 'su', 'tan', 'da', 'gon', 'ei', 'zu']
+_words = ['the', 'of', 'and', 'tale', 'knight', 'dragon', 'academy', 'love',
+          'witch', 'shadow', 'hero', 'kingdom', 'sword', 'demon', 'sky']
+
+
+def _title(rng: random.Random) -> str:
+    words = []
+    for _ in range(rng.randint(1, 5)):
+        if rng.random() < 0.5:
+            words.append(rng.choice(_words))
+        else:
+            words.append(''.join(rng.choice(_syllables)
+                                 for _ in range(rng.randint(1, 4))))
+    return ' '.join(words).title()
+
+
+def _linear(names: list[str], string: str) -> list[str]:
+    return [_ for _ in names if string.lower() in _.lower()]
+
+
+def _measure(search, names: list[str], queries: list[str]) -> list[float]:
+    timings = []
+    for query in queries:
+        for end in range(1, len(query) + 1):
+            started = time.perf_counter()
+            search(query[:end])
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _report(name: str, timings: list[float]):
+    timings.sort()
+    print(f'{name:>8}: p50 {statistics.median(timings) * 1000:8.3f}ms  '
+          f'p99 {timings[int(len(timings) * 0.99) - 1] * 1000:8.3f}ms  '
+          f'max {timings[-1] * 1000:8.3f}ms  keystrokes {len(timings)}')
+
+
+def main(count: int, queries: int, seed: int):
+    rng = random.Random(seed)
+    names = dict.fromkeys(_title(rng) for _ in range(count))
+    while len(names) < count:
+        names[_title(rng)] = None
+    names = list(names)
+    typed = [rng.choice(names) for _ in range(queries)]
+    # Misspell a third of the queries so the fuzzy path is exercised.
+    for position in range(0, len(typed), 3):
+        query = list(typed[position])
+        swap = rng.randrange(len(query) - 1) if len(query) > 1 else 0
+        query[swap:swap + 2] = query[swap:swap + 2][::-1]
+        typed[position] = ''.join(query)
+
+    started = time.perf_counter()
+    index = SearchIndex(names)
+    print(f'   build: {(time.perf_counter() - started) * 1000:8.1f}ms '
+          f'for {len(names)} series')
+
+    started = time.perf_counter()
+    index.update(names[:-100] + [_title(rng) for _ in range(100)])
+    print(f'  update: {(time.perf_counter() - started) * 1000:8.1f}ms '
+          f'for 100 changed series')
+
+    exact = [query for position, query in enumerate(typed) if position % 3]
+    typo = typed[::3]
+    _report('linear', _measure(lambda q: _linear(names, q), names, typed))
+    _report('index', _measure(index.search, names, exact))
+    _report('typo', _measure(index.search, names, typo))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--series', type=int, default=100_000)
+    parser.add_argument('--queries', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=6)
+    arguments = parser.parse_args()
+    main(arguments.series, arguments.queries, arguments.seed)
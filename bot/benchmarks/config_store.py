@@ -0,0 +1,85 @@
+"""
+Save and load time of the configuration at large sizes, comparing the old
+deep-copy plus pickle of koor.dat with ConfigStore snapshots and journal
+appends.
+
+Run from the bot directory:
+    python -m benchmarks.config_store --keys 1000 10000 100000
+"""
+import argparse
+import copy
+import pickle
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from librarian.dependable.config_store import ConfigStore
+from librarian.dependable.configuration import Configuration
+
+
+def _configuration(count: int) -> Configuration:
+    configuration = Configuration()
+    for number in range(count):
+        if number % 3 == 0:
+            value = [[number, number + 1, f'channel {number}']]
+        elif number % 3 == 1:
+            value = {'enabled': True, 'limit': number}
+        else:
+            value = f'value {number}'
+        configuration[f'key_{number}'] = value
+    return configuration
+
+
+def _time(function, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings)
+
+
+def _pickle_save(configuration: Configuration, path: Path):
+    with open(path, 'wb') as file:
+        pickle.Pickler(file, protocol=pickle.HIGHEST_PROTOCOL).dump(
+            copy.deepcopy(configuration))
+
+
+def _pickle_load(path: Path):
+    with open(path, 'rb') as file:
+        pickle.Unpickler(file).load()
+
+
+def main(sizes: list[int], repeat: int):
+    print(f'{"keys":>8} {"pickle save":>12} {"pickle load":>12} '
+          f'{"json save":>12} {"json load":>12} {"journal set":>12}')
+    for size in sizes:
+        configuration = _configuration(size)
+        with tempfile.TemporaryDirectory() as directory:
+            directory = Path(directory)
+            pickled = directory / 'koor.dat'
+            store = ConfigStore(directory / 'config.json')
+
+            pickle_save = _time(
+                lambda: _pickle_save(configuration, pickled), repeat)
+            pickle_load = _time(lambda: _pickle_load(pickled), repeat)
+            json_save = _time(lambda: store.write(configuration.snapshot()),
+                              repeat)
+            json_load = _time(store.load, repeat)
+            # One set_config with write-behind journals only the changed key.
+            journal = _time(lambda: store.append({'key_0': 'changed'}),
+                            repeat)
+
+        print(f'{size:>8} {pickle_save * 1000:10.1f}ms '
+              f'{pickle_load * 1000:10.1f}ms {json_save * 1000:10.1f}ms '
+              f'{json_load * 1000:10.1f}ms {journal * 1000:10.2f}ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, nargs='+',
+                        default=[1_000, 10_000, 100_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    arguments = parser.parse_args()
+    main(arguments.keys, arguments.repeat)
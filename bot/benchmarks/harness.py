@@ -0,0 +1,369 @@
+"""
+End-to-end benchmark of the Upload and Management handlers against local
+stand-ins for Kavita and the Discord attachment CDN.
+
+The handlers are called directly with synthetic interactions, so no Discord
+connection is needed. Reports p50/p99 autocomplete latency, upload MB/s and
+peak RSS, and writes the results as JSON; pass an earlier result with
+--compare to print the change.
+
+Run from the bot directory:
+    python -m benchmarks.harness --series 20000 --latency-ms 20 \\
+        --output results.json
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+from aiohttp import web
+
+from benchmarks.autocomplete_search import _title
+
+_BLOCK = os.urandom(1024 * 1024)
+
+
+def _token() -> str:
+    header = base64.urlsafe_b64encode(b'{"alg":"none"}').rstrip(b'=')
+    claims = base64.urlsafe_b64encode(
+        json.dumps({'exp': time.time() + 3600}).encode()).rstrip(b'=')
+    return f'{header.decode()}.{claims.decode()}.'
+
+
+async def _serve(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}'
+
+
+def fake_kavita(libraries: int, series: int, latency: float,
+    seed: int) -> web.Application:
+    """
+    Kavita stand-in serving authentication, the library list, paged series
+    and scans, each answered after latency seconds.
+    """
+    rng = random.Random(seed)
+    names = [f'Library {number}' for number in range(libraries)]
+    series_by_library = {
+        number: sorted({_title(rng) for _ in range(series)})
+        for number in range(libraries)}
+    stats = {'requests': 0}
+
+    @web.middleware
+    async def delay(request: web.Request, handler):
+        stats['requests'] += 1
+        await asyncio.sleep(latency)
+        return await handler(request)
+
+    async def authenticate(_: web.Request) -> web.Response:
+        return web.json_response({'token': _token()})
+
+    async def library_list(_: web.Request) -> web.Response:
+        return web.json_response([
+            {'id': number, 'name': name, 'folders': [f'/manga/{name}']}
+            for number, name in enumerate(names)])
+
+    async def all_series(request: web.Request) -> web.Response:
+        body = await request.json()
+        library = int(body['statements'][0]['value'])
+        page = int(request.query.get('PageNumber', 1))
+        size = int(request.query.get('PageSize', 500))
+        titles = series_by_library.get(library, [])
+        chunk = titles[(page - 1) * size:page * size]
+        return web.json_response(
+            [{'id': number, 'name': title}
+             for number, title in enumerate(chunk)],
+            headers={'Pagination': json.dumps({
+                'currentPage': page, 'itemsPerPage': size,
+                'totalItems': len(titles),
+                'totalPages': -(-len(titles) // size)})})
+
+    async def scan(_: web.Request) -> web.Response:
+        return web.Response()
+
+    app = web.Application(middlewares=[delay])
+    app['stats'] = stats
+    app['names'] = names
+    app['series'] = series_by_library
+    app.router.add_post('/api/Plugin/authenticate', authenticate)
+    app.router.add_get('/api/Library/libraries', library_list)
+    app.router.add_post('/api/Series/all-v2', all_series)
+    app.router.add_post('/api/Library/scan', scan)
+    app.router.add_post('/api/Library/scan-folder', scan)
+    return app
+
+
+def fake_cdn(size: int) -> web.Application:
+    """
+    Attachment CDN stand-in. Every file name gets distinct content, so the
+    duplicate check does not reject the uploads. Range requests are served.
+    """
+
+    def content(name: str, start: int, end: int) -> bytes:
+        prefix = hashlib.blake2b(name.encode(), digest_size=16).digest()
+        data = bytearray()
+        position = start
+        while position < end:
+            offset = position % len(_BLOCK)
+            piece = _BLOCK[offset:offset + end - position]
+            data += piece
+            position += len(piece)
+        head = max(0, len(prefix) - start)
+        data[:head] = prefix[start:start + head]
+        return bytes(data)
+
+    async def attachment(request: web.Request) -> web.StreamResponse:
+        name = request.match_info['name']
+        start, end = 0, size
+        status = 200
+        if 'Range' in request.headers:
+            first, _, last = request.headers['Range'][6:].partition('-')
+            start = int(first)
+            end = int(last) + 1 if last else size
+            status = 206
+        response = web.StreamResponse(status=status, headers={
+            'Content-Length': str(end - start), 'Accept-Ranges': 'bytes'})
+        await response.prepare(request)
+        position = start
+        while position < end:
+            piece_end = min(position + len(_BLOCK), end)
+            await response.write(content(name, position, piece_end))
+            position = piece_end
+        return response
+
+    app = web.Application()
+    app.router.add_get('/attachments/{name}', attachment)
+    return app
+
+
+class _Response:
+    def __init__(self, interaction: 'FakeInteraction'):
+        self.interaction = interaction
+
+    async def defer(self, **_):
+        pass
+
+    async def send_message(self, content: str | None = None, **kwargs):
+        self.interaction.messages.append(content or kwargs.get('embed'))
+
+
+class FakeInteraction:
+    """The parts of ApplicationCommandInteraction the handlers use."""
+
+    def __init__(self, filled_options: dict[str, Any] | None = None):
+        self.filled_options = filled_options or {}
+        self.application_id = 1
+        self.token = None
+        self.messages: list[Any] = []
+        self.edits = 0
+        self.response = _Response(self)
+
+    async def edit_original_response(self, content: str | None = None,
+        **kwargs):
+        self.edits += 1
+        self.messages.append(content or kwargs.get('embed'))
+
+
+def _attachment(cdn: str, name: str, size: int) -> SimpleNamespace:
+    return SimpleNamespace(filename=name, url=f'{cdn}/attachments/{name}',
+                           size=size)
+
+
+def _percentiles(timings: list[float]) -> dict[str, float]:
+    timings = sorted(timings)
+    return {'p50_ms': statistics.median(timings) * 1000,
+            'p99_ms': timings[max(0, int(len(timings) * 0.99) - 1)] * 1000,
+            'max_ms': timings[-1] * 1000,
+            'samples': len(timings)}
+
+
+async def _time_keystrokes(autocomplete, interaction: FakeInteraction,
+    queries: list[str]) -> dict[str, float]:
+    timings = []
+    for query in queries:
+        for end in range(1, len(query) + 1):
+            started = time.perf_counter()
+            await autocomplete(interaction, query[:end])
+            timings.append(time.perf_counter() - started)
+    return _percentiles(timings)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024)
+
+
+async def run(arguments: argparse.Namespace) -> dict[str, Any]:
+    directory = Path(tempfile.mkdtemp(prefix='librarian-benchmark-'))
+    os.environ['CONFIG_DIR'] = str(directory)
+
+    # Imported late so the cogs pick up CONFIG_DIR.
+    from librarian.cogs.management import Management
+    from librarian.cogs.upload import Upload
+    from librarian.dependable.bot_overload import InteractionBot
+    from librarian.dependable.configuration import Configuration
+
+    kavita_app = fake_kavita(arguments.libraries, arguments.series,
+                             arguments.latency_ms / 1000, arguments.seed)
+    kavita_runner, kavita_url = await _serve(kavita_app)
+    cdn_runner, cdn_url = await _serve(fake_cdn(arguments.file_mb * 2 ** 20))
+
+    config = Configuration(
+        kavita_base_url=kavita_url,
+        kavita_api_key='benchmark',
+        kavita_scan_enabled=False,
+        libraries_root=str(directory / 'libraries'),
+        upload_progress_interval=0.05,
+        user_agent='Librarian benchmark',
+    )
+    bot = InteractionBot(config)
+    bot.user_agent = config['user_agent']
+    upload = Upload(bot)
+    management = Management(bot)
+    await upload.on_ready()
+    rng = random.Random(arguments.seed)
+    results: dict[str, Any] = {'parameters': {
+        key: str(value) if isinstance(value, Path) else value
+        for key, value in vars(arguments).items()}}
+
+    try:
+        # The first keystroke pays for the Kavita round trips.
+        interaction = FakeInteraction()
+        started = time.perf_counter()
+        await upload.library_autocomplete(interaction, 'l')
+        results['library_autocomplete_cold_ms'] = \
+            (time.perf_counter() - started) * 1000
+        names = kavita_app['names']
+        results['library_autocomplete'] = await _time_keystrokes(
+            upload.library_autocomplete, interaction,
+            [rng.choice(names) for _ in range(arguments.queries)])
+
+        library = names[0]
+        interaction = FakeInteraction({'library': library})
+        started = time.perf_counter()
+        await upload.series_autocomplete(interaction, 'a')
+        results['series_autocomplete_cold_ms'] = \
+            (time.perf_counter() - started) * 1000
+        titles = kavita_app['series'][0]
+        results['series_autocomplete'] = await _time_keystrokes(
+            upload.series_autocomplete, interaction,
+            [rng.choice(titles) for _ in range(arguments.queries)])
+
+        for number in range(arguments.config_keys):
+            config[f'benchmark_key_{number}'] = number
+        results['config_autocomplete'] = await _time_keystrokes(
+            management.config_autocomplete, FakeInteraction(),
+            [f'benchmark_key_{rng.randrange(arguments.config_keys)}'
+             for _ in range(arguments.queries)])
+
+        size = arguments.file_mb * 2 ** 20
+        interaction = FakeInteraction()
+        started = time.perf_counter()
+        await Upload.upload_file.callback(
+            upload, interaction,
+            _attachment(cdn_url, 'single.bin', size), library, 'Single')
+        elapsed = time.perf_counter() - started
+        results['upload_file'] = {'seconds': elapsed,
+                                  'mb_per_s': size / elapsed / 2 ** 20,
+                                  'edits': interaction.edits,
+                                  'result': interaction.messages[-1]}
+
+        files = [_attachment(cdn_url, f'volume {number:02}.bin', size)
+                 for number in range(arguments.batch)]
+        interaction = FakeInteraction()
+        started = time.perf_counter()
+        await Upload.batch.callback(upload, interaction, library, files[0],
+                                    'Batch', *files[1:])
+        elapsed = time.perf_counter() - started
+        results['upload_batch'] = {
+            'files': len(files), 'seconds': elapsed,
+            'mb_per_s': size * len(files) / elapsed / 2 ** 20,
+            'edits': interaction.edits,
+            'result': interaction.messages[-1]}
+
+        results['kavita_requests'] = kavita_app['stats']['requests']
+        results['peak_rss_mb'] = _peak_rss_mb()
+    finally:
+        await upload.close()
+        await bot.kavita.close()
+        await kavita_runner.cleanup()
+        await cdn_runner.cleanup()
+        await asyncio.to_thread(shutil.rmtree, directory,
+                                ignore_errors=True)
+    return results
+
+
+def _compare(before: dict[str, Any], after: dict[str, Any]):
+    rows = [('library_autocomplete', 'p50_ms'),
+            ('library_autocomplete', 'p99_ms'),
+            ('series_autocomplete', 'p50_ms'),
+            ('series_autocomplete', 'p99_ms'),
+            ('config_autocomplete', 'p50_ms'),
+            ('config_autocomplete', 'p99_ms'),
+            ('upload_file', 'mb_per_s'),
+            ('upload_batch', 'mb_per_s'),
+            ('peak_rss_mb', None)]
+    for section, key in rows:
+        old = before.get(section)
+        new = after.get(section)
+        if key is not None:
+            old = old and old.get(key)
+            new = new and new.get(key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old * 100 if old else 0.0
+        name = section + (f'.{key}' if key else '')
+        print(f'{name:>30}: {old:10.3f} -> {new:10.3f} ({change:+.1f}%)')
+
+
+def _report(results: dict[str, Any]):
+    for section in ('library_autocomplete', 'series_autocomplete',
+                    'config_autocomplete'):
+        timings = results[section]
+        print(f'{section:>21}: p50 {timings["p50_ms"]:8.3f}ms  '
+              f'p99 {timings["p99_ms"]:8.3f}ms  '
+              f'keystrokes {timings["samples"]}')
+    for section in ('upload_file', 'upload_batch'):
+        print(f'{section:>21}: {results[section]["mb_per_s"]:8.1f} MB/s  '
+              f'({results[section]["edits"]} progress edits)')
+    print(f'{"peak RSS":>21}: {results["peak_rss_mb"]:8.1f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--libraries', type=int, default=20)
+    parser.add_argument('--series', type=int, default=20_000,
+                        help='series per library')
+    parser.add_argument('--latency-ms', type=float, default=20.0,
+                        help='added to every Kavita response')
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--config-keys', type=int, default=1_000)
+    parser.add_argument('--file-mb', type=int, default=64)
+    parser.add_argument('--batch', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=6)
+    parser.add_argument('--output', type=Path)
+    parser.add_argument('--compare', type=Path)
+    arguments = parser.parse_args()
+
+    results = asyncio.run(run(arguments))
+    _report(results)
+    if arguments.output is not None:
+        arguments.output.write_text(json.dumps(results, indent=4))
+    if arguments.compare is not None:
+        _compare(json.loads(arguments.compare.read_text()), results)
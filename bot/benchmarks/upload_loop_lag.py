@@ -0,0 +1,102 @@
+"""
+Measures event loop lag while a large attachment is downloaded and written
+to disk, comparing the old inline f.write() loop with stream_to_file().
+
+Run from the bot directory:
+    python -m benchmarks.upload_loop_lag --size-mb 300
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from librarian.dependable.files import stream_to_file
+
+
+async def _serve(size: int) -> tuple[web.AppRunner, str]:
+    block = os.urandom(1024 * 1024)
+
+    async def attachment(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Length': str(size)})
+        await response.prepare(request)
+        remaining = size
+        while remaining:
+            piece = block[:min(remaining, len(block))]
+            await response.write(piece)
+            remaining -= len(piece)
+        return response
+
+    app = web.Application()
+    app.router.add_get('/attachment.cbz', attachment)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://127.0.0.1:{port}/attachment.cbz'
+
+
+async def _monitor_lag(stop: asyncio.Event, interval: float,
+    samples: list[float]) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+async def _inline(response: aiohttp.ClientResponse, path: Path) -> None:
+    with open(path, 'xb') as f:
+        async for b, _ in response.content.iter_chunks():
+            f.write(b)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+async def _streamed(response: aiohttp.ClientResponse, path: Path) -> None:
+    await stream_to_file(response.content.iter_any(), path)
+
+
+async def _run(name: str, writer, url: str, directory: Path,
+    interval: float) -> None:
+    samples: list[float] = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(_monitor_lag(stop, interval, samples))
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url) as response:
+            size = int(response.headers['Content-Length'])
+            await writer(response, directory / f'{name}.cbz')
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await monitor
+
+    samples.sort()
+    p99 = samples[int(len(samples) * 0.99) - 1] if samples else 0.0
+    print(f'{name:>8}: {size / elapsed / 1e6:8.1f} MB/s  '
+          f'lag max {samples[-1] * 1000:7.2f}ms  '
+          f'p99 {p99 * 1000:7.2f}ms  '
+          f'ticks {len(samples)}')
+
+
+async def main(size_mb: int, interval: float) -> None:
+    runner, url = await _serve(size_mb * 1024 * 1024)
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            await _run('inline', _inline, url, Path(directory), interval)
+            await _run('streamed', _streamed, url, Path(directory), interval)
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=300)
+    parser.add_argument('--interval', type=float, default=0.001)
+    arguments = parser.parse_args()
+    asyncio.run(main(arguments.size_mb, arguments.interval))
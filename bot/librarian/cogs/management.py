@@ -1,21 +1,66 @@
-import importlib
+import asyncio
 import json
 import logging
-from datetime import datetime, timedelta, UTC
-from pkgutil import iter_modules
+from datetime import datetime, UTC
 from traceback import format_exc
 
-from disnake import ApplicationCommandInteraction, Embed, Color
+from disnake import (ApplicationCommandInteraction, AutoShardedClient, Color,
+                     Embed)
 from disnake.ext import commands
-from disnake.ext.commands import Cog, Context
+from disnake.ext.commands import Context
 
-from librarian.dependable.bot_overload import InteractionBot
-from librarian.dependable.exceptions import KoorModuleLoadException
+from librarian.dependable.bot_overload import (DEFAULT_DRAIN_TIMEOUT,
+                                               LibrarianBot)
+from librarian.dependable.exceptions import PasteFailedException
+from librarian.dependable.health import Health
 from librarian.dependable.paste import TextTypes
-
-
-def _snake_case_to_camel_case(string: str) -> str:
-    return ''.join(word.capitalize() for word in string.split('_'))
+from librarian.dependable.profiler import (DEFAULT_PROFILE_INTERVAL,
+                                           DEFAULT_PROFILE_SECONDS,
+                                           DEFAULT_SLOW_CALLBACK,
+                                           SamplingProfiler)
+
+# Longest profile the command accepts, in seconds.
+MAX_PROFILE_SECONDS = 300
+FIELD_LIMIT = 1024
+
+
+def _milliseconds(seconds: float | None) -> str:
+    return 'n/a' if seconds is None else f'{seconds * 1000:.0f}ms'
+
+
+def _megabytes(size: int | None) -> str:
+    return 'n/a' if size is None else f'{size / 1e6:.0f} MB'
+
+
+def _field(lines: list[str]) -> str:
+    value = '\n'.join(lines) or 'None'
+    if len(value) > FIELD_LIMIT:
+        value = value[:FIELD_LIMIT - 4].rsplit('\n', 1)[0] + '\n...'
+    return value
+
+
+def _health_fields(embed: Embed, health: Health):
+    """Adds the sampled health, all of it computed ahead of time."""
+    window = f'{health.window / 60:.0f}m' if health.window >= 60 \
+        else f'{health.window:.0f}s'
+    embed.add_field(f'Event loop lag ({window})',
+                    f'p50 {_milliseconds(health.loop_lag_p50)}, '
+                    f'p99 {_milliseconds(health.loop_lag_p99)}, '
+                    f'max {_milliseconds(health.loop_lag_max)}',
+                    inline=False)
+    embed.add_field('Memory', f'{_megabytes(health.rss)} '
+                              f'(peak {_megabytes(health.rss_peak)})')
+    embed.add_field('Open files', str(health.open_fds or 'n/a'))
+    embed.add_field(
+        f'Uploads ({window})',
+        f'{health.rates.get("upload_bytes", 0.0) / 1e6:.2f} MB/s, '
+        f'{health.rates.get("upload_jobs", 0.0) * 60:.1f} jobs/min')
+    embed.add_field('Connections', _field([
+        f'{name}: {connections.active} active, {connections.idle} idle'
+        for name, connections in health.connections.items()]))
+    embed.add_field('Disk free', _field([
+        f'{library}: {disk.free / 1e9:.1f} of {disk.total / 1e9:.1f} GB'
+        for library, disk in health.disk.items()]))
 
 
 async def _owner_check(ctx: Context) -> bool:
@@ -26,10 +71,10 @@ async def _owner_check(ctx: Context) -> bool:
 
 
 class Management(commands.Cog):
-    def __init__(self, bot: InteractionBot):
+    def __init__(self, bot: LibrarianBot):
         self.bot = bot
-        self._module_cache: tuple[list[str], datetime] = ([], datetime.min)
         self.logger = logging.getLogger(__name__)
+        self._profiling = False
 
     @commands.slash_command(guild_ids=[1080640807951929425])
     async def management(self, interaction: ApplicationCommandInteraction):
@@ -51,53 +96,36 @@ class Management(commands.Cog):
         interaction: Interaction given from disnake
         """
 
-        cog: Cog | None = None
         await interaction.response.send_message(
             f'Attempting to reload module `{module}`',
             ephemeral=ephemeral)
         try:
-            cog = self.bot.remove_cog(module)
-        except Exception as _:
-            _original_response = await interaction.original_response()
-            await _original_response.edit(
-                content=f'Unable to unload module: {module} \n'
-                        f'exception: ```py\n{format_exc()}```')
-        if cog is None:
-            _original_response = await interaction.original_response()
-            await _original_response.edit(
-                content=f'Module `{module}` not currently loaded. '
-                        f'Attempting to load!'
-            )
-
-        else:
-            _original_response = await interaction.original_response()
-            await _original_response.edit(
-                content=f'Module `{module}` successfully unloaded. '
-                        f'Attempting to reload!'
-            )
-
-        try:
-            importlib.invalidate_caches()
-            cog_module = importlib.import_module(
-                f'librarian.cogs.{module.lower()}')
-
-            cog_to_be_loaded: Cog = getattr(cog_module, module)(self.bot)
-            self.bot.add_cog(cog_to_be_loaded)
+            reload = await self.bot.reload_cog(
+                module, self.bot.config.get('reload_drain_timeout',
+                                            DEFAULT_DRAIN_TIMEOUT))
 
         except ModuleNotFoundError as _:
             _original_response = await interaction.original_response()
             return await _original_response.edit(
                 content=f'Unable to load module: `{module}`\n'
                         f'# That module does not exist!')
-        except KoorModuleLoadException as _:
+        except Exception as _:
             _original_response = await interaction.original_response()
             return await _original_response.edit(
-                content=f'Unable to load module: `{module}` \n'
+                content=f'Unable to reload module: `{module}` \n'
                         f'exception: ```py\n{format_exc()}```')
 
+        details = [f'{reload.drained} running commands drained']
+        if reload.running:
+            details.append(f'{reload.running} still running on the old '
+                           f'module')
+        if reload.warm:
+            details.append('state carried over')
         _original_response = await interaction.original_response()
         return await _original_response.edit(
-            content=f'Module `{module}` successfully reloaded.'
+            content=f'Module `{module}` successfully reloaded in '
+                    f'{reload.seconds * 1000:.0f}ms '
+                    f'({", ".join(details)}).'
         )
 
     @commands.check(_owner_check)
@@ -140,8 +168,8 @@ class Management(commands.Cog):
     async def module_autocomplete(self,
         _: ApplicationCommandInteraction,
         string: str):
-        return [_snake_case_to_camel_case(module) for module in self._modules if
-                string.lower() in module]
+        return [name for name in self.bot.registry.names
+                if string.lower() in name.lower()]
 
     @management.sub_command(name='version')
     async def management_version_stub(self,
@@ -213,7 +241,6 @@ class Management(commands.Cog):
         """
 
         loaded_modules = self.bot.loaded_cogs
-        total_modules = self._modules
         ping = self.bot.latency
 
         embed = Embed(
@@ -226,13 +253,20 @@ class Management(commands.Cog):
         embed.set_thumbnail(url=self.bot.user.display_avatar.url)
 
         embed.add_field('Ping', f'{int(ping * 1000)}ms', inline=False)
-
-        for total_module in total_modules:
+        if isinstance(self.bot, AutoShardedClient):
+            shards = [f'Shard {shard}: {int(latency * 1000)}ms'
+                      for shard, latency in self.bot.shard_latencies]
+            embed.add_field(f'Shards ({self.bot.instance})', _field(shards),
+                            inline=False)
+        _health_fields(embed, self.bot.health.health)
+
+        for entry in self.bot.registry.entries.values():
             loaded: bool = False
-            if _snake_case_to_camel_case(total_module) in loaded_modules:
+            if entry.name in loaded_modules:
                 loaded = True
-            embed.add_field(_snake_case_to_camel_case(total_module),
-                            'Loaded' if loaded else "Not Loaded", )
+            embed.add_field(entry.name,
+                            f'Loaded ({entry.timings()})' if loaded
+                            else 'Not Loaded')
 
         await interaction.response.send_message(embed=embed,
                                                 ephemeral=ephemeral)
@@ -253,7 +287,29 @@ class Management(commands.Cog):
 
         paste = self.bot.paste
         paste_url = await paste.paste(
-            json.dumps(self.bot.config.censored_copy(), indent=4,
+            self.bot.config.censored_json(indent=4, sort_keys=True),
+            TextTypes.JSON)
+        await interaction.response.send_message(
+            f'{paste_url}',
+            ephemeral=ephemeral
+        )
+
+    @commands.check(_owner_check)
+    @management.sub_command()
+    async def dump_status(self,
+        interaction: ApplicationCommandInteraction,
+        ephemeral: bool = True):
+        """
+        Dumps the latest sample of the bot's health
+
+        Parameters
+        ----------
+        ephemeral: Whether this message show to shown to all users.
+        interaction: Interaction given from disnake
+        """
+
+        paste_url = await self.bot.paste.paste(
+            json.dumps(self.bot.health.health.as_dict(), indent=4,
                        sort_keys=True),
             TextTypes.JSON)
         await interaction.response.send_message(
@@ -328,11 +384,61 @@ class Management(commands.Cog):
         interaction: Interaction given from disnake
         """
         self.logger.info('Saving running bot config to disk.')
-        self.bot.config.save()
+        await self.bot.config.save_async()
         self.bot.dispatch('config_saved')
         return await interaction.response.send_message('Config saved.',
                                                        ephemeral=ephemeral)
 
+    @commands.check(_owner_check)
+    @management.sub_command()
+    async def profile(self,
+        interaction: ApplicationCommandInteraction,
+        seconds: int = DEFAULT_PROFILE_SECONDS,
+        slow_callback_ms: int = int(DEFAULT_SLOW_CALLBACK * 1000),
+        ephemeral: bool = True):
+        """
+        Samples where the bot spends its time and pastes the stacks.
+
+        Parameters
+        ----------
+        seconds: How long to sample for, at most 300.
+        slow_callback_ms: Loop stalls longer than this are reported.
+        ephemeral: Whether this message show to shown to all users.
+        interaction: Interaction given from disnake
+        """
+        if self._profiling:
+            return await interaction.response.send_message(
+                'A profile is already running.', ephemeral=ephemeral)
+        seconds = min(max(seconds, 1), MAX_PROFILE_SECONDS)
+        await interaction.response.send_message(
+            f'Profiling for {seconds}s...', ephemeral=ephemeral)
+
+        profiler = SamplingProfiler(
+            self.bot.config.get('profile_interval', DEFAULT_PROFILE_INTERVAL),
+            max(slow_callback_ms, 1) / 1000)
+        self._profiling = True
+        try:
+            profile = await profiler.run(seconds)
+        finally:
+            self._profiling = False
+        self.logger.info(f'Profiled {profile.samples} samples, '
+                         f'{len(profile.stalls)} loop stalls')
+
+        summary = (f'{profile.samples} samples over {seconds}s, '
+                   f'{len(profile.stalls)} loop stalls over '
+                   f'{slow_callback_ms}ms')
+        if profile.stalls:
+            longest = max(stall.seconds for stall in profile.stalls)
+            summary += f' (longest {longest * 1000:.0f}ms)'
+        try:
+            paste_url = await self.bot.paste.paste(
+                await asyncio.to_thread(profile.collapsed), TextTypes.PLAIN)
+        except PasteFailedException as e:
+            return await interaction.edit_original_response(
+                content=f'{summary}.\nUnable to paste the profile: {e}')
+        return await interaction.edit_original_response(
+            content=f'{summary}: {paste_url}')
+
     @set_config.autocomplete('key')
     async def config_autocomplete(self,
         _: ApplicationCommandInteraction,
@@ -341,15 +447,6 @@ class Management(commands.Cog):
                 key[0] != '_' and string.lower() in key]
 
     @property
-    def _configuration_keys(self):
-        return [key for key in self.bot.config.censored_copy().keys()]
+    def _configuration_keys(self) -> tuple[str, ...]:
+        return self.bot.config.configuration_keys()
 
-    @property
-    def _modules(self) -> list[str]:
-        if datetime.now() < self._module_cache[1]:
-            self.logger.debug("Module Cache: HIT")
-            return self._module_cache[0]
-        self.logger.debug("Module Cache: MISS")
-        modules = [name for _, name, _ in iter_modules(['librarian/cogs'])]
-        self._module_cache = (modules, datetime.now() + timedelta(seconds=30))
-        return modules
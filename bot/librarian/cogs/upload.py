@@ -1,138 +1,817 @@
+import asyncio
 import logging
 import os
-from datetime import datetime, timedelta
-from typing import Any
+import shutil
+import tempfile
+import threading
+import time
+from datetime import UTC, datetime
+from pathlib import Path, PurePath
+from typing import Any, Callable, TYPE_CHECKING
 
 import aiohttp
-from disnake import ApplicationCommandInteraction, Attachment, Event
+from disnake import (ApplicationCommandInteraction, Attachment, Color, Embed,
+                     Event)
 from disnake.ext import commands
 
-from librarian.dependable.bot_overload import InteractionBot
+from librarian.dependable.bot_overload import LibrarianBot
+from librarian.dependable.cache import AsyncTTLCache
+from librarian.dependable.dedup import Deduplicator, HashIndex
+from librarian.dependable.download import (DEFAULT_RETRIES,
+                                           DEFAULT_SEGMENTED_THRESHOLD,
+                                           DEFAULT_SEGMENT_SIZE,
+                                           DEFAULT_SEGMENTS, Downloader)
+from librarian.dependable.files import (CommitHooks, DEFAULT_BUFFER_SIZE,
+                                        DEFAULT_QUEUE_DEPTH, HookChain,
+                                        extract_zip)
+from librarian.dependable.jobs import (BatchProgress,
+                                       DEFAULT_LIBRARY_LIMIT,
+                                       DEFAULT_PROGRESS_INTERVAL, Job,
+                                       JobQueue, JobState, JobStore,
+                                       ProgressReporter)
+from librarian.dependable.library_index import (DEFAULT_RECONCILE_INTERVAL,
+                                                DEFAULT_WALK_WORKERS,
+                                                LibraryIndex)
+from librarian.dependable.recompress import (DEFAULT_RECOMPRESS_FORMAT,
+                                             DEFAULT_RECOMPRESS_NICENESS,
+                                             DEFAULT_RECOMPRESS_QUALITY,
+                                             DEFAULT_RECOMPRESS_WORKERS,
+                                             available, lower_priority,
+                                             recompress)
+from librarian.dependable.scan import (DEFAULT_SCAN_MAX_FOLDERS,
+                                       DEFAULT_SCAN_WINDOW, ScanScheduler,
+                                       kavita_folder)
+from librarian.dependable.search import SearchIndex
+from librarian.dependable.validation import (DEFAULT_VALIDATION_TIMEOUT,
+                                             Validator)
+
+if TYPE_CHECKING:
+    from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_UPLOAD_CONCURRENCY = 3
+DEFAULT_VALIDATION_WORKERS = 2
+# Discord rejects messages longer than this.
+MESSAGE_LIMIT = 2000
+# Interaction tokens stop working after 15 minutes.
+INTERACTION_TOKEN_TTL = 15 * 60
+
+# A stored file, the error it failed with and what validation found out.
+Result = tuple[str, Exception | None, str | None]
+# Warm resources a reloaded Upload cog takes over from its predecessor.
+_HANDED_OVER = ('http_session', 'hash_index', '_backfill_task',
+                'scan_scheduler', 'jobs', '_library_cache', '_series_cache',
+                '_library_index', '_series_indexes', '_library_folders',
+                '_kavita_responses', 'local_index', '_validation_pool',
+                '_recompress_pool')
+
+
+def _target_name(filename: str, file_extension_override: bool) -> str:
+    if file_extension_override:
+        tmp_name = filename.split('.')
+        tmp_name.pop()
+        filename = '.'.join(tmp_name)
+    return filename
+
+
+def _folder_name(name: str, kind: str) -> str:
+    """name, if it is a single folder name and cannot leave its parent."""
+    if name in ('', '.', '..') or PurePath(name).name != name:
+        raise ValueError(f'`{name}` is not a valid {kind} name')
+    return name
+
+
+def _reason(error: Exception) -> str:
+    if isinstance(error, FileExistsError):
+        return 'already exists'
+    return str(error) or type(error).__name__
+
+
+def _same(previous: list, pages: list) -> bool:
+    """Whether Kavita answered with the very pages it sent last time."""
+    return len(previous) == len(pages) and all(
+        old is new for old, new in zip(previous, pages))
+
+
+def _note(summary: str | None, saved: int | None) -> str | None:
+    parts = [summary] if summary else []
+    if saved:
+        parts.append(f'saved {saved / 1e6:.1f} MB')
+    return ', '.join(parts) or None
+
+
+def _process_pool(workers: int, initializer: Callable | None = None,
+    initargs: tuple = ()) -> 'ProcessPoolExecutor':
+    # Imported on first use, keeping multiprocessing out of start up.
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(
+        workers, mp_context=multiprocessing.get_context('spawn'),
+        initializer=initializer, initargs=initargs)
+
+
+def _terminate_pool(pool: 'ProcessPoolExecutor'):
+    """Stops a pool without waiting for the work its processes hold."""
+    # The executor offers no way to stop a running task but killing its
+    # process.
+    processes = getattr(pool, '_processes', None) or {}
+    for process in list(processes.values()):
+        process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _batch_summary(library: str, series: str, results: list[Result]) -> str:
+    failures = [(name, error) for name, error, _ in results
+                if error is not None]
+    lines = [f'Uploaded {len(results) - len(failures)}/{len(results)} files '
+             f'to `{library}`/`{series}`.']
+    for name, error in failures:
+        lines.append(f'- `{name}`: {_reason(error)}')
+    for name, error, note in results:
+        if error is None and note is not None:
+            lines.append(f'- `{name}`: {note}')
+
+    content = '\n'.join(lines)
+    if len(content) > MESSAGE_LIMIT:
+        content = content[:MESSAGE_LIMIT - 4].rsplit('\n', 1)[0] + '\n...'
+    return content
 
 
 class Upload(commands.Cog):
-    def __init__(self, bot: InteractionBot):
+    def __init__(self, bot: LibrarianBot):
         self.logger = logging.getLogger(__name__)
-        self._library_cache: tuple[dict[str, int], datetime] = ({},
-                                                                datetime.min)
-        self._series_cache: tuple[list[str], datetime] = ([], datetime.min)
+        self._library_cache: AsyncTTLCache[dict[str, int]] = AsyncTTLCache(
+            'libraries', self._fetch_libraries, ttl=30)
+        self._series_cache: AsyncTTLCache[list[str]] = AsyncTTLCache(
+            'series', self._fetch_series, ttl=30)
+        self._library_index = SearchIndex()
+        self._series_indexes: dict[int, SearchIndex] = {}
         self.bot = bot
         self.http_session: aiohttp.ClientSession | None = None
+        self.hash_index = HashIndex(
+            Path(os.environ.get('CONFIG_DIR', '.')) / 'hashes.sqlite3')
+        self._backfill_task: asyncio.Task | None = None
+        self._library_folders: dict[int, list[str]] = {}
+        # Per fetch, the Kavita response it was built from and the result.
+        # Kavita hands back the same objects while nothing changed.
+        self._kavita_responses: dict[Any, tuple[Any, Any]] = {}
+        self.scan_scheduler = ScanScheduler(
+            self.bot.kavita,
+            window=self.bot.config.get('kavita_scan_debounce',
+                                       DEFAULT_SCAN_WINDOW),
+            max_folders=self.bot.config.get('kavita_scan_max_folders',
+                                            DEFAULT_SCAN_MAX_FOLDERS))
+        self.jobs = JobQueue(
+            JobStore(Path(os.environ.get('CONFIG_DIR', '.')) / 'jobs.sqlite3',
+                     owner=self.bot.instance),
+            self._run_job,
+            workers=self.bot.config.get('upload_concurrency',
+                                        DEFAULT_UPLOAD_CONCURRENCY),
+            library_limit=self.bot.config.get('upload_library_concurrency',
+                                              DEFAULT_LIBRARY_LIMIT))
+        self.local_index = LibraryIndex(
+            self._libraries_root,
+            reconcile_interval=self.bot.config.get(
+                'library_index_reconcile_interval',
+                DEFAULT_RECONCILE_INTERVAL),
+            workers=self.bot.config.get('library_index_workers',
+                                        DEFAULT_WALK_WORKERS))
+        # Created on first use, validation and re-encoding run in separate
+        # processes.
+        self._validation_pool: 'ProcessPoolExecutor | None' = None
+        self._recompress_pool: 'ProcessPoolExecutor | None' = None
+        # Validators replace the pool from worker threads.
+        self._validation_lock = threading.Lock()
+        self._handed_over = False
+        self._closing: asyncio.Task | None = None
+
+        metrics = self.bot.metrics
+        self._collectors = [metrics.track_cache(self._library_cache),
+                            metrics.track_cache(self._series_cache)]
+        self._upload_bytes = metrics.counter(
+            'upload_bytes_total', 'Bytes downloaded from attachments.',
+            ('library',))
+        self._upload_jobs = metrics.counter(
+            'upload_jobs_total', 'Finished upload jobs by outcome.',
+            ('state',))
+        self._recompress_saved = metrics.counter(
+            'recompress_saved_bytes_total',
+            'Bytes saved by re-encoding archive pages.', ('library',))
+
+    async def cog_load(self):
+        health = self.bot.health
+        health.track_session('cdn', lambda: self.http_session)
+        health.track_disk('libraries', self._library_directories)
+        health.track_rate('upload_bytes', self._upload_bytes)
+        health.track_rate('upload_jobs', self._upload_jobs)
+        # A cog loaded into a running bot never sees the ready event.
+        if self.bot.is_ready():
+            await self.on_ready()
+
+    def cog_unload(self):
+        for collector in self._collectors:
+            self.bot.metrics.remove_collector(collector)
+        for name in ('cdn', 'libraries', 'upload_bytes', 'upload_jobs'):
+            self.bot.health.untrack(name)
+        if not self._handed_over and self._closing is None:
+            self._closing = asyncio.create_task(self.close())
+
+    async def close(self):
+        """Stops the job queue and closes every resource of the cog."""
+        for pool in (self._validation_pool, self._recompress_pool):
+            if pool is not None:
+                pool.shutdown(wait=False, cancel_futures=True)
+        self._validation_pool = self._recompress_pool = None
+        if self._backfill_task is not None:
+            self._backfill_task.cancel()
+        await self.jobs.close()
+        await self.scan_scheduler.close()
+        await self.local_index.close()
+        if self.http_session is not None:
+            await self.http_session.close()
+            self.http_session = None
+        await asyncio.to_thread(self.jobs.store.close)
+        await asyncio.to_thread(self.hash_index.close)
+
+    def export_state(self) -> dict[str, Any]:
+        """
+        Hands the warm resources to the cog replacing this one. In-flight
+        handlers of this cog keep using them, but cog_unload no longer
+        closes them.
+        """
+        self._handed_over = True
+        return {name: getattr(self, name) for name in _HANDED_OVER}
+
+    def import_state(self, state: dict[str, Any]):
+        """Takes over the resources exported by a previous instance."""
+        for name, value in state.items():
+            if name in _HANDED_OVER:
+                setattr(self, name, value)
+        self._library_cache.fetch = self._fetch_libraries
+        self._series_cache.fetch = self._fetch_series
+        self.jobs.handler = self._run_job
+        metrics = self.bot.metrics
+        for collector in self._collectors:
+            metrics.remove_collector(collector)
+        self._collectors = [metrics.track_cache(self._library_cache),
+                            metrics.track_cache(self._series_cache)]
+        self._handed_over = False
+
+    def _session(self, user_agent: str | None) -> aiohttp.ClientSession:
+        return aiohttp.ClientSession(
+            headers={'User-Agent': user_agent},
+            trace_configs=[self.bot.metrics.trace_config('cdn',
+                                                         by_path=False)]
+        )
 
     @commands.Cog.listener(Event.ready)
     async def on_ready(self):
-        self.http_session = aiohttp.ClientSession(
-            headers={'User-Agent': self.bot.user_agent}
-        )
+        if self.http_session is None:
+            self.http_session = self._session(self.bot.user_agent)
+        if self._backfill_task is None:
+            self._backfill_task = asyncio.create_task(self._backfill())
+        if self.bot.config.get('library_index_enabled', True):
+            self.local_index.start()
+        if not self.jobs.started:
+            for job, future in await self.jobs.start():
+                future.add_done_callback(
+                    lambda done, job=job: asyncio.create_task(
+                        self._report_recovered(job, done)))
+
+    @commands.Cog.listener()
+    async def on_configuration_set(self, key: str, value):
+        if key == 'user_agent' and self.http_session is not None:
+            session, self.http_session = self.http_session, \
+                self._session(value)
+            # Running downloads still hold the old session.
+            await self.jobs.idle()
+            await session.close()
+        elif key in ('kavita_base_url', 'kavita_api_key'):
+            self._library_cache.invalidate()
+            self._series_cache.invalidate()
+            self._library_index = SearchIndex()
+            self._series_indexes.clear()
+            self._library_folders.clear()
+            self._kavita_responses.clear()
+        elif key == 'kavita_scan_debounce':
+            self.scan_scheduler.window = value or DEFAULT_SCAN_WINDOW
+            self.scan_scheduler.max_wait = self.scan_scheduler.window * 4
+        elif key == 'kavita_scan_max_folders':
+            self.scan_scheduler.max_folders = \
+                value or DEFAULT_SCAN_MAX_FOLDERS
+        elif key == 'validation_workers' and \
+                self._validation_pool is not None:
+            # Validations already running finish in the old pool.
+            self._validation_pool.shutdown(wait=False)
+            self._validation_pool = None
+        elif key in ('recompress_workers', 'recompress_niceness') and \
+                self._recompress_pool is not None:
+            self._recompress_pool.shutdown(wait=False)
+            self._recompress_pool = None
+
+    async def _report_recovered(self, job: Job, future: asyncio.Future):
+        if future.cancelled():
+            return
+        error = future.exception()
+        results = [(job.filename, error, None)] if error \
+            else future.result()
+        self.logger.info(f'Recovered upload job {job.id} finished: '
+                         f'{_batch_summary(job.library, job.series, results)}')
+        if job.token is None or \
+                time.time() - job.created > INTERACTION_TOKEN_TTL:
+            return
+        try:
+            await self.bot.http.edit_original_interaction_response(
+                job.application_id, job.token,
+                content=_batch_summary(job.library, job.series, results))
+        except Exception as e:
+            self.logger.warning(f'Could not report recovered upload job '
+                                f'{job.id}: {e!r}')
+
+    async def _backfill(self):
+        if await asyncio.to_thread(self.hash_index.backfilled):
+            return
+        self.logger.info(f'Backfilling hash index from {self._libraries_root}')
+        await asyncio.to_thread(
+            self.hash_index.backfill, self._libraries_root,
+            self.bot.config.get('dedup_backfill_workers', 4))
 
     @commands.slash_command()
-    async def upload(self, file: Attachment, library: str,
+    async def upload(self, interaction: ApplicationCommandInteraction):
+        pass
+
+    @upload.sub_command(name='file')
+    async def upload_file(self,
         interaction: ApplicationCommandInteraction,
+        file: Attachment,
+        library: str,
         series: str = "Unknown",
-        file_extension_override: bool = False
-    ):
-        filename = file.filename
+        file_extension_override: bool = False):
+        """
+        Upload a file into a library.
 
+        Parameters
+        ----------
+        file: The file to upload
+        library: The library to upload into
+        series: The series folder the file is stored in
+        file_extension_override: Whether to strip the file extension
+        interaction: Interaction given from disnake
+        """
         await interaction.response.defer()
-        file_content = (await self.http_session.request(
-            'GET', file.url,
-            allow_redirects=True,
-            headers={
-                'User-Agent': self.bot.user_agent})).content
-
-        print(await self._libraries)
-        if file_extension_override:
-            tmp_name = filename.split('.')
-            tmp_name.pop()
-            filename = '.'.join(tmp_name)
-
-        if library not in (await self._libraries).keys():
+
+        filename = _target_name(file.filename, file_extension_override)
+
+        if not await self._library_exists(library):
             return await interaction.edit_original_response(
                 content=f"Library `{library}` not found.")
         try:
-            os.makedirs(f'/libraries/{library.lower()}/{series}',
-                        exist_ok=True)
-            with open(
-                f'/libraries/{library.lower()}/{series}/{filename}',
-                'xb') as f:
-                async for b, _ in file_content.iter_chunks():
-                    f.write(b)
+            directory = await self._series_directory(library, series)
+            if self.local_index.exists(directory.parent.name, directory.name,
+                                       filename):
+                raise FileExistsError('already exists')
+            job = self._job(interaction, library, series, directory, file,
+                            filename, extract=False)
+            reporter = self._reporter(interaction)
+            future = await self.jobs.submit(
+                job, BatchProgress(reporter, [job]).add)
 
         except Exception as e:
             return await interaction.edit_original_response(
                 content=f"Error uploading {filename}: {e}")
-        return await interaction.edit_original_response(
-            content=f"Successfully uploaded `{filename}` to {library}.")
+        try:
+            _, _, note = (await future)[0]
+        except Exception as e:
+            return await reporter.finish(f"Error uploading {filename}: {e}")
+        if self.local_index.ready:
+            count = self.local_index.count(directory.parent.name,
+                                           directory.name)
+            note = ', '.join(filter(None, (
+                note, f'{count} files in `{series}`')))
+        return await reporter.finish(
+            f"Successfully uploaded `{filename}` to {library}."
+            + (f" ({note})" if note else ""))
+
+    @upload.sub_command()
+    async def batch(self,
+        interaction: ApplicationCommandInteraction,
+        library: str,
+        file: Attachment,
+        series: str = "Unknown",
+        file_2: Attachment | None = None,
+        file_3: Attachment | None = None,
+        file_4: Attachment | None = None,
+        file_5: Attachment | None = None,
+        file_6: Attachment | None = None,
+        file_7: Attachment | None = None,
+        file_8: Attachment | None = None,
+        file_9: Attachment | None = None,
+        file_10: Attachment | None = None,
+        extract_archives: bool = True,
+        file_extension_override: bool = False):
+        """
+        Upload several files, or zip archives of files, into a library.
+
+        Parameters
+        ----------
+        library: The library to upload into
+        file: A file to upload
+        series: The series folder the files are stored in
+        file_2: Another file to upload
+        file_3: Another file to upload
+        file_4: Another file to upload
+        file_5: Another file to upload
+        file_6: Another file to upload
+        file_7: Another file to upload
+        file_8: Another file to upload
+        file_9: Another file to upload
+        file_10: Another file to upload
+        extract_archives: Whether zip files are extracted into the series
+        file_extension_override: Whether to strip the file extensions
+        interaction: Interaction given from disnake
+        """
+        await interaction.response.defer()
 
-    @upload.autocomplete('library')
+        if not await self._library_exists(library):
+            return await interaction.edit_original_response(
+                content=f"Library `{library}` not found.")
+        try:
+            directory = await self._series_directory(library, series)
+        except Exception as e:
+            return await interaction.edit_original_response(
+                content=f"Error creating series `{series}`: {e}")
+
+        attachments = [attachment for attachment in (
+            file, file_2, file_3, file_4, file_5,
+            file_6, file_7, file_8, file_9, file_10
+        ) if attachment is not None]
+        jobs = []
+        results = []
+        for attachment in attachments:
+            extract = extract_archives and \
+                attachment.filename.lower().endswith('.zip')
+            filename = attachment.filename if extract else \
+                _target_name(attachment.filename, file_extension_override)
+            if not extract and self.local_index.exists(
+                    directory.parent.name, directory.name, filename):
+                results.append((filename, FileExistsError(filename), None))
+                continue
+            jobs.append(self._job(
+                interaction, library, series, directory, attachment,
+                filename, extract))
+
+        reporter = self._reporter(interaction)
+        progress = BatchProgress(reporter, jobs)
+        futures = []
+        for job in jobs:
+            future = await self.jobs.submit(job, progress.add)
+            future.add_done_callback(progress.done)
+            futures.append(future)
+
+        for job, outcome in zip(jobs, await asyncio.gather(
+                *futures, return_exceptions=True)):
+            if isinstance(outcome, Exception):
+                results.append((job.filename, outcome, None))
+            else:
+                results.extend(outcome)
+        return await reporter.finish(_batch_summary(library, series, results))
+
+    @upload.sub_command()
+    async def queue(self,
+        interaction: ApplicationCommandInteraction,
+        ephemeral: bool = True):
+        """
+        Shows pending, running and recently finished uploads.
+
+        Parameters
+        ----------
+        ephemeral: Whether this message show to shown to all users.
+        interaction: Interaction given from disnake
+        """
+        listing = await asyncio.to_thread(self.jobs.store.listing)
+
+        embed = Embed(
+            title='Upload queue',
+            timestamp=datetime.now(UTC),
+            color=Color.purple(),
+        )
+        for state in JobState:
+            lines = [f'`{job.filename}` → `{job.library}`/`{job.series}`'
+                     + (f': {job.error}' if job.error else '')
+                     for job in listing[state]]
+            value = '\n'.join(lines) or 'None'
+            if len(value) > 1024:
+                value = value[:1020].rsplit('\n', 1)[0] + '\n...'
+            embed.add_field(state.value.capitalize(), value, inline=False)
+
+        await interaction.response.send_message(embed=embed,
+                                                ephemeral=ephemeral)
+
+    async def _series_directory(self, library: str, series: str) -> Path:
+        root = self._libraries_root
+        directory = root / _folder_name(library.lower(), 'library') \
+            / _folder_name(series, 'series')
+
+        def create():
+            # A symlink in the way must not lead the upload elsewhere either.
+            if not directory.resolve().is_relative_to(root.resolve()):
+                raise ValueError(f'`{series}` is outside of the libraries')
+            os.makedirs(directory, exist_ok=True)
+        await asyncio.to_thread(create)
+        return directory
+
+    def _schedule_scan(self, library: str, directory: Path):
+        if not self.bot.config.get('kavita_scan_enabled', True):
+            return
+        library_id = self._library_cache.peek(default={}).get(library)
+        if library_id is None:
+            return
+        self.scan_scheduler.touch(library_id, kavita_folder(
+            self._library_folders.get(library_id, []),
+            directory.parent.name, directory.name))
+
+    def _job(self, interaction: ApplicationCommandInteraction, library: str,
+        series: str, directory: Path, file: Attachment, filename: str,
+        extract: bool) -> Job:
+        return Job(library=library, series=series,
+                   directory=str(directory), filename=filename,
+                   url=file.url, size=file.size, extract=extract,
+                   application_id=interaction.application_id,
+                   token=interaction.token)
+
+    def _reporter(self, interaction: ApplicationCommandInteraction
+    ) -> ProgressReporter:
+        async def edit(content: str):
+            await interaction.edit_original_response(content=content)
+
+        return ProgressReporter(edit, self.bot.config.get(
+            'upload_progress_interval', DEFAULT_PROGRESS_INTERVAL))
+
+    async def _run_job(self, job: Job,
+        progress: Callable[[int], None] | None) -> list[Result]:
+        directory = Path(job.directory)
+        await asyncio.to_thread(os.makedirs, directory, exist_ok=True)
+
+        def received(size: int):
+            self._upload_bytes.inc(job.library, amount=size)
+            if progress is not None:
+                progress(size)
+
+        try:
+            results = await self._store_job(job, directory, received)
+        except Exception:
+            self._upload_jobs.inc(str(JobState.FAILED))
+            raise
+        self._upload_jobs.inc(str(JobState.FAILED if job.error
+                                  else JobState.DONE))
+        return results
+
+    async def _store_job(self, job: Job, directory: Path,
+        progress: Callable[[int], None]) -> list[Result]:
+        hooks, validator = self._hooks(directory)
+        if job.extract:
+            stored = await self._store_archive(job, directory, hooks,
+                                               progress)
+            failures = [f'{name}: {_reason(error)}'
+                        for name, error in stored if error is not None]
+            if failures:
+                job.error = '; '.join(failures)
+        else:
+            await self._download(job.url, directory / job.filename, job.size,
+                                 hooks, progress)
+            stored = [(job.filename, None)]
+        saved = await self._recompress(job, directory, stored)
+        results = [(name, error, _note(validator and validator.summary(name),
+                                       saved.get(name)))
+                   for name, error in stored]
+        for name, error in stored:
+            if error is None:
+                self.local_index.record(directory.parent.name,
+                                        directory.name, name)
+        if any(error is None for _, error in stored):
+            self._schedule_scan(job.library, directory)
+        return results
+
+    def _hooks(self, directory: Path
+    ) -> tuple[CommitHooks, Validator | None]:
+        deduplicator = self._deduplicator(directory)
+        config = self.bot.config
+        if not config.get('validation_enabled', True):
+            return deduplicator, None
+        validator = Validator(self._validation_executor(),
+                              self._libraries_root,
+                              directory.parent.name, directory.name,
+                              config.get('validation_timeout',
+                                         DEFAULT_VALIDATION_TIMEOUT),
+                              self._recycle_validation_pool)
+        return HookChain(validator, deduplicator), validator
+
+    def _validation_executor(self) -> 'ProcessPoolExecutor':
+        with self._validation_lock:
+            if self._validation_pool is None:
+                self._validation_pool = _process_pool(self.bot.config.get(
+                    'validation_workers', DEFAULT_VALIDATION_WORKERS))
+            return self._validation_pool
+
+    def _recycle_validation_pool(self, pool: 'ProcessPoolExecutor'
+    ) -> 'ProcessPoolExecutor':
+        """
+        Replaces a pool a check timed out in. Called from worker threads;
+        pools already replaced are only stopped.
+        """
+        with self._validation_lock:
+            if self._validation_pool is pool:
+                self.logger.warning('Validation timed out, restarting the '
+                                    'validation workers')
+                self._validation_pool = None
+        _terminate_pool(pool)
+        return self._validation_executor()
+
+    async def _recompress(self, job: Job, directory: Path,
+        stored: list[tuple[str, Exception | None]]) -> dict[str, int]:
+        """
+        Re-encodes the pages of stored comic archives for libraries listed
+        in recompress_libraries, and returns the bytes saved per file.
+        """
+        settings = self.bot.config.get('recompress_libraries', {}).get(
+            job.library)
+        names = [name for name, error in stored if error is None
+                 and name.lower().endswith('.cbz')]
+        if settings is None or not names:
+            return {}
+        if not available():
+            self.logger.warning(f'Not re-encoding uploads to {job.library}, '
+                                f'Pillow is not installed')
+            return {}
+
+        config = self.bot.config
+        if self._recompress_pool is None:
+            self._recompress_pool = _process_pool(
+                config.get('recompress_workers', DEFAULT_RECOMPRESS_WORKERS),
+                lower_priority, (config.get('recompress_niceness',
+                                            DEFAULT_RECOMPRESS_NICENESS),))
+        image_format = settings.get('format', config.get(
+            'recompress_format', DEFAULT_RECOMPRESS_FORMAT))
+        quality = settings.get('quality', config.get(
+            'recompress_quality', DEFAULT_RECOMPRESS_QUALITY))
+        loop = asyncio.get_running_loop()
+        saved = {}
+        for name in names:
+            path = directory / name
+            try:
+                # Hard links are duplicates sharing content with another
+                # file, which would no longer be shared after repacking.
+                if (await asyncio.to_thread(os.stat, path)).st_nlink > 1:
+                    continue
+                digest = await asyncio.to_thread(self.hash_index.digest, path)
+                result = await loop.run_in_executor(
+                    self._recompress_pool, recompress, path, image_format,
+                    quality)
+                if result.saved and digest is not None:
+                    # Uploads of the original content still find this file.
+                    await asyncio.to_thread(self.hash_index.record, path,
+                                            digest, directory.parent.name,
+                                            directory.name)
+            except Exception as e:
+                self.logger.warning(f'Could not re-encode {path}: {e!r}')
+                continue
+            self.logger.info(f'Re-encoded {result.pages} pages of {path}, '
+                             f'saving {result.saved} bytes')
+            self._recompress_saved.inc(job.library, amount=result.saved)
+            saved[name] = result.saved
+        return saved
+
+    def _deduplicator(self, directory: Path) -> Deduplicator:
+        return Deduplicator(self.hash_index,
+                            self.bot.config.get('dedup_mode', 'reject'),
+                            directory.parent.name, directory.name)
+
+    async def _download(self, url: str, destination: Path,
+        size: int | None = None,
+        hooks: CommitHooks | None = None,
+        progress: Callable[[int], None] | None = None) -> Path:
+        config = self.bot.config
+        downloader = Downloader(
+            self.http_session,
+            segment_size=config.get('download_segment_size',
+                                    DEFAULT_SEGMENT_SIZE),
+            segments=config.get('download_segments', DEFAULT_SEGMENTS),
+            retries=config.get('download_retries', DEFAULT_RETRIES),
+            segmented_threshold=config.get('download_segmented_threshold',
+                                           DEFAULT_SEGMENTED_THRESHOLD),
+            buffer_size=self._buffer_size,
+            queue_depth=config.get('upload_queue_depth',
+                                   DEFAULT_QUEUE_DEPTH),
+            headers={'User-Agent': self.bot.user_agent})
+        return await downloader.download(url, destination, size, hooks,
+                                         progress)
+
+    async def _store_archive(self, job: Job, directory: Path,
+        hooks: CommitHooks, progress: Callable[[int], None] | None
+    ) -> list[tuple[str, Exception | None]]:
+        # The archive itself is only staged in a hidden directory, which
+        # Kavita skips while scanning.
+        staging = Path(await asyncio.to_thread(
+            tempfile.mkdtemp, prefix='.librarian-', dir=directory))
+        try:
+            archive = await self._download(job.url, staging / job.filename,
+                                           job.size, progress=progress)
+            return await asyncio.to_thread(extract_zip, archive, directory,
+                                           self._buffer_size, hooks)
+        finally:
+            await asyncio.to_thread(shutil.rmtree, staging,
+                                    ignore_errors=True)
+
+    @property
+    def _libraries_root(self) -> Path:
+        return Path(self.bot.config.get('libraries_root', '/libraries'))
+
+    @property
+    def _buffer_size(self) -> int:
+        return self.bot.config.get('upload_buffer_size', DEFAULT_BUFFER_SIZE)
+
+    @upload_file.autocomplete('library')
+    @batch.autocomplete('library')
     async def library_autocomplete(self,
         _: ApplicationCommandInteraction,
         string: str):
-        return [_ for _ in (await self._libraries).keys() if
-                string.lower() in _.lower()]
+        await self._library_cache.get(deadline=self._autocomplete_deadline,
+                                      default={})
+        return self._library_index.search(string)
 
-    @upload.autocomplete('series')
+    @upload_file.autocomplete('series')
+    @batch.autocomplete('series')
     async def series_autocomplete(
         self,
-        _: ApplicationCommandInteraction
+        interaction: ApplicationCommandInteraction
         , string: str):
-        return [_ for _ in (await self._series) if string.lower() in _.lower()]
+        library = interaction.filled_options.get('library')
+        # Series folders on disk are what uploads land in, and reading them
+        # does not depend on Kavita.
+        if library is not None and library.lower() in self.local_index:
+            return self.local_index.search_series(library.lower(), string)
+        libraries = await self._library_cache.get(
+            deadline=self._autocomplete_deadline, default={})
+        library_id = libraries.get(library)
+        if library_id is None:
+            return []
+        await self._series_cache.get(library_id,
+                                     deadline=self._autocomplete_deadline,
+                                     default=[])
+        index = self._series_indexes.get(library_id)
+        return [] if index is None else index.search(string)
 
     @property
-    async def _series(self) -> list[str]:
-        if datetime.now() < self._series_cache[1]:
-            self.logger.debug("Module Cache: HIT")
-            return self._series_cache[0]
-        self.logger.debug("Module Cache: MISS")
-        known_series_req = await self.http_session.request(
-            'POST',
-            f'{self.bot.config.get("kavita_base_url")}/api/Library/series',
-            headers={'Authorization': f'Bearer {await self.get_jwt()}'})
-        known_series_req.raise_for_status()
-        series_data: list[dict[str, Any]] = await known_series_req.json()
-        series_available: list[str] = []
-        for series in series_data:
-            series_available.append(series['name'])
-
-        self._series_cache = (series_available,
-                              datetime.now() + timedelta(seconds=30))
+    def _autocomplete_deadline(self) -> float:
+        return self.bot.config.get('autocomplete_deadline', 2.0)
+
+    async def _fetch_series(self, library_id: int) -> list[str]:
+        pages = [page async for page
+                 in self.bot.kavita.iter_series(library_id)]
+        previous = self._kavita_responses.get(library_id)
+        if previous is not None and _same(previous[0], pages):
+            return previous[1]
+        series_available = [series['name'] for page in pages
+                            for series in page]
+        # Building takes long enough for a large library to stall the
+        # gateway, so it happens in a thread and only the swap is on the loop.
+        self._series_indexes[library_id] = await asyncio.to_thread(
+            SearchIndex, series_available)
+        self._kavita_responses[library_id] = (pages, series_available)
         return series_available
 
     @property
     async def _libraries(self) -> dict[str, int]:
-        if datetime.now() < self._library_cache[1]:
-            self.logger.debug("Module Cache: HIT")
-            return self._library_cache[0]
-        self.logger.debug("Module Cache: MISS")
-        libraries = {}
+        return await self._library_cache.get()
 
-        libraries_response = await self.http_session.request(
-            'GET',
-            f'{self.bot.config.get('kavita_base_url')}/api/Library/libraries',
-            headers={'Authorization': f'Bearer {await self.get_jwt()}'}
+    def _library_directories(self) -> dict[str, Path]:
+        if not self.local_index.ready:
+            return {'libraries': self._libraries_root}
+        return {library: self._libraries_root / library
+                for library in self.local_index.libraries()}
 
-        )
-        libraries_available: list[
-            dict[str, Any]] = await libraries_response.json()
+    async def _library_exists(self, library: str) -> bool:
+        try:
+            return library in await self._libraries
+        except Exception as e:
+            if library.lower() not in self.local_index:
+                raise
+            self.logger.warning(f'Could not fetch libraries from Kavita '
+                                f'({e!r}), trusting the library folder')
+            return True
+
+    async def _fetch_libraries(self) -> dict[str, int]:
+        libraries = {}
+
+        libraries_available = await self.bot.kavita.libraries()
+        previous = self._kavita_responses.get('libraries')
+        if previous is not None and previous[0] is libraries_available:
+            return previous[1]
 
         for library in libraries_available:
             libraries[library['name']] = library['id']
-        self._library_cache = (libraries,
-                               datetime.now() + timedelta(seconds=30))
+            self._library_folders[library['id']] = library.get('folders', [])
+        self._library_index = await asyncio.to_thread(SearchIndex,
+                                                      list(libraries))
+        self._kavita_responses['libraries'] = (libraries_available, libraries)
         return libraries
-
-    async def get_jwt(self):
-        key = self.bot.config.get('kavita_api_key')
-        if self.http_session is None:
-            raise RuntimeError("HTTP Session not initialized.")
-        async with self.http_session.request(
-            'POST',
-            f'{self.bot.config.get('kavita_base_url')}/api/Plugin/authenticate',
-            params={
-                'apiKey': key,
-                'pluginName': 'librarian'
-            }) as resp:
-            resp.raise_for_status()
-            token = (await resp.json())
-            print(token)
-            return token['token']
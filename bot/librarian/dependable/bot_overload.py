@@ -1,27 +1,132 @@
-from typing import Optional
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
 
 import disnake
 import disnake.ext.commands as dc
-from disnake import ClientException
+from disnake import (ApplicationCommandInteraction, ClientException,
+                     OptionType)
 from disnake.ext.commands import CommandError, Cog
 
 from librarian.dependable.configuration import Configuration
+from librarian.dependable.health import (DEFAULT_STATUS_INTERVAL,
+                                         DEFAULT_STATUS_WINDOW,
+                                         HealthSampler)
+from librarian.dependable.kavita import Kavita
+from librarian.dependable.metrics import (DEFAULT_LOOP_LAG_INTERVAL,
+                                          DEFAULT_METRICS_HOST,
+                                          LoopLagMonitor, MetricsServer,
+                                          Registry)
 from librarian.dependable.paste import Paste
+from librarian.dependable.registry import CogRegistry
 
+_SUB_COMMANDS = (OptionType.sub_command, OptionType.sub_command_group)
+DEFAULT_DRAIN_TIMEOUT = 30.0
 
-class InteractionBot(dc.InteractionBot):
+
+@dataclass
+class Reload:
+    """What reloading a cog took."""
+    seconds: float
+    drained: int
+    # Handlers that outlived the drain timeout and run on with the old cog.
+    running: int
+    warm: bool
+
+
+def _command_name(interaction: ApplicationCommandInteraction) -> str:
+    """The full name of the invoked command, including subcommands."""
+    names = [interaction.data.name]
+    options = interaction.data.options
+    while options and options[0].type in _SUB_COMMANDS:
+        names.append(options[0].name)
+        options = options[0].options
+    return ' '.join(names)
+
+
+class LibrarianBot:
+    """
+    Everything the bot adds to disnake, shared by the single connection
+    InteractionBot and the AutoShardedInteractionBot.
+
+    instance names the process in stores shared with other processes, and
+    process numbers it, e.g. to offset the metrics port.
+    """
     version: str | None = None
     user_agent: str | None = None
 
-    def __init__(self, config: Configuration, *args, **kwargs):
+    def __init__(self, config: Configuration, *args,
+        instance: str = 'main', process: int = 0, **kwargs):
         self._loaded_cogs: list[str] = []
         self.config: Configuration = config
+        self.config.bind(self)
+        self.logger = logging.getLogger(__name__)
+        self.instance = instance
+        self.process = process
+        # Per cog, the command handlers currently running.
+        self._in_flight: dict[str, set[asyncio.Task]] = {}
+        self._draining: set[str] = set()
+
+        self.registry = CogRegistry(self)
+        self.metrics = Registry()
+        self._command_latency = self.metrics.histogram(
+            'command_duration_seconds',
+            'Time spent handling application commands.', ('command',))
+        self._autocomplete_latency = self.metrics.histogram(
+            'autocomplete_duration_seconds',
+            'Time spent answering autocompletion.', ('command', 'option'))
+        self._command_errors = self.metrics.counter(
+            'command_errors_total', 'Application commands that raised.',
+            ('command', 'error'))
+        self._autocomplete_errors = self.metrics.counter(
+            'autocomplete_errors_total', 'Autocompletions that raised.',
+            ('command', 'option', 'error'))
+        self._metrics_server: MetricsServer | None = None
+        lag_interval = self.config.get('metrics_loop_lag_interval',
+                                       DEFAULT_LOOP_LAG_INTERVAL)
+        status_window = self.config.get('status_window',
+                                        DEFAULT_STATUS_WINDOW)
+        self._loop_lag = LoopLagMonitor(
+            self.metrics, lag_interval,
+            max(int(status_window / lag_interval), 1))
+        self.health = HealthSampler(
+            self._loop_lag, self.config.get('status_sample_interval',
+                                            DEFAULT_STATUS_INTERVAL),
+            status_window)
+        gateway_latency = self.metrics.gauge(
+            'gateway_latency_seconds', 'Heartbeat latency per shard.',
+            ('shard',))
+
+        def collect_latencies():
+            for shard, latency in self.shard_latencies:
+                gateway_latency.set(str(shard), value=latency)
+
+        self.metrics.add_collector(collect_latencies)
+        kavita_responses = self.metrics.counter(
+            'kavita_responses_total',
+            'Cached Kavita requests by whether the response changed.',
+            ('result',))
+
+        def collect_kavita_responses():
+            stats = self.kavita.response_stats
+            for result in ('not_modified', 'unchanged', 'changed'):
+                kavita_responses.set(result, value=getattr(stats, result))
+
+        self.metrics.add_collector(collect_kavita_responses)
 
         self.paste = Paste(self.config, self.user_agent)
+        self.paste.trace_configs.append(self.metrics.trace_config('paste'))
+        self.kavita = Kavita(self.config, self.user_agent)
+        self.kavita.trace_configs.append(self.metrics.trace_config('kavita'))
+        self.health.track_session('kavita', lambda: self.kavita._session)
+        self.health.track_session('paste', lambda: self.paste.client)
 
         intents = disnake.Intents.default()
         super().__init__(*args, **kwargs, intents=intents)
         # self.add_listener(self.on_ready, Event.ready)
+        self.add_listener(self._on_configuration_set, 'on_configuration_set')
 
     async def connect(
         self, *, reconnect: bool = True,
@@ -30,11 +135,119 @@ class InteractionBot(dc.InteractionBot):
         self.user_agent = (
             self.config.get('user_agent'))
         self.paste.user_agent = self.user_agent
+        self.kavita.user_agent = self.user_agent
+        self.config.watch()
+        self._loop_lag.start()
+        self.health.start()
+        await self._start_metrics_server()
         await super().connect(
             reconnect=reconnect,
             ignore_session_start_limit=ignore_session_start_limit
         )
 
+    async def close(self) -> None:
+        self.config.unwatch()
+        await self._loop_lag.close()
+        await self.health.close()
+        await self._stop_metrics_server()
+        await asyncio.to_thread(self.config.flush)
+        await self.kavita.close()
+        await self.paste.close()
+        await super().close()
+
+    async def _on_configuration_set(self, key: str, value: Any):
+        if key == 'user_agent' and value != self.user_agent:
+            self.user_agent = value
+            self.paste.user_agent = value
+            self.kavita.user_agent = value
+            # The session is recreated with the new header on next use.
+            await self.kavita.close()
+        elif key in ('kavita_base_url', 'kavita_api_key'):
+            self.kavita.invalidate()
+            self.kavita.forget()
+        elif key in ('kavita_connection_limit', 'kavita_timeout'):
+            await self.kavita.close()
+        elif key in ('paste_api_url', 'paste_frontend_url'):
+            self.paste.forget()
+        elif key in ('paste_connection_limit', 'paste_timeout'):
+            await self.paste.close()
+        elif key in ('metrics_port', 'metrics_host'):
+            await self._stop_metrics_server()
+            await self._start_metrics_server()
+
+    async def _start_metrics_server(self):
+        port = self.config.get('metrics_port')
+        if port is None or self._metrics_server is not None:
+            return
+        # Every process of a sharded bot serves its own metrics.
+        port += self.process
+        server = MetricsServer(
+            self.metrics, self.config.get('metrics_host',
+                                          DEFAULT_METRICS_HOST), port)
+        try:
+            await server.start()
+        except OSError as e:
+            await server.close()
+            self.logger.error(f'Could not serve metrics on port {port}: {e}')
+            return
+        self._metrics_server = server
+
+    async def _stop_metrics_server(self):
+        if self._metrics_server is not None:
+            await self._metrics_server.close()
+            self._metrics_server = None
+
+    def _cog_name(self, interaction: ApplicationCommandInteraction
+    ) -> str | None:
+        command = self.get_slash_command(interaction.data.name)
+        cog = getattr(command, 'cog', None)
+        return cog.qualified_name if cog is not None else None
+
+    async def process_application_commands(
+        self, interaction: ApplicationCommandInteraction) -> None:
+        cog = self._cog_name(interaction)
+        if cog in self._draining:
+            await interaction.response.send_message(
+                f'`{cog}` is being reloaded, try again in a moment.',
+                ephemeral=True)
+            return
+        task = asyncio.current_task()
+        in_flight = self._in_flight.setdefault(cog, set())
+        in_flight.add(task)
+        started = time.perf_counter()
+        try:
+            await super().process_application_commands(interaction)
+        finally:
+            in_flight.discard(task)
+            self._command_latency.observe(time.perf_counter() - started,
+                                          _command_name(interaction))
+
+    async def process_app_command_autocompletion(
+        self, interaction: ApplicationCommandInteraction) -> None:
+        if self._cog_name(interaction) in self._draining:
+            await interaction.response.autocomplete(choices=[])
+            return
+        started = time.perf_counter()
+        name = _command_name(interaction)
+        focused = interaction.data.focused_option
+        option = focused.name if focused is not None else ''
+        try:
+            await super().process_app_command_autocompletion(interaction)
+        except Exception as e:
+            self._autocomplete_errors.inc(name, option, type(e).__name__)
+            raise
+        finally:
+            self._autocomplete_latency.observe(
+                time.perf_counter() - started, name, option)
+
+    async def on_slash_command_error(self,
+        interaction: ApplicationCommandInteraction,
+        exception: CommandError) -> None:
+        error = getattr(exception, 'original', exception)
+        self._command_errors.inc(_command_name(interaction),
+                                 type(error).__name__)
+        await super().on_slash_command_error(interaction, exception)
+
     def add_cog(self, cog: dc.Cog, *, override: bool = False) -> None:
         try:
             super().add_cog(cog, override=override)
@@ -57,3 +270,70 @@ class InteractionBot(dc.InteractionBot):
     @property
     def loaded_cogs(self) -> list[str]:
         return self._loaded_cogs
+
+    async def reload_cog(self, name: str,
+        timeout: float = DEFAULT_DRAIN_TIMEOUT) -> Reload:
+        """
+        Replaces a cog with a fresh instance from its re-executed module.
+
+        New invocations of the cog's commands are turned away while its
+        running handlers get up to timeout seconds to finish. A cog with an
+        export_state() method then hands its warm resources to the new
+        instance's import_state(), rather than closing them in cog_unload.
+        If the new instance cannot be loaded, the old one is put back.
+        """
+        entry = self.registry.get(name)
+        if entry is None:
+            raise ModuleNotFoundError(f'No cog module named {name}')
+        started = time.perf_counter()
+        self._draining.add(entry.name)
+        try:
+            # The handler reloading the cog must not wait for itself.
+            pending = self._in_flight.get(entry.name, set()) \
+                - {asyncio.current_task()}
+            drained = 0
+            if pending:
+                done, pending = await asyncio.wait(pending, timeout=timeout)
+                drained = len(done)
+
+            old = self.get_cog(entry.name)
+            state = None
+            if old is not None:
+                if hasattr(old, 'export_state'):
+                    state = old.export_state()
+                self.remove_cog(entry.name)
+            try:
+                cog = self.registry.load(entry.name, reload=True)
+            except BaseException:
+                if old is not None:
+                    if state is not None:
+                        old.import_state(state)
+                    self.add_cog(old)
+                raise
+            if state is not None:
+                if hasattr(cog, 'import_state'):
+                    cog.import_state(state)
+                else:
+                    # Nothing takes the resources over, so the old cog
+                    # closes them after all.
+                    old.import_state(state)
+                    old.cog_unload()
+        finally:
+            self._draining.discard(entry.name)
+        return Reload(time.perf_counter() - started, drained, len(pending),
+                      state is not None)
+
+    @property
+    def shard_latencies(self) -> list[tuple[int, float]]:
+        """Heartbeat latency of every shard this process connects."""
+        if isinstance(self, disnake.AutoShardedClient):
+            return self.latencies
+        return [(self.shard_id or 0, self.latency)]
+
+
+class InteractionBot(LibrarianBot, dc.InteractionBot):
+    pass
+
+
+class AutoShardedInteractionBot(LibrarianBot, dc.AutoShardedInteractionBot):
+    pass
@@ -0,0 +1,130 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Any, Awaitable, Callable, Generic, Hashable, TypeVar
+
+V = TypeVar('V')
+
+_MISSING: Any = object()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    stale: int = 0
+    refreshes: int = 0
+    errors: int = 0
+    timeouts: int = 0
+
+
+class AsyncTTLCache(Generic[V]):
+    """
+    Caches the results of an async fetch function per key.
+
+    Fresh values are returned directly. Once a value is older than ttl it is
+    still served immediately while a single background task refreshes it;
+    only values older than ttl + max_stale make callers wait. Concurrent
+    callers for the same key always share one in-flight fetch. Keys are
+    passed to fetch, except for the default key None which calls fetch
+    without arguments.
+
+    Fetches started before an invalidate() never fill the cache, as they
+    may have asked whatever the cache was invalidated for.
+    """
+
+    def __init__(self, name: str,
+        fetch: Callable[..., Awaitable[V]],
+        ttl: float = 30,
+        max_stale: float | None = None):
+        self.name = name
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.stats = CacheStats()
+        self.logger = logging.getLogger(__name__)
+        self._entries: dict[Hashable, tuple[V, float]] = {}
+        self._inflight: dict[Hashable, asyncio.Future[V]] = {}
+        self._generation = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    async def get(self, key: Hashable = None,
+        deadline: float | None = None,
+        default: Any = _MISSING) -> V:
+        """
+        Returns the value for key.
+
+        When the caller has to wait for a fetch and deadline seconds pass,
+        the stale value is returned instead, or default when nothing was
+        cached yet. Without a default the TimeoutError is raised. The fetch
+        carries on in the background either way.
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, expires = entry
+            if now < expires:
+                self.stats.hits += 1
+                self.logger.debug(f'{self.name} cache: HIT')
+                return value
+            if self.max_stale is None or now < expires + self.max_stale:
+                self.stats.stale += 1
+                self.logger.debug(f'{self.name} cache: STALE')
+                self.refresh(key)
+                return value
+
+        self.stats.misses += 1
+        self.logger.debug(f'{self.name} cache: MISS')
+        refresh = self.refresh(key)
+        try:
+            return await asyncio.wait_for(asyncio.shield(refresh), deadline)
+        except TimeoutError:
+            self.stats.timeouts += 1
+            if entry is not None:
+                return entry[0]
+            if default is not _MISSING:
+                return default
+            raise
+
+    def refresh(self, key: Hashable = None) -> asyncio.Future[V]:
+        """Starts a fetch for key unless one is already running."""
+        refresh = self._inflight.get(key)
+        if refresh is None:
+            self.stats.refreshes += 1
+            refresh = asyncio.ensure_future(
+                self._load(key, self._generation))
+            refresh.add_done_callback(partial(self._loaded, key))
+            self._inflight[key] = refresh
+        return refresh
+
+    async def _load(self, key: Hashable, generation: int) -> V:
+        value = await (self.fetch() if key is None else self.fetch(key))
+        if generation == self._generation:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+        return value
+
+    def _loaded(self, key: Hashable, refresh: asyncio.Future[V]):
+        if self._inflight.get(key) is refresh:
+            del self._inflight[key]
+        if not refresh.cancelled() and refresh.exception() is not None:
+            self.stats.errors += 1
+            self.logger.warning(f'Refreshing {self.name} cache failed: '
+                                f'{refresh.exception()!r}')
+
+    def peek(self, key: Hashable = None, default: Any = None) -> V | Any:
+        """Returns whatever is cached for key without fetching."""
+        entry = self._entries.get(key)
+        return default if entry is None else entry[0]
+
+    def invalidate(self, key: Hashable = _MISSING):
+        self._generation += 1
+        if key is _MISSING:
+            self._entries.clear()
+            self._inflight.clear()
+        else:
+            self._entries.pop(key, None)
+            self._inflight.pop(key, None)
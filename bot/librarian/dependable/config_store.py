@@ -0,0 +1,141 @@
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Mapping
+
+from librarian.dependable.files import replace_file
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where only a single process runs the bot.
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+# The journal is folded into a fresh snapshot once it holds this many
+# entries, keeping startup replay short.
+DEFAULT_COMPACT_AFTER = 1000
+
+# Marks a key removed from the configuration in a set of changes.
+DELETED: Any = object()
+
+
+class ConfigStore:
+    """
+    Stores configuration values as a JSON snapshot plus an append-only
+    journal of JSON lines holding the changes made since.
+
+    The snapshot is only ever replaced atomically, and a torn last journal
+    line from a crash is skipped on load, so a crash at any point leaves
+    either the old or the new value of every key. Unknown fields and
+    newer format versions are tolerated on load.
+
+    Every shard process has a store of its own on the same files, so all
+    reads and writes hold an exclusive lock on a lock file next to them.
+    """
+
+    def __init__(self, path: Path | str,
+        compact_after: int = DEFAULT_COMPACT_AFTER):
+        self.path = Path(path)
+        self.journal_path = self.path.with_name(self.path.name + '.journal')
+        self.lock_path = self.path.with_name(self.path.name + '.lock')
+        self.compact_after = compact_after
+        self._journal_entries = 0
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return self.path.exists() or self.journal_path.exists()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            os.makedirs(self.path.parent, exist_ok=True)
+            with open(self.lock_path, 'ab') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                yield
+
+    def load(self) -> dict[str, Any]:
+        with self._locked():
+            return self._load()
+
+    def _load(self) -> dict[str, Any]:
+        values: dict[str, Any] = {}
+        if self.path.exists():
+            stored = json.loads(self.path.read_bytes())
+            if stored.get('format', FORMAT_VERSION) > FORMAT_VERSION:
+                logger.warning(f'{self.path} was written by a newer '
+                               f'version (format {stored["format"]})')
+            values.update(stored.get('values', {}))
+        self._journal_entries = self._replay(values)
+        return values
+
+    def _replay(self, values: dict[str, Any]) -> int:
+        try:
+            with open(self.journal_path, 'rb') as journal:
+                lines = journal.readlines()
+        except FileNotFoundError:
+            return 0
+        if lines and not lines[-1].endswith(b'\n'):
+            # Cut the torn line off, or the next append would extend it.
+            torn = lines.pop()
+            os.truncate(self.journal_path,
+                        self.journal_path.stat().st_size - len(torn))
+            logger.warning(f'Dropped a torn entry from {self.journal_path}')
+        for number, line in enumerate(lines, 1):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                logger.warning(f'Skipping unreadable line {number} of '
+                               f'{self.journal_path}')
+                continue
+            if entry.get('deleted'):
+                values.pop(entry['key'], None)
+            else:
+                values[entry['key']] = entry.get('value')
+        return len(lines)
+
+    def write(self, values: Mapping[str, Any]) -> None:
+        """Replaces the snapshot with values and empties the journal."""
+        with self._locked():
+            self._write(values)
+
+    def _write(self, values: Mapping[str, Any]) -> None:
+        data = json.dumps({'format': FORMAT_VERSION, 'values': dict(values)},
+                          indent=4, sort_keys=True).encode()
+        replace_file(self.path, data)
+        self.journal_path.unlink(missing_ok=True)
+        self._journal_entries = 0
+
+    def append(self, changes: Mapping[str, Any]) -> None:
+        """
+        Journals changed keys, with DELETED for removed ones. Once the
+        journal grows past compact_after entries, it is folded into a new
+        snapshot along with the changes instead.
+        """
+        lines = b''.join(
+            json.dumps({'key': key, 'deleted': True}
+                       if value is DELETED else
+                       {'key': key, 'value': value}).encode() + b'\n'
+            for key, value in changes.items())
+        with self._locked():
+            if self._journal_entries + len(changes) > self.compact_after:
+                # Folded from the files rather than from this process's
+                # values, which lack what other processes journaled.
+                values = self._load()
+                for key, value in changes.items():
+                    if value is DELETED:
+                        values.pop(key, None)
+                    else:
+                        values[key] = value
+                return self._write(values)
+            with open(self.journal_path, 'ab') as journal:
+                journal.write(lines)
+                journal.flush()
+                os.fsync(journal.fileno())
+            self._journal_entries += len(changes)
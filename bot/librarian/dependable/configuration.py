@@ -1,21 +1,35 @@
-import copy
+import asyncio
+import json
 import logging
 import os
 import pickle
 from os import environ
 from pathlib import Path
+from types import MappingProxyType
+from typing import Iterable, Iterator, Mapping, TYPE_CHECKING
 
 from typing_extensions import Any
 
-# from koor.dependable.bot_overload import InteractionBot
+from librarian.dependable.config_store import ConfigStore, DELETED
 from librarian.dependable.exceptions import BlockedConfigurationKeyException
+from librarian.dependable.watch import Watcher
+
+if TYPE_CHECKING:
+    from librarian.dependable.bot_overload import LibrarianBot
 
 
 logger = logging.getLogger(__name__)
 
+CENSORED = '******'
+DEFAULT_WRITE_BEHIND_DELAY = 1.0
+
+
+def _config_dir() -> Path:
+    return Path(os.environ.get('CONFIG_DIR', '.'))
+
 
 class Configuration(dict):
-    # _bot: InteractionBot | None = None
+    _bot: 'LibrarianBot | None' = None
 
     # Luckperms Cog
     luckperms_base_url: str | None
@@ -47,13 +61,216 @@ class Configuration(dict):
         'mcprofile_api_key'
     ]
 
+    # Bumped on every change; the cached views below are rebuilt lazily
+    # when they were built for an older version.
+    _version: int = 0
+    _view_version: int = -1
+    _snapshot: Mapping[str, Any] = MappingProxyType({})
+    _keys: tuple[str, ...] = ()
+
+    # Set by attach(); with config_write_behind enabled, changed keys are
+    # journalled config_write_behind_delay seconds after the last change.
+    _store: ConfigStore | None = None
+    _dirty: set[str] | None = None
+    # Keys changed in memory since they were last written, in either mode;
+    # reload() leaves them alone.
+    _unsaved: set[str] | None = None
+    _flushing: frozenset[str] = frozenset()
+    _flush_handle: asyncio.TimerHandle | None = None
+    _flush_task: asyncio.Future | None = None
+    _watcher: Watcher | None = None
+
     def __str__(self) -> str:
-        dictionary = self.__dict__.copy()
-        for key in dictionary.keys():
-            if key in self.censored_keys:
-                dictionary[key] = '******'
+        return str(dict(self.censored_items()))
+
+    def __setitem__(self, key: str, value: Any):
+        if key in self and self[key] is value:
+            return
+        super().__setitem__(key, value)
+        self._changed((key,))
+
+    def __delitem__(self, key: str):
+        super().__delitem__(key)
+        self._changed((key,))
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def pop(self, key: str, *default) -> Any:
+        if key not in self:
+            return super().pop(key, *default)
+        value = super().pop(key)
+        self._changed((key,))
+        return value
+
+    def popitem(self) -> tuple[str, Any]:
+        item = super().popitem()
+        self._changed((item[0],))
+        return item
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def clear(self):
+        keys = tuple(self)
+        super().clear()
+        self._changed(keys)
+
+    def _changed(self, keys: Iterable[str]):
+        self._version += 1
+        keys = tuple(keys)
+        if self._unsaved is None:
+            self._unsaved = set()
+        self._unsaved.update(keys)
+        if self._store is None or not self.get('config_write_behind', False):
+            return
+        if self._dirty is None:
+            self._dirty = set()
+        self._dirty.update(keys)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.flush()
+        if self._flush_handle is None:
+            self._flush_handle = loop.call_later(
+                self.get('config_write_behind_delay',
+                         DEFAULT_WRITE_BEHIND_DELAY),
+                self._write_behind)
+
+    def _write_behind(self):
+        self._flush_handle = None
+        if self._flush_task is not None and not self._flush_task.done():
+            # Keep journal entries in order behind the running flush.
+            self._flush_task.add_done_callback(
+                lambda _: self._write_behind())
+            return
+        changes = self._pending_changes()
+        if changes:
+            self._flushing = frozenset(changes)
+            self._flush_task = asyncio.ensure_future(asyncio.to_thread(
+                self._append, changes))
+
+    def _pending_changes(self) -> dict[str, Any]:
+        changes = {key: self.get(key, DELETED) for key in self._dirty or ()}
+        self._dirty = set()
+        return changes
+
+    def _append(self, changes: dict[str, Any]):
+        try:
+            self._store.append(changes)
+        except Exception as e:
+            logger.error(f'Could not write configuration changes: {e!r}')
+        else:
+            # Keys changed again meanwhile are still waiting in _dirty.
+            self._unsaved = (self._unsaved or set()) - (
+                changes.keys() - (self._dirty or set()))
+        finally:
+            self._flushing = frozenset()
 
-        return str(dictionary)
+    def attach(self, store: ConfigStore):
+        self._store = store
+
+    def bind(self, bot: 'LibrarianBot'):
+        """Dispatches configuration_set on bot for every changed key."""
+        self._bot = bot
+
+    def _dispatch(self, key: str, value: Any):
+        if self._bot is not None:
+            self._bot.dispatch('configuration_set', key=key, value=value)
+
+    def watch(self):
+        """
+        Reloads the configuration whenever its files in CONFIG_DIR change,
+        e.g. after editing config.json by hand. Needs a running event loop.
+        """
+        if self._store is None or self._watcher is not None:
+            return
+        names = {self._store.path.name, self._store.journal_path.name}
+
+        def changed(paths: set[Path]):
+            if any(path.name in names or path == self._store.path.parent
+                   for path in paths):
+                asyncio.create_task(self.reload())
+
+        self._watcher = Watcher(changed)
+        self._watcher.add(self._store.path.parent)
+        self._watcher.start()
+        logger.info(f'Watching {self._store.path} ({self._watcher.backend})')
+
+    def unwatch(self):
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
+    async def reload(self) -> list[str]:
+        """
+        Applies the stored configuration in place and returns the keys that
+        changed. Keys set here but not yet written keep their value.
+        """
+        try:
+            stored = await asyncio.to_thread(self._store.load)
+        except (OSError, ValueError) as e:
+            logger.error(f'Could not reload configuration: {e!r}')
+            return []
+        unsaved = (self._unsaved or set()) | (self._dirty or set()) \
+            | self._flushing
+        changed = [key for key in self.keys() | stored.keys()
+                   if key not in unsaved
+                   and self.get(key, DELETED) != stored.get(key, DELETED)]
+        for key in changed:
+            if key in stored:
+                super().__setitem__(key, stored[key])
+            else:
+                super().__delitem__(key)
+        if changed:
+            self._version += 1
+            logger.info(f'Reloaded configuration keys: {", ".join(changed)}')
+        for key in changed:
+            self._dispatch(key, stored.get(key))
+        return changed
+
+    def flush(self):
+        """Journals any changes still waiting for the write-behind delay."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._store is not None:
+            changes = self._pending_changes()
+            if changes:
+                self._append(changes)
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def _refresh_views(self):
+        if self._view_version != self._version:
+            self._snapshot = MappingProxyType(dict(self))
+            self._keys = tuple(self._snapshot)
+            self._view_version = self._version
+
+    def snapshot(self) -> Mapping[str, Any]:
+        """
+        Read-only shallow copy of the configuration, shared by all callers
+        until the configuration next changes.
+        """
+        self._refresh_views()
+        return self._snapshot
+
+    def configuration_keys(self) -> tuple[str, ...]:
+        self._refresh_views()
+        return self._keys
+
+    def censored_items(self) -> Iterator[tuple[str, Any]]:
+        """Items of the snapshot with the censored keys' values masked."""
+        for key, value in self.snapshot().items():
+            yield key, CENSORED if key in self.censored_keys else value
+
+    def censored_json(self, **kwargs) -> str:
+        return json.dumps(dict(self.censored_items()), **kwargs)
 
     def show(self, key: str) -> str | None:
         if key in self.censored_keys:
@@ -62,29 +279,41 @@ class Configuration(dict):
 
     def set(self, key: str, value: Any):
         self[key] = value
-        # self._bot.dispatch("configuration_set", key=key, value=value)
+        self._dispatch(key, value)
 
     def configuration_get_key(self, key: str) -> Any | None:
         return self.get(key)
 
-    def censored_copy(self):
-        copied_configuration = copy.deepcopy(self)
-        for key in copied_configuration.keys():
-            if key in copied_configuration.censored_keys:
-                copied_configuration[key] = '******'
-        return copied_configuration
+    def censored_copy(self) -> dict[str, Any]:
+        return dict(self.censored_items())
 
     def save(self):
-        path: Path = Path(os.environ.get('CONFIG_DIR')) / 'koor.dat'
-        os.makedirs(os.path.dirname(path), exist_ok=True)
+        """
+        Writes the whole configuration as a new snapshot. Blocking, so use
+        save_async() on the event loop instead.
+        """
+        self._store.write(self._saving())
+        self._unsaved = set()
 
-        config = copy.deepcopy(self)
-        config._bot = None
+    async def save_async(self):
+        """save(), with only the writing done in a thread."""
+        snapshot = self._saving()
+        unsaved, self._unsaved = self._unsaved, set()
+        try:
+            await asyncio.to_thread(self._store.write, snapshot)
+        except BaseException:
+            self._unsaved |= unsaved or set()
+            raise
 
-        with open(path, 'wb') as file:
-            # noinspection PyTypeChecker
-            pickler = pickle.Pickler(file, protocol=pickle.HIGHEST_PROTOCOL)
-            pickler.dump(config)
+    def _saving(self) -> Mapping[str, Any]:
+        # Runs on the event loop, as its timer handles are not thread safe.
+        if self._store is None:
+            self.attach(ConfigStore(_config_dir() / 'config.json'))
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._dirty = set()
+        return self.snapshot()
 
     @staticmethod
     def from_env():
@@ -92,7 +321,7 @@ class Configuration(dict):
         paste_frontend_url = environ.get('PASTE_FRONTEND_URL')
         user_agent = environ.get('USER_AGENT')
 
-        return Configuration(
+        configuration = Configuration(
             # _bot=bot,
             paste_api_url=paste_api_url,
             paste_frontend_url=paste_frontend_url,
@@ -100,10 +329,27 @@ class Configuration(dict):
             botstatus_activity=[],
             censored_keys=[]
         )
+        configuration.attach(ConfigStore(_config_dir() / 'config.json'))
+        return configuration
 
     @staticmethod
     def from_stored():
-        path: Path = Path(os.environ.get('CONFIG_DIR')) / 'koor.dat'
+        """
+        Loads config.json and its journal, migrating a pickled koor.dat
+        from older versions on first start.
+        """
+        store = ConfigStore(_config_dir() / 'config.json')
+        if not store.exists():
+            Configuration._migrate_pickle(store)
+        configuration = Configuration(store.load())
+        configuration.attach(store)
+        return configuration
+
+    @staticmethod
+    def _migrate_pickle(store: ConfigStore):
+        path = _config_dir() / 'koor.dat'
         with open(path, 'rb') as file:
-            configuration: Configuration = pickle.Unpickler(file).load()
-            return configuration
+            pickled: dict = pickle.Unpickler(file).load()
+        logger.info(f'Migrating {path} to {store.path}')
+        store.write(dict(pickled))
+        path.rename(path.with_name(path.name + '.migrated'))
@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from librarian.dependable.exceptions import DuplicateFileException
+from librarian.dependable.files import AtomicFile, DEFAULT_HASH
+from librarian.dependable.store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    digest TEXT NOT NULL,
+    library TEXT NOT NULL,
+    series TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_digest ON files (digest);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+
+def hash_file(path: Path | str, hash_name: str = DEFAULT_HASH) -> str:
+    with open(path, 'rb') as file:
+        return hashlib.file_digest(file, hash_name).hexdigest()
+
+
+class HashIndex(SQLiteStore):
+    """
+    Persistent map of content hash to the files under /libraries holding
+    that content.
+    """
+    schema = _SCHEMA
+
+    def __init__(self, path: Path | str):
+        super().__init__(path)
+        # Per digest being stored, its lock and how many threads want it.
+        self._claims: dict[str, tuple[threading.Lock, int]] = {}
+        self._claims_lock = threading.Lock()
+
+    @contextmanager
+    def claim(self, digest: str) -> Iterator[None]:
+        """
+        Holds off other threads of this process claiming the same digest,
+        so looking it up, storing the file and recording it happen as one.
+        """
+        with self._claims_lock:
+            lock, waiting = self._claims.get(digest, (threading.Lock(), 0))
+            self._claims[digest] = (lock, waiting + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._claims_lock:
+                lock, waiting = self._claims[digest]
+                if waiting == 1:
+                    del self._claims[digest]
+                else:
+                    self._claims[digest] = (lock, waiting - 1)
+
+    def find(self, digest: str) -> Path | None:
+        """
+        Returns a file still on disk with the given digest, forgetting any
+        entries whose files have disappeared since.
+        """
+        with self._lock:
+            rows = self.connection.execute(
+                'SELECT path FROM files WHERE digest = ?', (digest,)
+            ).fetchall()
+            for path, in rows:
+                if os.path.exists(path):
+                    return Path(path)
+                self.connection.execute('DELETE FROM files WHERE path = ?',
+                                        (path,))
+        return None
+
+    def record(self, path: Path | str, digest: str, library: str,
+        series: str):
+        stat = os.stat(path)
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO files '
+                '(path, digest, library, series, size, mtime_ns) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (str(path), digest, library, series, stat.st_size,
+                 stat.st_mtime_ns))
+
+    def digest(self, path: Path | str) -> str | None:
+        """The digest path was recorded with, if it is indexed."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT digest FROM files WHERE path = ?', (str(path),)
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def _known(self) -> dict[str, tuple[int, int]]:
+        with self._lock:
+            return {path: (size, mtime_ns) for path, size, mtime_ns in
+                    self.connection.execute(
+                        'SELECT path, size, mtime_ns FROM files')}
+
+    def backfilled(self) -> bool:
+        with self._lock:
+            return self.connection.execute(
+                "SELECT 1 FROM meta WHERE key = 'backfilled'"
+            ).fetchone() is not None
+
+    def backfill(self, root: Path | str, workers: int = 4) -> int:
+        """
+        Hashes every file under root/<library>/<series>/ that is not yet
+        indexed with its current size and mtime, using a pool of threads.
+        Returns the number of files hashed.
+        """
+        known = self._known()
+        pending: list[tuple[Path, str, str]] = []
+        for library in _visible(Path(root)):
+            if not library.is_dir():
+                continue
+            for series in _visible(library):
+                if not series.is_dir():
+                    continue
+                for file in _visible(series):
+                    if not file.is_file():
+                        continue
+                    stat = file.stat()
+                    if known.get(str(file)) == (stat.st_size,
+                                                stat.st_mtime_ns):
+                        continue
+                    pending.append((file, library.name, series.name))
+
+        def index(entry: tuple[Path, str, str]):
+            file, library_name, series_name = entry
+            try:
+                self.record(file, hash_file(file), library_name, series_name)
+            except OSError as e:
+                logger.warning(f'Could not index {file}: {e}')
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(index, pending))
+
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta (key, value) "
+                "VALUES ('backfilled', datetime('now'))")
+        logger.info(f'Hash index backfill hashed {len(pending)} files')
+        return len(pending)
+
+
+def _visible(directory: Path) -> list[Path]:
+    try:
+        return [Path(entry.path) for entry in os.scandir(directory)
+                if not entry.name.startswith('.')]
+    except OSError:
+        return []
+
+
+class Deduplicator:
+    """
+    Commit hooks rejecting, or hard linking, files whose content is already
+    stored somewhere under /libraries, and indexing the files that land.
+    """
+
+    def __init__(self, index: HashIndex, mode: str, library: str,
+        series: str):
+        self.index = index
+        self.mode = mode
+        self.library = library
+        self.series = series
+
+    def before_commit(self, file: AtomicFile) -> None:
+        if self.mode == 'off':
+            return
+        # Checked and recorded apart, two jobs storing the same content at
+        # once would both find nothing and both be stored. So the file is
+        # committed here, while the digest is claimed.
+        with self.index.claim(file.digest):
+            existing = self.index.find(file.digest)
+            if existing is None:
+                file.commit()
+            elif self.mode == 'link':
+                logger.info(f'Linking duplicate {file.destination} to '
+                            f'{existing}')
+                file.commit_link(existing)
+            else:
+                raise DuplicateFileException(f'duplicate of `{existing}`')
+            self._record(file)
+
+    def after_commit(self, file: AtomicFile) -> None:
+        if self.mode == 'off':
+            self._record(file)
+
+    def _record(self, file: AtomicFile):
+        self.index.record(file.destination, file.digest, self.library,
+                          self.series)
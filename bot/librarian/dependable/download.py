@@ -0,0 +1,246 @@
+import asyncio
+import logging
+import threading
+from pathlib import Path
+from typing import AsyncIterator, Callable
+
+from aiohttp import (ClientConnectionError, ClientPayloadError,
+                     ClientResponseError, ClientSession, ClientTimeout)
+
+from librarian.dependable.exceptions import IncompleteFileException
+from librarian.dependable.files import (AtomicFile, CommitHooks,
+                                        DEFAULT_BUFFER_SIZE,
+                                        DEFAULT_QUEUE_DEPTH, finalize,
+                                        stream_to_file)
+
+DEFAULT_SEGMENT_SIZE = 8 * 1024 * 1024
+DEFAULT_SEGMENTS = 4
+DEFAULT_RETRIES = 5
+# Files smaller than this are fetched as a single stream.
+DEFAULT_SEGMENTED_THRESHOLD = 32 * 1024 * 1024
+
+_RETRYABLE = (ClientConnectionError, ClientPayloadError, TimeoutError)
+
+
+def _ignore(_: int):
+    pass
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, _RETRYABLE)
+
+
+class _OrderedHash:
+    """
+    Hashes the blocks of a segmented download in file order, as they are
+    written from several segments at once. Blocks arriving ahead of the
+    hashed offset are held in memory up to limit bytes; those beyond it are
+    read back from the file once the hash reaches them.
+    """
+
+    def __init__(self, file: AtomicFile, limit: int, block_size: int):
+        self.file = file
+        self.limit = limit
+        self.block_size = block_size
+        self.offset = 0
+        self.read_back = 0
+        # The data of blocks ahead, or their end when they are read back.
+        self._ahead: dict[int, bytes | int] = {}
+        self._held = 0
+        self._lock = threading.Lock()
+
+    def write_at(self, data: bytes, offset: int) -> None:
+        self.file.write_at(data, offset)
+        with self._lock:
+            if offset != self.offset:
+                if self._held + len(data) <= self.limit:
+                    self._ahead[offset] = data
+                    self._held += len(data)
+                else:
+                    self._ahead[offset] = offset + len(data)
+                return
+            self.file.hash.update(data)
+            self.offset += len(data)
+            while (block := self._ahead.pop(self.offset, None)) is not None:
+                if isinstance(block, int):
+                    self.file.hash_range(self.offset, block - self.offset,
+                                         self.block_size)
+                    self.read_back += block - self.offset
+                    self.offset = block
+                else:
+                    self._held -= len(block)
+                    self.file.hash.update(block)
+                    self.offset += len(block)
+
+
+class Downloader:
+    """
+    Fetches a URL into an AtomicFile, resuming from the last good offset
+    with exponential backoff when the connection drops. Large files from
+    servers supporting range requests are split into segments fetched in
+    parallel into a preallocated file, and hashed in order as they arrive.
+    """
+
+    def __init__(self, session: ClientSession,
+        segment_size: int = DEFAULT_SEGMENT_SIZE,
+        segments: int = DEFAULT_SEGMENTS,
+        retries: int = DEFAULT_RETRIES,
+        backoff: float = 0.5,
+        segmented_threshold: int = DEFAULT_SEGMENTED_THRESHOLD,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        queue_depth: int = DEFAULT_QUEUE_DEPTH,
+        headers: dict[str, str] | None = None):
+        self.session = session
+        self.segment_size = segment_size
+        self.segments = segments
+        self.retries = retries
+        self.backoff = backoff
+        self.segmented_threshold = segmented_threshold
+        self.buffer_size = buffer_size
+        self.queue_depth = queue_depth
+        self.headers = headers or {}
+        self.logger = logging.getLogger(__name__)
+
+    async def download(self, url: str, destination: Path | str,
+        size: int | None = None,
+        hooks: CommitHooks | None = None,
+        progress: Callable[[int], None] | None = None) -> Path:
+        """
+        Downloads url into destination. progress, when given, is called with
+        the number of bytes of every chunk received.
+        """
+        progress = progress or _ignore
+        if (size is not None and size >= self.segmented_threshold
+            and await self._supports_ranges(url)):
+            return await self._segmented(url, Path(destination), size, hooks,
+                                         progress)
+        return await stream_to_file(
+            self._resumable(url, progress), destination,
+            buffer_size=self.buffer_size,
+            queue_depth=self.queue_depth,
+            hooks=hooks,
+            expected_size=size)
+
+    async def _supports_ranges(self, url: str) -> bool:
+        try:
+            async with self.session.get(
+                url, headers={**self.headers, 'Range': 'bytes=0-0'}
+            ) as response:
+                return response.status == 206
+        except _RETRYABLE:
+            return False
+
+    async def _backoff(self, attempt: int, error: Exception, url: str):
+        delay = self.backoff * 2 ** attempt
+        self.logger.warning(f'Download of {url} interrupted ({error!r}), '
+                            f'retrying in {delay:.1f}s')
+        await asyncio.sleep(delay)
+
+    async def _resumable(self, url: str,
+        progress: Callable[[int], None]) -> AsyncIterator[bytes]:
+        position = 0
+        attempt = 0
+        while True:
+            headers = dict(self.headers)
+            if position:
+                headers['Range'] = f'bytes={position}-'
+            try:
+                async with self.session.get(url, headers=headers) as response:
+                    response.raise_for_status()
+                    if position and response.status != 206:
+                        raise IncompleteFileException(
+                            f'connection dropped after {position} bytes and '
+                            f'the server does not support resuming')
+                    async for chunk in response.content.iter_any():
+                        position += len(chunk)
+                        attempt = 0
+                        progress(len(chunk))
+                        yield chunk
+                    return
+            except Exception as e:
+                if not _retryable(e) or attempt >= self.retries:
+                    raise
+                await self._backoff(attempt, e, url)
+                attempt += 1
+
+    async def _segmented(self, url: str, destination: Path, size: int,
+        hooks: CommitHooks | None, progress: Callable[[int], None]) -> Path:
+        file = await asyncio.to_thread(AtomicFile, destination)
+        try:
+            await asyncio.to_thread(file.preallocate, size)
+            limit = asyncio.Semaphore(self.segments)
+            hashed = _OrderedHash(file, self.segments * self.segment_size,
+                                  self.buffer_size)
+            segments = [asyncio.create_task(self._segment(
+                url, hashed, start, min(start + self.segment_size, size),
+                limit, progress))
+                for start in range(0, size, self.segment_size)]
+            try:
+                await asyncio.gather(*segments)
+            finally:
+                for segment in segments:
+                    segment.cancel()
+                await asyncio.gather(*segments, return_exceptions=True)
+            if hashed.read_back:
+                self.logger.debug(f'Read {hashed.read_back} bytes of '
+                                  f'{destination} back to hash them')
+
+            return await asyncio.to_thread(finalize, file, hooks, size)
+        except BaseException:
+            await asyncio.to_thread(file.discard)
+            raise
+
+    async def _segment(self, url: str, hashed: _OrderedHash, start: int,
+        end: int, limit: asyncio.Semaphore,
+        progress: Callable[[int], None]):
+        position = start
+        attempt = 0
+        async with limit:
+            while position < end:
+                buffer = bytearray()
+                written = position
+                error: Exception | None = None
+                try:
+                    async with self.session.get(
+                        url,
+                        headers={**self.headers,
+                                 'Range': f'bytes={position}-{end - 1}'},
+                        timeout=ClientTimeout(sock_read=60)
+                    ) as response:
+                        response.raise_for_status()
+                        if response.status != 206:
+                            raise IncompleteFileException(
+                                'server stopped honouring range requests')
+                        async for chunk in response.content.iter_any():
+                            chunk = chunk[:end - written - len(buffer)]
+                            buffer += chunk
+                            progress(len(chunk))
+                            if len(buffer) >= self.buffer_size:
+                                await asyncio.to_thread(hashed.write_at,
+                                                        bytes(buffer),
+                                                        written)
+                                written += len(buffer)
+                                buffer.clear()
+                except Exception as e:
+                    if not _retryable(e):
+                        raise
+                    error = e
+                # Whatever arrived before a failure is kept, so the retry
+                # resumes from the last good offset.
+                if buffer:
+                    await asyncio.to_thread(hashed.write_at, bytes(buffer),
+                                            written)
+                    written += len(buffer)
+                if written > position:
+                    attempt = 0
+                position = written
+
+                if position < end:
+                    error = error or IncompleteFileException(
+                        f'segment {start}-{end} ended at {position}')
+                    if attempt >= self.retries:
+                        raise error
+                    await self._backoff(attempt, error, url)
+                    attempt += 1
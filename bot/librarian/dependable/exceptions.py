@@ -5,4 +5,13 @@ class BlockedConfigurationKeyException(Exception):
     pass
 
 class PasteFailedException(Exception):
-    pass
\ No newline at end of file
+    pass
+
+class DuplicateFileException(Exception):
+    pass
+
+class IncompleteFileException(Exception):
+    pass
+
+class InvalidFileException(Exception):
+    pass
@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+from pathlib import Path, PurePosixPath
+from typing import AsyncIterable, Protocol
+
+from librarian.dependable.exceptions import IncompleteFileException
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUFFER_SIZE = 4 * 1024 * 1024
+DEFAULT_QUEUE_DEPTH = 4
+DEFAULT_HASH = 'blake2b'
+
+
+class AtomicFile:
+    """
+    A temporary file created next to its destination. Nothing is visible at
+    the destination until commit() has fsynced the data and linked it into
+    place, so scanners never see a partially written file. The content is
+    hashed as it is written.
+    """
+
+    def __init__(self, destination: Path | str,
+        hash_name: str = DEFAULT_HASH):
+        self.destination = Path(destination)
+        fd, name = tempfile.mkstemp(dir=self.destination.parent,
+                                    prefix=f'.{self.destination.name}.',
+                                    suffix='.part')
+        self.path = Path(name)
+        self.size = 0
+        self.hash = hashlib.new(hash_name)
+        self._file = os.fdopen(fd, 'wb')
+        self._committed = False
+
+    def __enter__(self) -> 'AtomicFile':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if not self._committed:
+            self.discard()
+
+    @property
+    def committed(self) -> bool:
+        return self._committed
+
+    @property
+    def digest(self) -> str:
+        return self.hash.hexdigest()
+
+    def write(self, data: bytes | bytearray | memoryview) -> None:
+        self._file.write(data)
+        self.hash.update(data)
+        self.size += len(data)
+
+    def flush(self) -> None:
+        """Makes everything written so far readable through path."""
+        self._file.flush()
+
+    def commit(self) -> Path:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        try:
+            # Linking refuses to replace an existing file, which keeps the
+            # old 'xb' semantics of never clobbering an upload.
+            os.link(self.path, self.destination)
+        except FileExistsError:
+            self.discard()
+            raise
+        except OSError:
+            if self.destination.exists():
+                self.discard()
+                raise FileExistsError(self.destination)
+            os.rename(self.path, self.destination)
+        else:
+            os.unlink(self.path)
+        self._committed = True
+        _fsync_directory(self.destination.parent)
+        return self.destination
+
+    def preallocate(self, size: int) -> None:
+        """Reserves size bytes up front for write_at()."""
+        self._file.flush()
+        try:
+            os.posix_fallocate(self._file.fileno(), 0, size)
+        except (AttributeError, OSError):
+            os.truncate(self._file.fileno(), size)
+        self.size = size
+
+    def write_at(self, data: bytes | bytearray | memoryview,
+        offset: int) -> None:
+        """
+        Writes data at offset without hashing it; the hash has to be caught
+        up in order with hash_range() once the range is complete.
+        """
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(self._file.fileno(), view, offset)
+            view = view[written:]
+            offset += written
+
+    def hash_range(self, offset: int, length: int,
+        block_size: int = DEFAULT_BUFFER_SIZE) -> None:
+        end = offset + length
+        while offset < end:
+            block = os.pread(self._file.fileno(),
+                             min(block_size, end - offset), offset)
+            if not block:
+                raise EOFError(f'{self.path} ends at {offset}')
+            self.hash.update(block)
+            offset += len(block)
+
+    def commit_link(self, source: Path | str) -> Path:
+        """
+        Discards the written data and links source into the destination
+        instead, for content that already exists elsewhere.
+        """
+        self.discard()
+        os.link(source, self.destination)
+        self._committed = True
+        _fsync_directory(self.destination.parent)
+        return self.destination
+
+    def discard(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+        self.path.unlink(missing_ok=True)
+
+
+class CommitHooks(Protocol):
+    """
+    Called from a worker thread around AtomicFile.commit(). before_commit
+    may raise to reject the file or commit it itself, e.g. via commit_link.
+    """
+
+    def before_commit(self, file: AtomicFile) -> None: ...
+
+    def after_commit(self, file: AtomicFile) -> None: ...
+
+
+class HookChain:
+    """Runs several CommitHooks in order."""
+
+    def __init__(self, *hooks: CommitHooks):
+        self.hooks = hooks
+
+    def before_commit(self, file: AtomicFile) -> None:
+        for hook in self.hooks:
+            if file.committed:
+                break
+            hook.before_commit(file)
+
+    def after_commit(self, file: AtomicFile) -> None:
+        for hook in self.hooks:
+            hook.after_commit(file)
+
+
+def _fsync_directory(path: Path) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def replace_file(destination: Path | str, data: bytes) -> None:
+    """
+    Replaces destination with data atomically: readers see either the old
+    or the new content, never a partial write.
+    """
+    destination = Path(destination)
+    fd, path = tempfile.mkstemp(prefix=f'.{destination.name}.',
+                                suffix='.tmp', dir=destination.parent)
+    try:
+        with open(fd, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path, destination)
+    except BaseException:
+        Path(path).unlink(missing_ok=True)
+        raise
+    _fsync_directory(destination.parent)
+
+
+async def _fill(chunks: AsyncIterable[bytes], queue: asyncio.Queue,
+    buffer_size: int, failed: asyncio.Event) -> None:
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= buffer_size:
+            if failed.is_set():
+                return
+            await queue.put(bytes(buffer))
+            buffer.clear()
+    if buffer:
+        await queue.put(bytes(buffer))
+
+
+async def _drain(queue: asyncio.Queue, file: AtomicFile,
+    failed: asyncio.Event) -> None:
+    error: OSError | None = None
+    while (block := await queue.get()) is not None:
+        # Keep consuming after a failure so the reader never blocks on a
+        # full queue; the error is raised once the reader has stopped.
+        if error is None:
+            try:
+                await asyncio.to_thread(file.write, block)
+            except OSError as e:
+                error = e
+                failed.set()
+    if error is not None:
+        raise error
+
+
+def finalize(file: AtomicFile, hooks: CommitHooks | None = None,
+    expected_size: int | None = None) -> Path:
+    """
+    Commits file, running hooks around it, once it is known to be complete.
+    """
+    if expected_size is not None and file.size != expected_size:
+        raise IncompleteFileException(
+            f'received {file.size} of {expected_size} bytes')
+    if hooks is not None:
+        hooks.before_commit(file)
+    if not file.committed:
+        file.commit()
+    if hooks is not None:
+        hooks.after_commit(file)
+    return file.destination
+
+
+async def stream_to_file(chunks: AsyncIterable[bytes],
+    destination: Path | str,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    queue_depth: int = DEFAULT_QUEUE_DEPTH,
+    hooks: CommitHooks | None = None,
+    expected_size: int | None = None) -> Path:
+    """
+    Streams chunks into destination without blocking the event loop.
+
+    Chunks are coalesced into blocks of buffer_size bytes and handed to a
+    worker thread through a queue holding at most queue_depth blocks. The
+    data lands in a temporary file which is only linked into place once
+    everything was written and fsynced.
+    """
+    file = await asyncio.to_thread(AtomicFile, destination)
+    queue: asyncio.Queue[bytes | None] = asyncio.Queue(maxsize=queue_depth)
+    failed = asyncio.Event()
+    writer = asyncio.create_task(_drain(queue, file, failed))
+    try:
+        try:
+            await _fill(chunks, queue, buffer_size, failed)
+        finally:
+            if not writer.done():
+                await queue.put(None)
+        await writer
+        logger.debug(f'Wrote {file.size} bytes for {destination}')
+        return await asyncio.to_thread(finalize, file, hooks, expected_size)
+    except BaseException:
+        writer.cancel()
+        await asyncio.to_thread(file.discard)
+        raise
+
+
+def extract_zip(archive: Path | str, directory: Path | str,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    hooks: CommitHooks | None = None
+) -> list[tuple[str, Exception | None]]:
+    """
+    Streams every file of a zip archive into directory, one member at a
+    time and each through an AtomicFile. Members are flattened to their base
+    name. A member that fails does not stop the others; the result lists
+    each member with the exception it failed with, if any.
+    """
+    results: list[tuple[str, Exception | None]] = []
+    with zipfile.ZipFile(archive) as zip_file:
+        for member in zip_file.infolist():
+            name = PurePosixPath(member.filename).name
+            if (member.is_dir() or not name or name.startswith('.')
+                or member.filename.startswith('__MACOSX/')):
+                continue
+            try:
+                with (zip_file.open(member) as source,
+                      AtomicFile(Path(directory) / name) as target):
+                    shutil.copyfileobj(source, target, buffer_size)
+                    finalize(target, hooks)
+            except Exception as e:
+                results.append((name, e))
+            else:
+                results.append((name, None))
+    return results
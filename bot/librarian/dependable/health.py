@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import os
+import shutil
+import time
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+from aiohttp import ClientSession
+
+from librarian.dependable.metrics import Counter, LoopLagMonitor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATUS_INTERVAL = 5.0
+DEFAULT_STATUS_WINDOW = 5 * 60.0
+
+
+def _rss() -> int | None:
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _open_fds() -> int | None:
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def _disk(directories: dict[str, Path]) -> dict[str, 'Disk']:
+    disk = {}
+    for name, directory in directories.items():
+        try:
+            usage = shutil.disk_usage(directory)
+        except OSError:
+            continue
+        disk[name] = Disk(usage.free, usage.total)
+    return disk
+
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+@dataclass
+class Connections:
+    active: int
+    idle: int
+
+
+@dataclass
+class Disk:
+    free: int
+    total: int
+
+
+@dataclass
+class Health:
+    """The aggregates of one sample, over the last window seconds."""
+    taken: float
+    window: float
+    loop_lag_p50: float | None = None
+    loop_lag_p99: float | None = None
+    loop_lag_max: float | None = None
+    rss: int | None = None
+    rss_peak: int | None = None
+    open_fds: int | None = None
+    connections: dict[str, Connections] = field(default_factory=dict)
+    disk: dict[str, Disk] = field(default_factory=dict)
+    # Per second, from the counters registered with track_rate.
+    rates: dict[str, float] = field(default_factory=dict)
+
+    def as_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+
+class HealthSampler:
+    """
+    Samples the process every interval seconds and keeps the aggregates of
+    the last window seconds in health, so reading them costs nothing.
+
+    What is sampled beyond the process itself is registered: aiohttp
+    sessions with track_session, directories whose free space is reported
+    with track_disk and counters turned into rates with track_rate.
+    """
+
+    def __init__(self, loop_lag: LoopLagMonitor,
+        interval: float = DEFAULT_STATUS_INTERVAL,
+        window: float = DEFAULT_STATUS_WINDOW):
+        self.loop_lag = loop_lag
+        self.interval = interval
+        self.window = window
+        self.health = Health(time.time(), window)
+        samples = max(int(window / interval), 1) + 1
+        self._rss: deque[int] = deque(maxlen=samples)
+        self._totals: dict[str, deque[tuple[float, float]]] = {}
+        self._sessions: dict[str, Callable[[], ClientSession | None]] = {}
+        self._disk: dict[str, Callable[[], dict[str, Path]]] = {}
+        self._rates: dict[str, Counter] = {}
+        self._task: asyncio.Task | None = None
+
+    def track_session(self, name: str,
+        session: Callable[[], ClientSession | None]):
+        self._sessions[name] = session
+
+    def track_disk(self, name: str,
+        directories: Callable[[], dict[str, Path]]):
+        self._disk[name] = directories
+
+    def track_rate(self, name: str, counter: Counter):
+        self._rates[name] = counter
+        self._totals.setdefault(name, deque(maxlen=self._rss.maxlen))
+
+    def untrack(self, name: str):
+        self._sessions.pop(name, None)
+        self._disk.pop(name, None)
+        self._rates.pop(name, None)
+        self._totals.pop(name, None)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sample()
+            except Exception as e:
+                logger.warning(f'Sampling health failed: {e!r}')
+            await asyncio.sleep(self.interval)
+
+    async def sample(self) -> Health:
+        now = time.monotonic()
+        health = Health(time.time(), self.window)
+
+        lag = sorted(self.loop_lag.recent)
+        if lag:
+            health.loop_lag_p50 = _percentile(lag, 0.5)
+            health.loop_lag_p99 = _percentile(lag, 0.99)
+            health.loop_lag_max = lag[-1]
+
+        for name, session in self._sessions.items():
+            health.connections[name] = _connections(session())
+
+        for name, counter in self._rates.items():
+            totals = self._totals[name]
+            totals.append((now, sum(counter.values.values())))
+            started, first = totals[0]
+            health.rates[name] = (totals[-1][1] - first) / (now - started) \
+                if now > started else 0.0
+
+        # Resolved here, as the directories may come from structures only
+        # the event loop changes.
+        directories = {library: path for getter in self._disk.values()
+                       for library, path in getter().items()}
+        rss, health.open_fds, health.disk = await asyncio.to_thread(
+            lambda: (_rss(), _open_fds(), _disk(directories)))
+        if rss is not None:
+            self._rss.append(rss)
+            health.rss = rss
+            health.rss_peak = max(self._rss)
+
+        self.health = health
+        return health
+
+
+def _connections(session: ClientSession | None) -> Connections:
+    connector = None if session is None or session.closed \
+        else session.connector
+    if connector is None:
+        return Connections(0, 0)
+    # aiohttp keeps its pool in private attributes only.
+    acquired = getattr(connector, '_acquired', ())
+    idle = getattr(connector, '_conns', {})
+    return Connections(len(acquired),
+                       sum(len(connections) for connections in idle.values()))
@@ -0,0 +1,394 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field, fields
+from enum import Enum
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from librarian.dependable.store import SQLiteStore
+
+DEFAULT_WORKERS = 3
+DEFAULT_LIBRARY_LIMIT = 2
+# Discord allows roughly five message edits per five seconds.
+DEFAULT_PROGRESS_INTERVAL = 2.0
+DEFAULT_HEARTBEAT_INTERVAL = 60.0
+# Jobs of an owner that has not checked in for this long are taken over.
+DEFAULT_STALE_AFTER = 5 * 60.0
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    state TEXT NOT NULL,
+    library TEXT NOT NULL,
+    series TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    url TEXT NOT NULL,
+    size INTEGER,
+    extract INTEGER NOT NULL,
+    application_id INTEGER,
+    token TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+CREATE TABLE IF NOT EXISTS claims (
+    job INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS owners (
+    owner TEXT PRIMARY KEY,
+    seen REAL NOT NULL
+);
+'''
+
+
+class JobState(str, Enum):
+    PENDING = 'pending'
+    ACTIVE = 'active'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __str__(self):
+        return self.value
+
+
+@dataclass
+class Job:
+    library: str
+    series: str
+    directory: str
+    filename: str
+    url: str
+    size: int | None = None
+    extract: bool = False
+    # Lets a restarted bot still edit the original interaction response.
+    application_id: int | None = None
+    token: str | None = None
+    id: int | None = None
+    state: JobState = JobState.PENDING
+    error: str | None = None
+    created: float = field(default_factory=time.time)
+    updated: float = field(default_factory=time.time)
+
+
+_COLUMNS = [column.name for column in fields(Job) if column.name != 'id']
+
+
+def _job(row: tuple) -> Job:
+    job = Job(**dict(zip(_COLUMNS, row[1:])), id=row[0])
+    job.state = JobState(job.state)
+    job.extract = bool(job.extract)
+    return job
+
+
+class JobStore(SQLiteStore):
+    """
+    Upload jobs persisted in SQLite so they survive restarts. Several
+    processes can share one store: every job is claimed by the owner that
+    added it, and only recovered by another owner once its claimant stopped
+    checking in.
+    """
+    schema = _SCHEMA
+
+    _select = f'SELECT id, {", ".join(_COLUMNS)} FROM jobs'
+
+    def __init__(self, path: Path | str, owner: str = 'main'):
+        super().__init__(path)
+        self.owner = owner
+
+    def add(self, job: Job) -> int:
+        values = [getattr(job, column) for column in _COLUMNS]
+        with self._lock:
+            cursor = self.connection.execute(
+                f'INSERT INTO jobs ({", ".join(_COLUMNS)}) '
+                f'VALUES ({", ".join("?" * len(_COLUMNS))})',
+                [str(value) if isinstance(value, JobState) else value
+                 for value in values])
+            self.connection.execute(
+                'INSERT OR REPLACE INTO claims (job, owner) VALUES (?, ?)',
+                (cursor.lastrowid, self.owner))
+        job.id = cursor.lastrowid
+        return job.id
+
+    def heartbeat(self):
+        with self._lock:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO owners (owner, seen) VALUES (?, ?)',
+                (self.owner, time.time()))
+
+    def update(self, job: Job):
+        job.updated = time.time()
+        with self._lock:
+            self.connection.execute(
+                'UPDATE jobs SET state = ?, error = ?, updated = ? '
+                'WHERE id = ?',
+                (str(job.state), job.error, job.updated, job.id))
+
+    def recover(self, stale_after: float = DEFAULT_STALE_AFTER
+    ) -> list[Job]:
+        """
+        Claims and returns the unfinished jobs of this owner, of no owner
+        and of owners that stopped checking in stale_after seconds ago.
+        Jobs that were running when their owner stopped are put back into
+        the pending state.
+        """
+        unfinished = (str(JobState.PENDING), str(JobState.ACTIVE))
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'INSERT OR REPLACE INTO claims (job, owner) '
+                    'SELECT jobs.id, ? FROM jobs '
+                    'LEFT JOIN claims ON claims.job = jobs.id '
+                    'LEFT JOIN owners ON owners.owner = claims.owner '
+                    'WHERE jobs.state IN (?, ?) AND (claims.owner IS NULL '
+                    'OR owners.seen IS NULL OR owners.seen < ?)',
+                    (self.owner, *unfinished, time.time() - stale_after))
+                connection.execute(
+                    'UPDATE jobs SET state = ? WHERE state = ? AND id IN '
+                    '(SELECT job FROM claims WHERE owner = ?)',
+                    (str(JobState.PENDING), str(JobState.ACTIVE),
+                     self.owner))
+                rows = connection.execute(
+                    f'{self._select} WHERE state = ? AND id IN '
+                    f'(SELECT job FROM claims WHERE owner = ?) ORDER BY id',
+                    (str(JobState.PENDING), self.owner)).fetchall()
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        return [_job(row) for row in rows]
+
+    def listing(self, finished: int = 10) -> dict[JobState, list[Job]]:
+        """Pending and active jobs, plus the most recently finished ones."""
+        with self._lock:
+            unfinished = self.connection.execute(
+                f'{self._select} WHERE state IN (?, ?) ORDER BY id',
+                (str(JobState.ACTIVE), str(JobState.PENDING))).fetchall()
+            recent = self.connection.execute(
+                f'{self._select} WHERE state IN (?, ?) '
+                f'ORDER BY updated DESC LIMIT ?',
+                (str(JobState.DONE), str(JobState.FAILED), finished)
+            ).fetchall()
+        listing: dict[JobState, list[Job]] = {state: [] for state in JobState}
+        for row in unfinished + recent:
+            job = _job(row)
+            listing[job.state].append(job)
+        return listing
+
+
+Handler = Callable[[Job, Callable[[int], None] | None], Awaitable[Any]]
+
+
+class JobQueue:
+    """
+    Runs jobs from a JobStore on a fixed pool of workers, with at most
+    library_limit jobs of the same library running at once.
+
+    The handler receives the job and the progress callback it was submitted
+    with. It may set job.error to mark a job that partially failed.
+    """
+
+    def __init__(self, store: JobStore, handler: Handler,
+        workers: int = DEFAULT_WORKERS,
+        library_limit: int = DEFAULT_LIBRARY_LIMIT,
+        heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+        stale_after: float = DEFAULT_STALE_AFTER):
+        self.store = store
+        self.handler = handler
+        self.workers = workers
+        self.library_limit = library_limit
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self.logger = logging.getLogger(__name__)
+        self._queue: asyncio.Queue[Job] = asyncio.Queue()
+        self._futures: dict[int, asyncio.Future] = {}
+        self._progress: dict[int, Callable[[int], None]] = {}
+        self._libraries: dict[str, asyncio.Semaphore] = {}
+        self._workers: list[asyncio.Task] = []
+        self._heartbeat: asyncio.Task | None = None
+
+    @property
+    def started(self) -> bool:
+        return bool(self._workers)
+
+    async def start(self) -> list[tuple[Job, asyncio.Future]]:
+        """
+        Starts the workers and requeues unfinished jobs from a previous run,
+        returning them with the futures their results will be set on.
+        """
+        # Checking in first keeps other processes from taking over the jobs
+        # this one is about to recover.
+        await asyncio.to_thread(self.store.heartbeat)
+        self._heartbeat = asyncio.create_task(self._beat())
+        recovered = []
+        for job in await asyncio.to_thread(self.store.recover,
+                                           self.stale_after):
+            self.logger.info(f'Recovering upload job {job.id} '
+                             f'({job.filename})')
+            recovered.append((job, self._enqueue(job)))
+        self._workers = [asyncio.create_task(self._work())
+                         for _ in range(self.workers)]
+        return recovered
+
+    async def close(self):
+        tasks = list(self._workers)
+        if self._heartbeat is not None:
+            tasks.append(self._heartbeat)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._heartbeat = None
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+
+    async def submit(self, job: Job,
+        progress: Callable[[int], None] | None = None) -> asyncio.Future:
+        await asyncio.to_thread(self.store.add, job)
+        if progress is not None:
+            self._progress[job.id] = progress
+        return self._enqueue(job)
+
+    def _enqueue(self, job: Job) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._futures[job.id] = future
+        self._queue.put_nowait(job)
+        return future
+
+    async def _beat(self):
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await asyncio.to_thread(self.store.heartbeat)
+            except Exception as e:
+                self.logger.warning(f'Job store heartbeat failed: {e!r}')
+
+    def _library(self, library: str) -> asyncio.Semaphore:
+        if library not in self._libraries:
+            self._libraries[library] = asyncio.Semaphore(self.library_limit)
+        return self._libraries[library]
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                async with self._library(job.library):
+                    await self._run(job)
+            except Exception as e:
+                # A worker lost here would leave the pool short for good.
+                self.logger.error(f'Upload job {job.id} could not be run: '
+                                  f'{e!r}')
+            finally:
+                self._queue.task_done()
+
+    async def idle(self):
+        """Waits until no job is queued or running."""
+        await self._queue.join()
+
+    async def _run(self, job: Job):
+        future = self._futures.pop(job.id, None)
+        progress = self._progress.pop(job.id, None)
+        try:
+            job.state = JobState.ACTIVE
+            await asyncio.to_thread(self.store.update, job)
+            result = await self.handler(job, progress)
+        except Exception as e:
+            self.logger.warning(f'Upload job {job.id} failed: {e!r}')
+            job.state = JobState.FAILED
+            job.error = str(e) or type(e).__name__
+            if future is not None and not future.done():
+                future.set_exception(e)
+        else:
+            job.state = JobState.FAILED if job.error else JobState.DONE
+            if future is not None and not future.done():
+                future.set_result(result)
+        try:
+            await asyncio.to_thread(self.store.update, job)
+        except Exception as e:
+            # Left as it was in the store, the job is recovered by the next
+            # start once its owner has gone stale.
+            self.logger.warning(f'Could not record upload job {job.id} as '
+                                f'{job.state}: {e!r}')
+
+
+class ProgressReporter:
+    """
+    Sends at most one edit per interval seconds. Updates arriving in between
+    replace each other, so only the newest content is sent.
+    """
+
+    def __init__(self, edit: Callable[[str], Awaitable[Any]],
+        interval: float = DEFAULT_PROGRESS_INTERVAL):
+        self.edit = edit
+        self.interval = interval
+        self.logger = logging.getLogger(__name__)
+        self._content: str | None = None
+        self._sent: str | None = None
+        self._last_edit = 0.0
+        self._task: asyncio.Task | None = None
+
+    def update(self, content: str):
+        self._content = content
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(max(0.0, self._last_edit + self.interval
+                                - loop.time()))
+        self._task = None
+        await self._send(self._content)
+
+    async def _send(self, content: str | None):
+        if content is None or content == self._sent:
+            return
+        self._last_edit = asyncio.get_running_loop().time()
+        self._sent = content
+        try:
+            await self.edit(content)
+        except Exception as e:
+            self.logger.warning(f'Could not update progress: {e!r}')
+
+    async def finish(self, content: str):
+        """Sends content as the final edit, after any pending one."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(max(0.0, self._last_edit + self.interval
+                                - loop.time()))
+        await self._send(content)
+
+
+class BatchProgress:
+    """Renders byte progress of a set of jobs into one ProgressReporter."""
+
+    def __init__(self, reporter: ProgressReporter, jobs: list[Job]):
+        self.reporter = reporter
+        self.total = sum(job.size or 0 for job in jobs)
+        self.files = len(jobs)
+        self.finished = 0
+        self.received = 0
+        self.started = time.monotonic()
+
+    def add(self, received: int):
+        self.received += received
+        self.reporter.update(self.render())
+
+    def done(self, _: Any = None):
+        self.finished += 1
+        self.reporter.update(self.render())
+
+    def render(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-3)
+        content = (f'Uploading: {self.finished}/{self.files} files done, '
+                   f'{self.received / 1e6:.1f}')
+        if self.total:
+            content += f'/{self.total / 1e6:.1f}'
+        return content + f' MB ({self.received / elapsed / 1e6:.1f} MB/s)'
@@ -0,0 +1,287 @@
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+from multidict import CIMultiDictProxy
+
+from librarian.dependable.configuration import Configuration
+
+# Refresh the JWT this long before Kavita would reject it.
+TOKEN_EXPIRY_MARGIN = 60
+# Used when a token carries no readable 'exp' claim.
+DEFAULT_TOKEN_TTL = 600
+
+DEFAULT_PAGE_SIZE = 500
+# Responses kept for conditional requests.
+DEFAULT_RESPONSE_CACHE_SIZE = 256
+
+# Kavita FilterV2Dto enum values.
+FILTER_CONTAINS = 5
+FILTER_FIELD_LIBRARIES = 19
+FILTER_COMBINATION_AND = 1
+SORT_FIELD_SORT_NAME = 1
+
+
+def _token_lifetime(token: str) -> float:
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload))
+        return float(claims['exp']) - time.time()
+    except (IndexError, KeyError, TypeError, ValueError):
+        return DEFAULT_TOKEN_TTL
+
+
+def _cache_key(method: str, path: str, kwargs: dict[str, Any]) -> str:
+    return json.dumps([method, path, kwargs.get('params'),
+                       kwargs.get('json')], sort_keys=True, default=str)
+
+
+@dataclass
+class CachedResponse:
+    body: Any
+    headers: CIMultiDictProxy[str]
+    digest: bytes
+    etag: str | None
+    last_modified: str | None
+
+    def validators(self) -> dict[str, str]:
+        headers = {}
+        if self.etag is not None:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified is not None:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+@dataclass
+class ResponseStats:
+    # Answered 304 Not Modified.
+    not_modified: int = 0
+    # Answered in full, with the same body as before.
+    unchanged: int = 0
+    changed: int = 0
+
+
+class Kavita:
+    """
+    Client for Kavita's API. Requests made with cache=True remember their
+    response: they are sent with its ETag and Last-Modified, and when
+    Kavita answers 304 or sends the same body again, the previously parsed
+    body is returned as the very same object. Callers can therefore skip
+    rebuilding what they derived from it with an identity check, and must
+    not modify it.
+    """
+
+    def __init__(self, config: Configuration, user_agent: str | None = None):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        self._user_agent: str | None = user_agent
+        self._session: ClientSession | None = None
+        self._token: str | None = None
+        self._token_expiry: float = 0.0
+        self._refresh: asyncio.Future[str] | None = None
+        self.authentications = 0
+        self.trace_configs: list[TraceConfig] = []
+        self.response_stats = ResponseStats()
+        self._responses: OrderedDict[str, CachedResponse] = OrderedDict()
+
+    @property
+    def user_agent(self):
+        return self._user_agent
+
+    @user_agent.setter
+    def user_agent(self, value: str | None):
+        self._user_agent = value
+
+    @property
+    def base_url(self) -> str:
+        base_url: str | None = self.config.get('kavita_base_url')
+        if base_url is None:
+            raise RuntimeError("kavita_base_url is not configured.")
+        return base_url.rstrip('/')
+
+    @property
+    def session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            connection_limit = self.config.get('kavita_connection_limit', 16)
+            connector = TCPConnector(
+                limit=connection_limit,
+                limit_per_host=connection_limit,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+            )
+            self._session = ClientSession(
+                connector=connector,
+                timeout=ClientTimeout(
+                    total=self.config.get('kavita_timeout', 30)),
+                headers={'User-Agent': self.user_agent or 'Librarian'},
+                trace_configs=self.trace_configs,
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _authenticate(self) -> str:
+        self.authentications += 1
+        async with self.session.post(
+            f'{self.base_url}/api/Plugin/authenticate',
+            params={
+                'apiKey': self.config.get('kavita_api_key'),
+                'pluginName': 'librarian'
+            }) as resp:
+            resp.raise_for_status()
+            token: str = (await resp.json())['token']
+
+        lifetime = _token_lifetime(token) - TOKEN_EXPIRY_MARGIN
+        self._token = token
+        self._token_expiry = time.monotonic() + max(lifetime, 0.0)
+        self.logger.debug(f'Authenticated with Kavita, token valid for '
+                          f'{int(lifetime)}s')
+        return token
+
+    async def token(self) -> str:
+        if self._token is not None and time.monotonic() < self._token_expiry:
+            return self._token
+
+        # Everyone who needs a token while a refresh is running awaits the
+        # same request instead of authenticating on their own.
+        if self._refresh is None:
+            self._refresh = asyncio.ensure_future(self._authenticate())
+            self._refresh.add_done_callback(self._refresh_done)
+        return await asyncio.shield(self._refresh)
+
+    def _refresh_done(self, _: asyncio.Future):
+        self._refresh = None
+
+    def invalidate(self, token: str | None = None):
+        """
+        Forget the cached token. When token is given it is only dropped if it
+        is still the current one, so a burst of 401s refreshes only once.
+        """
+        if token is None or token == self._token:
+            self._token = None
+            self._token_expiry = 0.0
+
+    def forget(self):
+        """Drops the remembered responses, e.g. after the server changed."""
+        self._responses.clear()
+
+    async def _request(self, method: str, path: str, cache: bool = False,
+        **kwargs) -> tuple[Any, CIMultiDictProxy[str]]:
+        headers = kwargs.pop('headers', {})
+        key = _cache_key(method, path, kwargs) if cache else None
+        cached = self._responses.get(key) if key is not None else None
+        if cached is not None:
+            headers = {**headers, **cached.validators()}
+        for attempt in range(2):
+            token = await self.token()
+            async with self.session.request(
+                method, f'{self.base_url}{path}',
+                headers={**headers, 'Authorization': f'Bearer {token}'},
+                **kwargs) as resp:
+                if resp.status == 401 and attempt == 0:
+                    self.logger.debug(f'{method} {path} returned 401, '
+                                      f'refreshing token')
+                    self.invalidate(token)
+                    continue
+                if resp.status == 304 and cached is not None:
+                    self.response_stats.not_modified += 1
+                    self._responses.move_to_end(key)
+                    return cached.body, cached.headers
+                resp.raise_for_status()
+                if resp.content_type != 'application/json':
+                    return None, resp.headers
+                if key is None:
+                    return await resp.json(), resp.headers
+                return self._remember(key, cached, await resp.read(),
+                                      resp.headers), resp.headers
+
+    def _remember(self, key: str, cached: CachedResponse | None, raw: bytes,
+        headers: CIMultiDictProxy[str]) -> Any:
+        # Without validators from Kavita, an unchanged body is still
+        # recognised by its digest and not parsed again.
+        digest = hashlib.blake2b(raw, digest_size=16).digest()
+        if cached is not None and cached.digest == digest:
+            self.response_stats.unchanged += 1
+            body = cached.body
+        else:
+            self.response_stats.changed += 1
+            body = json.loads(raw)
+        self._responses[key] = CachedResponse(
+            body, headers, digest, headers.get('ETag'),
+            headers.get('Last-Modified'))
+        self._responses.move_to_end(key)
+        while len(self._responses) > self.config.get(
+                'kavita_response_cache_size', DEFAULT_RESPONSE_CACHE_SIZE):
+            self._responses.popitem(last=False)
+        return body
+
+    async def request(self, method: str, path: str, **kwargs) -> Any:
+        body, _ = await self._request(method, path, **kwargs)
+        return body
+
+    async def libraries(self) -> list[dict[str, Any]]:
+        return await self.request('GET', '/api/Library/libraries',
+                                  cache=True)
+
+    async def iter_series(self, library_id: int,
+        page_size: int | None = None) -> AsyncIterator[list[dict[str, Any]]]:
+        """
+        Yields the series of one library a page at a time, so callers can
+        start using results before the whole library has been transferred.
+        """
+        page_size = page_size or self.config.get('kavita_series_page_size',
+                                                 DEFAULT_PAGE_SIZE)
+        series_filter = {
+            'statements': [{
+                'comparison': FILTER_CONTAINS,
+                'field': FILTER_FIELD_LIBRARIES,
+                'value': str(library_id),
+            }],
+            'combination': FILTER_COMBINATION_AND,
+            'sortOptions': {'sortField': SORT_FIELD_SORT_NAME,
+                            'isAscending': True},
+            'limitTo': 0,
+        }
+        page_number = 1
+        while True:
+            page, headers = await self._request(
+                'POST', '/api/Series/all-v2', cache=True,
+                params={'PageNumber': page_number, 'PageSize': page_size},
+                json=series_filter)
+            if page:
+                yield page
+
+            try:
+                pagination = json.loads(headers.get('Pagination', ''))
+                last_page = page_number >= pagination['totalPages']
+            except (KeyError, TypeError, ValueError):
+                last_page = len(page) < page_size
+            if last_page or not page:
+                return
+            page_number += 1
+
+    async def series(self, library_id: int) -> list[dict[str, Any]]:
+        return [series async for page in self.iter_series(library_id)
+                for series in page]
+
+    async def scan_library(self, library_id: int, force: bool = False):
+        await self.request('POST', '/api/Library/scan',
+                           params={'libraryId': library_id,
+                                   'force': str(force).lower()})
+
+    async def scan_folder(self, folder_path: str):
+        await self.request('POST', '/api/Library/scan-folder',
+                           json={'apiKey': self.config.get('kavita_api_key'),
+                                 'folderPath': folder_path})
@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left, insort
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from librarian.dependable.search import DEFAULT_LIMIT, SearchIndex
+from librarian.dependable.watch import Watcher
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RECONCILE_INTERVAL = 10 * 60
+DEFAULT_WALK_WORKERS = 8
+
+# Per library, per series, the sorted names of the files in it. Tuples cost
+# a pointer per name, a fraction of what sets would.
+Tree = dict[str, dict[str, tuple[str, ...]]]
+
+
+def _directories(directory: Path) -> list[str]:
+    try:
+        with os.scandir(directory) as entries:
+            return [entry.name for entry in entries
+                    if not entry.name.startswith('.') and entry.is_dir()]
+    except OSError:
+        return []
+
+
+def _files(directory: Path) -> tuple[str, ...] | None:
+    try:
+        with os.scandir(directory) as entries:
+            return tuple(sorted(entry.name for entry in entries
+                                if not entry.name.startswith('.')
+                                and entry.is_file()))
+    except OSError:
+        return None
+
+
+def _library(directory: Path) -> dict[str, tuple[str, ...] | None] | None:
+    if not directory.is_dir():
+        return None
+    return {series: _files(directory / series)
+            for series in _directories(directory)}
+
+
+def _indexed(listings: dict[str, tuple[str, ...] | None] | None
+) -> tuple[dict[str, tuple[str, ...] | None] | None, SearchIndex | None]:
+    if listings is None:
+        return None, None
+    return listings, SearchIndex(series for series, files in listings.items()
+                                 if files is not None)
+
+
+def walk(root: Path, workers: int = DEFAULT_WALK_WORKERS) -> Tree:
+    """Lists root/<library>/<series>/, one series directory per thread."""
+    libraries = {library: _directories(root / library)
+                 for library in _directories(root)}
+    directories = [(library, series) for library, series_names
+                   in libraries.items() for series in series_names]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        listings = executor.map(
+            lambda entry: _files(root / entry[0] / entry[1]), directories)
+        tree: Tree = {library: {} for library in libraries}
+        for (library, series), files in zip(directories, listings):
+            if files is not None:
+                tree[library][series] = files
+    return tree
+
+
+class LibraryIndex:
+    """
+    The files below root/<library>/<series>/, walked once in parallel and
+    then kept current by a Watcher, with a full walk every
+    reconcile_interval seconds for whatever the watcher missed. Lookups
+    only read memory, so they keep working while Kavita is unavailable.
+
+    Without inotify, or once inotify runs out of watches, only root and
+    the library directories are watched; files then only show up through
+    uploads and reconciliation.
+    """
+
+    def __init__(self, root: Path | str,
+        reconcile_interval: float = DEFAULT_RECONCILE_INTERVAL,
+        workers: int = DEFAULT_WALK_WORKERS):
+        self.root = Path(root)
+        self.reconcile_interval = reconcile_interval
+        self.workers = workers
+        self.walk_seconds: float | None = None
+        self._tree: Tree = {}
+        self._series_search: dict[str, SearchIndex] = {}
+        self._watcher = Watcher(self._changed)
+        self._watch_series = True
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._updates: set[asyncio.Task] = set()
+
+    def __contains__(self, library: str) -> bool:
+        return library in self._tree
+
+    @property
+    def ready(self) -> bool:
+        return self.walk_seconds is not None
+
+    @property
+    def files_total(self) -> int:
+        return sum(len(files) for series in self._tree.values()
+                   for files in series.values())
+
+    def start(self):
+        if self._task is None:
+            self._watcher.start()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        self._watcher.close()
+        tasks = list(self._updates)
+        if self._task is not None:
+            tasks.append(self._task)
+            self._task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def libraries(self) -> list[str]:
+        return list(self._tree)
+
+    def series(self, library: str) -> list[str]:
+        return list(self._tree.get(library, ()))
+
+    def search_series(self, library: str, query: str,
+        limit: int = DEFAULT_LIMIT) -> list[str]:
+        index = self._series_search.get(library)
+        return [] if index is None else index.search(query, limit)
+
+    def files(self, library: str, series: str) -> tuple[str, ...]:
+        return self._tree.get(library, {}).get(series, ())
+
+    def count(self, library: str, series: str) -> int:
+        return len(self.files(library, series))
+
+    def exists(self, library: str, series: str, filename: str) -> bool:
+        files = self.files(library, series)
+        position = bisect_left(files, filename)
+        return position < len(files) and files[position] == filename
+
+    def record(self, library: str, series: str, filename: str):
+        """Adds a file written by the bot without waiting for the watcher."""
+        self._set_file(library, series, filename, True)
+
+    async def reconcile(self):
+        async with self._lock:
+            started = time.perf_counter()
+            # The search indexes are built next to the walk, off the loop.
+            tree, series_search = await asyncio.to_thread(self._walk)
+            self._tree = tree
+            self._series_search = series_search
+            self._sync_watches()
+            self.walk_seconds = time.perf_counter() - started
+        logger.info(f'Indexed {self.files_total} files in {len(tree)} '
+                    f'libraries in {self.walk_seconds:.2f}s')
+
+    def _walk(self) -> tuple[Tree, dict[str, SearchIndex]]:
+        tree = walk(self.root, self.workers)
+        return tree, {library: SearchIndex(series)
+                      for library, series in tree.items()}
+
+    async def _run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning(f'Walking {self.root} failed: {e!r}')
+            await asyncio.sleep(self.reconcile_interval)
+
+    def _sync_watches(self):
+        wanted = {self.root / library for library in self._tree}
+        if self.root.is_dir():
+            wanted.add(self.root)
+        if self._watch_series and self._watcher.backend == 'inotify':
+            wanted |= {self.root / library / series
+                       for library, series_names in self._tree.items()
+                       for series in series_names}
+        watched = set(self._watcher.directories)
+        for directory in watched - wanted:
+            self._watcher.remove(directory)
+        # Outer directories first, they matter most when watches run out.
+        for directory in sorted(wanted - watched,
+                                key=lambda path: len(path.parts)):
+            self._watcher.add(directory)
+        if self._watch_series and self._watcher.exhausted:
+            # Watching some series but not others would silently miss
+            # changes, so series are left to reconciliation altogether.
+            self._watch_series = False
+            logger.warning(f'Out of inotify watches, only watching the '
+                           f'libraries in {self.root}; changes inside series '
+                           f'are picked up every '
+                           f'{self.reconcile_interval:g}s')
+            self._sync_watches()
+
+    def _changed(self, paths: set[Path]):
+        task = asyncio.create_task(self._apply(paths))
+        self._updates.add(task)
+        task.add_done_callback(self._updates.discard)
+
+    async def _apply(self, paths: set[Path]):
+        if self.root in paths:
+            await self.reconcile()
+            return
+        async with self._lock:
+            for path in paths:
+                try:
+                    parts = path.relative_to(self.root).parts
+                except ValueError:
+                    continue
+                if any(part.startswith('.') for part in parts):
+                    continue
+                if len(parts) == 1:
+                    self._set_library(parts[0], *await asyncio.to_thread(
+                        lambda: _indexed(_library(path))))
+                elif len(parts) == 2:
+                    self._set_series(*parts, await asyncio.to_thread(
+                        _files, path))
+                elif len(parts) == 3:
+                    self._set_file(*parts, await asyncio.to_thread(
+                        path.is_file))
+            self._sync_watches()
+
+    def _set_library(self, library: str,
+        listings: dict[str, tuple[str, ...] | None] | None,
+        index: SearchIndex | None):
+        if listings is None:
+            self._tree.pop(library, None)
+            self._series_search.pop(library, None)
+            return
+        self._tree[library] = {series: files for series, files
+                               in listings.items() if files is not None}
+        self._series_search[library] = index
+
+    def _set_series(self, library: str, series: str,
+        files: tuple[str, ...] | None):
+        series_names = self._tree.setdefault(library, {})
+        index = self._series_search.setdefault(library, SearchIndex())
+        if files is None:
+            series_names.pop(series, None)
+            index.remove(series)
+        else:
+            series_names[series] = files
+            index.add(series)
+
+    def _set_file(self, library: str, series: str, filename: str,
+        exists: bool):
+        files = list(self.files(library, series))
+        position = bisect_left(files, filename)
+        present = position < len(files) and files[position] == filename
+        if exists and not present:
+            insort(files, filename)
+        elif present and not exists:
+            del files[position]
+        else:
+            return
+        if library in self._tree and series in self._tree[library]:
+            self._tree[library][series] = tuple(files)
+        else:
+            self._set_series(library, series, tuple(files))
@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from collections import deque
+from types import SimpleNamespace
+from typing import Callable, Iterator
+
+from aiohttp import (TraceConfig, TraceRequestEndParams,
+                     TraceRequestExceptionParams, TraceRequestStartParams, web)
+
+from librarian.dependable.cache import AsyncTTLCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                           2.5, 5.0, 10.0, 30.0)
+DEFAULT_LOOP_LAG_INTERVAL = 0.5
+DEFAULT_LOOP_LAG_WINDOW = 600
+DEFAULT_METRICS_HOST = '127.0.0.1'
+
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"',
+                                                                    '\\"')
+
+
+def _format_labels(names: Labels, values: Labels,
+    extra: str | None = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"'
+             for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str,
+        labels: Labels = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} {self.type}'
+        yield from self.samples()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str,
+        labels: Labels = ()):
+        super().__init__(name, documentation, labels)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, *labels: str, value: float):
+        """For counters maintained elsewhere and copied in on collection."""
+        self.values[labels] = value
+
+    def samples(self) -> Iterator[str]:
+        for labels, value in self.values.items():
+            yield (f'{self.name}{_format_labels(self.label_names, labels)} '
+                   f'{_format_value(value)}')
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str,
+        labels: Labels = (),
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        # Per label set: non-cumulative bucket counts, sum and count.
+        self.values: dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * len(self.buckets), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> Iterator[str]:
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                bucket_labels = _format_labels(
+                    self.label_names, labels, f'le="{_format_value(bound)}"')
+                yield f'{self.name}_bucket{bucket_labels} {cumulative}'
+            formatted = _format_labels(self.label_names, labels)
+            yield f'{self.name}_sum{formatted} {_format_value(total)}'
+            yield f'{self.name}_count{formatted} {count}'
+
+
+class Registry:
+    """
+    Holds the bot's metrics. Recording is a dict lookup and an increment;
+    collectors registered with add_collector only run when the metrics are
+    rendered.
+    """
+
+    def __init__(self, prefix: str = 'librarian'):
+        self.prefix = prefix
+        self.metrics: dict[str, Metric] = {}
+        self.collectors: list[Callable[[], None]] = []
+
+    def _get(self, kind: type, name: str, documentation: str,
+        labels: Labels, **kwargs) -> Metric:
+        name = f'{self.prefix}_{name}'
+        metric = self.metrics.get(name)
+        if metric is None:
+            metric = self.metrics[name] = kind(name, documentation, labels,
+                                               **kwargs)
+        return metric
+
+    def counter(self, name: str, documentation: str,
+        labels: Labels = ()) -> Counter:
+        return self._get(Counter, name, documentation, labels)
+
+    def gauge(self, name: str, documentation: str,
+        labels: Labels = ()) -> Gauge:
+        return self._get(Gauge, name, documentation, labels)
+
+    def histogram(self, name: str, documentation: str,
+        labels: Labels = (),
+        buckets: tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, documentation, labels,
+                         buckets=buckets)
+
+    def add_collector(self, collector: Callable[[], None]):
+        self.collectors.append(collector)
+
+    def remove_collector(self, collector: Callable[[], None]):
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f'Metrics collector failed: {e!r}')
+        lines = [line for metric in self.metrics.values()
+                 for line in metric.render()]
+        return '\n'.join(lines) + '\n'
+
+    def track_cache(self, cache: AsyncTTLCache) -> Callable[[], None]:
+        """
+        Exports the statistics of cache. Returns the collector, to be
+        removed again when the cache goes away.
+        """
+        events = self.counter('cache_events_total',
+                              'Cache lookups by result, refreshes and '
+                              'failed refreshes.', ('cache', 'event'))
+        ratio = self.gauge('cache_hit_ratio',
+                           'Lookups answered without waiting for a fetch.',
+                           ('cache',))
+
+        def collect():
+            stats = cache.stats
+            for event in ('hits', 'misses', 'stale', 'refreshes', 'errors',
+                          'timeouts'):
+                events.set(cache.name, event, value=getattr(stats, event))
+            lookups = stats.hits + stats.stale + stats.misses
+            ratio.set(cache.name, value=(stats.hits + stats.stale) / lookups
+                      if lookups else 0.0)
+
+        self.add_collector(collect)
+        return collect
+
+    def trace_config(self, client: str, by_path: bool = True) -> TraceConfig:
+        """
+        aiohttp tracing that records request latency for client, labelled
+        by URL path, or only by host for URLs that are unique per request.
+        """
+        latency = self.histogram('http_request_duration_seconds',
+                                 'Outgoing HTTP request latency.',
+                                 ('client', 'endpoint', 'status'))
+
+        async def start(_, context: SimpleNamespace,
+            params: TraceRequestStartParams):
+            context.started = time.perf_counter()
+
+        def record(context: SimpleNamespace, params, status: str):
+            endpoint = params.url.path if by_path else params.url.host
+            latency.observe(time.perf_counter() - context.started,
+                            client, endpoint or '', status)
+
+        async def end(_, context: SimpleNamespace,
+            params: TraceRequestEndParams):
+            record(context, params, str(params.response.status))
+
+        async def exception(_, context: SimpleNamespace,
+            params: TraceRequestExceptionParams):
+            record(context, params, type(params.exception).__name__)
+
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(start)
+        trace_config.on_request_end.append(end)
+        trace_config.on_request_exception.append(exception)
+        return trace_config
+
+
+class LoopLagMonitor:
+    """
+    Records how late the event loop wakes up from a sleep of interval, and
+    keeps the last window of those delays in recent.
+    """
+
+    def __init__(self, registry: Registry,
+        interval: float = DEFAULT_LOOP_LAG_INTERVAL,
+        window: int = DEFAULT_LOOP_LAG_WINDOW):
+        self.interval = interval
+        self.histogram = registry.histogram(
+            'event_loop_lag_seconds', 'Delay of event loop wake-ups.',
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+        self.recent: deque[float] = deque(maxlen=window)
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - started - self.interval)
+            self.histogram.observe(lag)
+            self.recent.append(lag)
+
+
+class MetricsServer:
+    """Serves the registry in Prometheus text format on /metrics."""
+
+    def __init__(self, registry: Registry, host: str, port: int):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: web.AppRunner | None = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self._metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logger.info(f'Serving metrics on http://{self.host}:{self.port}'
+                    f'/metrics')
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _metrics(self, _: web.Request) -> web.Response:
+        return web.Response(
+            body=self.registry.render().encode(),
+            headers={'Content-Type': 'text/plain; version=0.0.4; '
+                                     'charset=utf-8'})
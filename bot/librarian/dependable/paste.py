@@ -1,10 +1,28 @@
+import asyncio
+import gzip
+import hashlib
+import logging
+import time
+from collections import OrderedDict
 from enum import Enum
 
-from aiohttp import ClientSession
+from aiohttp import (ClientConnectionError, ClientResponseError,
+                     ClientSession, ClientTimeout, TCPConnector, TraceConfig)
 
 from librarian.dependable.exceptions import PasteFailedException
 from librarian.dependable.configuration import Configuration
 
+DEFAULT_RETRIES = 3
+DEFAULT_CACHE_SIZE = 128
+# Remembered URLs are dropped well before the paste service expires them.
+DEFAULT_CACHE_TTL = 12 * 60 * 60
+# Bodies at least this large are sent gzip compressed.
+DEFAULT_GZIP_THRESHOLD = 1024
+# Content larger than this is split into parts behind an index paste.
+DEFAULT_MAX_SIZE = 8 * 1024 * 1024
+# Compressing this much or more is moved off the event loop.
+_THREADED_GZIP_SIZE = 256 * 1024
+
 
 class TextTypes(str, Enum):
     PLAIN = 'text/plain'
@@ -48,10 +66,21 @@ class TextTypes(str, Enum):
 
 
 class Paste:
+    """
+    Client for the paste service, with a pooled session, retries, gzip
+    request bodies and an LRU of content already pasted.
+    """
+
     def __init__(self, config: Configuration, user_agent: str | None = None):
         self.client: ClientSession | None = None
         self.config = config
+        self.logger = logging.getLogger(__name__)
         self._user_agent: str | None = user_agent
+        # Content key to URL and when it was pasted.
+        self._urls: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        # Cleared once the server rejects a compressed body.
+        self._gzip = True
+        self.trace_configs: list[TraceConfig] = []
         # self.user_agent = user_agent
 
     @property
@@ -62,30 +91,137 @@ class Paste:
     def user_agent(self, value: str | None):
         self._user_agent = value
 
-    async def _setup_http_session(self):
-        self.client = ClientSession()
+    @property
+    def session(self) -> ClientSession:
+        if self.client is None or self.client.closed:
+            limit = self.config.get('paste_connection_limit', 4)
+            self.client = ClientSession(
+                connector=TCPConnector(limit=limit, ttl_dns_cache=300,
+                                       keepalive_timeout=60),
+                timeout=ClientTimeout(
+                    total=self.config.get('paste_timeout', 30)),
+                trace_configs=self.trace_configs)
+        return self.client
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    def forget(self):
+        """Drops the remembered URLs, e.g. after the paste server changed."""
+        self._urls.clear()
 
     async def paste(self, content: str | bytes,
         content_type: str | TextTypes = 'text/plain') -> str:
-        if self.client is None:
-            await self._setup_http_session()
-
+        """
+        Pastes content and returns its URL. Content pasted within the last
+        paste_cache_ttl seconds is not uploaded again.
+        """
+        data = content.encode() if isinstance(content, str) else content
+        key = hashlib.blake2b(str(content_type).encode() + b'\0' + data,
+                              digest_size=16).hexdigest()
+        cached = self._urls.get(key)
+        if cached is not None:
+            url, pasted = cached
+            if time.monotonic() - pasted < self.config.get(
+                    'paste_cache_ttl', DEFAULT_CACHE_TTL):
+                self._urls.move_to_end(key)
+                return url
+            del self._urls[key]
+
+        max_size = self.config.get('paste_max_size', DEFAULT_MAX_SIZE)
+        if len(data) > max_size:
+            url = await self._paste_parts(data, content_type, max_size)
+        else:
+            url = await self._post(data, content_type)
+
+        self._urls[key] = (url, time.monotonic())
+        while len(self._urls) > self.config.get('paste_cache_size',
+                                                DEFAULT_CACHE_SIZE):
+            self._urls.popitem(last=False)
+        return url
+
+    async def _paste_parts(self, data: bytes,
+        content_type: str | TextTypes, max_size: int) -> str:
+        parts = _split(data, max_size)
+        urls = await asyncio.gather(*(self._post(part, content_type)
+                                      for part in parts))
+        index = '\n'.join(f'Part {number}/{len(urls)}: {url}'
+                          for number, url in enumerate(urls, 1))
+        return await self._post(index.encode(), TextTypes.PLAIN)
+
+    async def _post(self, data: bytes,
+        content_type: str | TextTypes) -> str:
         paste_api_url: str | None = self.config.get('paste_api_url')
+        if paste_api_url is None:
+            raise PasteFailedException('paste_api_url is not configured.')
+
+        compressed = None
+        if self._gzip and len(data) >= self.config.get(
+                'paste_gzip_threshold', DEFAULT_GZIP_THRESHOLD):
+            compressed = await asyncio.to_thread(gzip.compress, data) \
+                if len(data) >= _THREADED_GZIP_SIZE else gzip.compress(data)
+
+        retries = self.config.get('paste_retries', DEFAULT_RETRIES)
+        attempt = 0
+        while True:
+            headers = {'Content-Type': str(content_type),
+                       'User-Agent': self.user_agent or 'Librarian'}
+            body = data
+            if compressed is not None and self._gzip:
+                headers['Content-Encoding'] = 'gzip'
+                body = compressed
+            try:
+                async with self.session.post(paste_api_url + '/post',
+                                             headers=headers,
+                                             data=body) as post:
+                    if post.status in (400, 415) and body is compressed:
+                        self.logger.info('Paste server rejected gzip, '
+                                         'sending uncompressed bodies')
+                        self._gzip = False
+                        continue
+                    post.raise_for_status()
+                    json: dict[str, str] = await post.json(content_type=None)
+            except Exception as e:
+                if not _retryable(e) or attempt >= retries:
+                    raise PasteFailedException(str(e)) from e
+                delay = 0.5 * 2 ** attempt
+                self.logger.warning(f'Paste failed ({e!r}), retrying in '
+                                    f'{delay:.1f}s')
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
 
-        print(paste_api_url)
-        print(content_type)
-
-        http_client = self.client
-        async with http_client.post(
-            paste_api_url + '/post',
-            headers={
-                'Content-Type': str(content_type),
-                'User-Agent': self.user_agent
-            },
-            data=content,
-        ) as post:
-            json: dict[str, str] = await post.json()
             key = json.get('key')
             if key is None:
                 raise PasteFailedException
             return f'{self.config.get('paste_frontend_url')}/{key}'
+
+
+def _retryable(error: Exception) -> bool:
+    if isinstance(error, ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return isinstance(error, (ClientConnectionError, TimeoutError))
+
+
+def _split(data: bytes, max_size: int) -> list[bytes]:
+    """
+    Splits data into parts of at most max_size, at line ends if any and
+    otherwise between UTF-8 characters.
+    """
+    parts = []
+    start = 0
+    while len(data) - start > max_size:
+        end = data.rfind(b'\n', start, start + max_size) + 1
+        if end <= start:
+            end = start + max_size
+            # Back off from continuation bytes to the start of a character.
+            while end > start and data[end] & 0xC0 == 0x80:
+                end -= 1
+            if end == start:
+                end = start + max_size
+        parts.append(data[start:end])
+        start = end
+    parts.append(data[start:])
+    return parts
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from types import FrameType
+
+DEFAULT_PROFILE_SECONDS = 30
+DEFAULT_PROFILE_INTERVAL = 0.01
+DEFAULT_SLOW_CALLBACK = 0.1
+# How often the event loop reports that it is still turning.
+_BEAT_INTERVAL = 0.01
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    return (f'{code.co_qualname} '
+            f'({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+
+
+def _collapse(thread: str, frame: FrameType | None) -> str:
+    """A stack as 'thread;outermost;...;innermost', like flamegraph.pl."""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    names.append(thread.replace(';', ':'))
+    return ';'.join(reversed(names))
+
+
+@dataclass
+class Stall:
+    """A stretch where the event loop ran no callbacks, and what it ran."""
+    at: float
+    seconds: float
+    stack: str | None
+
+
+@dataclass
+class Profile:
+    seconds: float
+    samples: int = 0
+    stacks: Counter[str] = field(default_factory=Counter)
+    stalls: list[Stall] = field(default_factory=list)
+
+    def collapsed(self) -> str:
+        """
+        The sampled stacks in collapsed form, one 'stack count' per line and
+        the heaviest first, preceded by '#' comments on the loop stalls.
+        """
+        lines = [f'# {self.samples} samples over {self.seconds:.1f}s, '
+                 f'{len(self.stalls)} loop stalls']
+        for stall in self.stalls:
+            lines.append(f'# stall at +{stall.at:.2f}s for '
+                         f'{stall.seconds * 1000:.0f}ms: '
+                         f'{stall.stack or "unknown"}')
+        lines.extend(f'{stack} {count}'
+                     for stack, count in self.stacks.most_common())
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of every thread each interval seconds from a thread
+    of its own, and records stalls of the event loop longer than
+    slow_callback seconds along with the stack the loop was stuck in.
+
+    Nothing runs outside of run(), and while it does the sampled threads
+    are not touched beyond the GIL being taken once per interval.
+    """
+
+    def __init__(self, interval: float = DEFAULT_PROFILE_INTERVAL,
+        slow_callback: float = DEFAULT_SLOW_CALLBACK):
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._loop_thread: int | None = None
+        self._beat = 0.0
+        self._stall_stacks: Counter[str] = Counter()
+
+    async def run(self, seconds: float) -> Profile:
+        """Profiles the running process for seconds seconds."""
+        self._loop_thread = threading.get_ident()
+        self._beat = time.perf_counter()
+        self._stop.clear()
+        profile = Profile(seconds)
+        sampler = threading.Thread(target=self._sample, args=(profile,),
+                                   name='Librarian profiler', daemon=True)
+        heartbeat = asyncio.create_task(self._heartbeat(profile))
+        sampler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self._stop.set()
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+            await asyncio.to_thread(sampler.join)
+        return profile
+
+    def _sample(self, profile: Profile):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+            stalled = time.perf_counter() - self._beat > \
+                _BEAT_INTERVAL + self.slow_callback
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if ident == self._loop_thread:
+                    stack = _collapse('event loop', frame)
+                    if stalled:
+                        with self._lock:
+                            self._stall_stacks[stack] += 1
+                else:
+                    stack = _collapse(names.get(ident, str(ident)), frame)
+                profile.stacks[stack] += 1
+            profile.samples += 1
+
+    async def _heartbeat(self, profile: Profile):
+        started = self._beat
+        while True:
+            await asyncio.sleep(_BEAT_INTERVAL)
+            now = time.perf_counter()
+            lag = now - self._beat - _BEAT_INTERVAL
+            self._beat = now
+            with self._lock:
+                stacks, self._stall_stacks = self._stall_stacks, Counter()
+            if lag > self.slow_callback:
+                stack = stacks.most_common(1)[0][0] if stacks else None
+                profile.stalls.append(Stall(now - lag - started, lag, stack))
@@ -0,0 +1,140 @@
+import importlib.util
+import io
+import logging
+import os
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+
+from librarian.dependable.files import _fsync_directory
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RECOMPRESS_FORMAT = 'webp'
+DEFAULT_RECOMPRESS_QUALITY = 80
+DEFAULT_RECOMPRESS_WORKERS = 1
+DEFAULT_RECOMPRESS_NICENESS = 10
+
+# Pillow format name and file extension per configurable format.
+FORMATS = {
+    'webp': ('WEBP', '.webp'),
+    'jpeg': ('JPEG', '.jpg'),
+}
+# Pages already in the target format are not encoded a second time.
+_SAME_FORMAT = {
+    'WEBP': {'.webp'},
+    'JPEG': {'.jpg', '.jpeg'},
+}
+# Animated GIFs would lose their frames, so they are left alone.
+_PAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.webp', '.tif',
+                    '.tiff'}
+
+
+def available() -> bool:
+    """Whether Pillow is installed; re-encoding is skipped otherwise."""
+    return importlib.util.find_spec('PIL') is not None
+
+
+@dataclass
+class Recompression:
+    original_size: int
+    size: int
+    pages: int = 0
+
+    @property
+    def saved(self) -> int:
+        return max(0, self.original_size - self.size)
+
+
+def lower_priority(niceness: int) -> None:
+    """Process pool initializer keeping re-encoding behind everything else."""
+    try:
+        os.nice(niceness)
+    except (AttributeError, OSError):
+        pass
+
+
+def _encode(data: bytes, image_format: str, quality: int) -> bytes:
+    # Imported here, so only the worker processes pay for Pillow.
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as image:
+        if getattr(image, 'n_frames', 1) > 1:
+            raise ValueError('animated image')
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            image = image.convert('RGBA' if 'transparency' in image.info
+                                  else 'RGB')
+        encoded = io.BytesIO()
+        image.save(encoded, image_format, quality=quality,
+                   **({'optimize': True} if image_format == 'JPEG' else {}))
+        return encoded.getvalue()
+
+
+def _repack(source: zipfile.ZipFile, target: zipfile.ZipFile,
+    image_format: str, extension: str, quality: int) -> int:
+    names = {member.filename for member in source.infolist()}
+    pages = 0
+    for member in source.infolist():
+        data = source.read(member)
+        name = member.filename
+        compress_type = member.compress_type
+        path = PurePosixPath(name)
+        if path.suffix.lower() in _PAGE_EXTENSIONS and \
+                path.suffix.lower() not in _SAME_FORMAT[image_format] and \
+                not path.name.startswith('.'):
+            renamed = str(path.with_suffix(extension))
+            try:
+                encoded = _encode(data, image_format, quality)
+            except Exception as e:
+                logger.debug(f'Keeping {name} as is: {e!r}')
+            else:
+                # A page only changes if that makes it smaller and does not
+                # clash with another member's name.
+                if len(encoded) < len(data) and (
+                        renamed == name or renamed not in names):
+                    names.add(renamed)
+                    data, name = encoded, renamed
+                    pages += 1
+            # Pages are compressed already, deflating them again is wasted
+            # work for the reader.
+            compress_type = zipfile.ZIP_STORED
+        info = zipfile.ZipInfo(name, date_time=member.date_time)
+        info.external_attr = member.external_attr
+        target.writestr(info, data, compress_type)
+    return pages
+
+
+def recompress(path: Path | str,
+    image_format: str = DEFAULT_RECOMPRESS_FORMAT,
+    quality: int = DEFAULT_RECOMPRESS_QUALITY) -> Recompression:
+    """
+    Repacks the comic archive at path with its pages re-encoded, page by
+    page from zip to zip. The repacked archive replaces path only if it is
+    smaller. Runs in a worker process.
+    """
+    if not available():
+        raise RuntimeError('Pillow is not installed')
+    pillow_format, extension = FORMATS[image_format]
+    path = Path(path)
+    original_size = path.stat().st_size
+    fd, temporary = tempfile.mkstemp(prefix=f'.{path.name}.',
+                                     suffix='.repack', dir=path.parent)
+    try:
+        with open(fd, 'wb') as file:
+            with zipfile.ZipFile(path) as source, \
+                    zipfile.ZipFile(file, 'w') as target:
+                pages = _repack(source, target, pillow_format, extension,
+                                quality)
+            file.flush()
+            os.fsync(file.fileno())
+            size = file.tell()
+        if not pages or size >= original_size:
+            return Recompression(original_size, original_size)
+        os.replace(temporary, path)
+    finally:
+        Path(temporary).unlink(missing_ok=True)
+    _fsync_directory(path.parent)
+    return Recompression(original_size, size, pages)
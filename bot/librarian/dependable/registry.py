@@ -0,0 +1,95 @@
+import importlib
+import logging
+import sys
+import time
+from dataclasses import dataclass
+from pkgutil import iter_modules
+from typing import TYPE_CHECKING
+
+from disnake.ext.commands import Cog
+
+if TYPE_CHECKING:
+    from librarian.dependable.bot_overload import LibrarianBot
+
+DEFAULT_COG_PACKAGE = 'librarian.cogs'
+
+
+def _cog_name(module: str) -> str:
+    return ''.join(word.capitalize() for word in module.split('_'))
+
+
+@dataclass
+class CogEntry:
+    """A cog module; its cog class is named like the module in CamelCase."""
+    module: str
+    name: str
+    import_seconds: float | None = None
+    setup_seconds: float | None = None
+
+    def timings(self) -> str:
+        if self.import_seconds is None:
+            return 'not imported'
+        return (f'import {self.import_seconds * 1000:.0f}ms, '
+                f'setup {self.setup_seconds * 1000:.0f}ms')
+
+
+class CogRegistry:
+    """
+    The cog modules of a package, found once through the package's __path__
+    without importing them. A module is only imported when its cog is
+    loaded, and the time taken by the import and by setting up the cog is
+    recorded.
+    """
+
+    def __init__(self, bot: 'LibrarianBot',
+        package: str = DEFAULT_COG_PACKAGE):
+        self.bot = bot
+        self.package = package
+        self.logger = logging.getLogger(__name__)
+        self.entries: dict[str, CogEntry] = {}
+        for module in iter_modules(importlib.import_module(package).__path__):
+            if module.ispkg or module.name.startswith('_'):
+                continue
+            entry = CogEntry(module.name, _cog_name(module.name))
+            self.entries[entry.name] = entry
+
+    @property
+    def names(self) -> list[str]:
+        return list(self.entries)
+
+    def get(self, name: str) -> CogEntry | None:
+        """The entry of a cog, by cog name or module name."""
+        entry = self.entries.get(name)
+        if entry is None:
+            entry = next((entry for entry in self.entries.values()
+                          if entry.module == name.lower()), None)
+        return entry
+
+    def load(self, name: str, reload: bool = False) -> Cog:
+        """
+        Imports the module of a cog, or re-executes it when reload is set,
+        and adds a new instance of the cog to the bot.
+        """
+        entry = self.get(name)
+        if entry is None:
+            raise ModuleNotFoundError(f'No cog module named {name}',
+                                      name=f'{self.package}.{name.lower()}')
+        started = time.perf_counter()
+        importlib.invalidate_caches()
+        qualified = f'{self.package}.{entry.module}'
+        module = sys.modules.get(qualified)
+        if reload and module is not None:
+            module = importlib.reload(module)
+        else:
+            module = importlib.import_module(qualified)
+        imported = time.perf_counter()
+        cog: Cog = getattr(module, entry.name)(self.bot)
+        self.bot.add_cog(cog)
+        entry.import_seconds = imported - started
+        entry.setup_seconds = time.perf_counter() - imported
+        self.logger.info(f'Loaded {entry.name} ({entry.timings()})')
+        return cog
+
+    def load_all(self):
+        for name in self.entries:
+            self.load(name)
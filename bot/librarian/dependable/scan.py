@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import posixpath
+
+from librarian.dependable.kavita import Kavita
+
+DEFAULT_SCAN_WINDOW = 30
+# Past this many folders in one library a single library scan is cheaper.
+DEFAULT_SCAN_MAX_FOLDERS = 5
+
+
+def _minimal_folders(folders: set[str]) -> list[str]:
+    """Drops every folder that lies inside another folder of the set."""
+    minimal: list[str] = []
+    for folder in sorted(folder.rstrip('/') for folder in folders):
+        if minimal and (folder == minimal[-1]
+                        or folder.startswith(minimal[-1] + '/')):
+            continue
+        minimal.append(folder)
+    return minimal
+
+
+class ScanScheduler:
+    """
+    Collects the Kavita folders touched by uploads and asks Kavita to scan
+    them once things have been quiet for window seconds, or at the latest
+    max_wait seconds after the first touch. Touched folders are merged into
+    as few scan-folder calls as possible, falling back to one library scan
+    when a library has too many of them.
+    """
+
+    def __init__(self, kavita: Kavita,
+        window: float = DEFAULT_SCAN_WINDOW,
+        max_folders: int = DEFAULT_SCAN_MAX_FOLDERS,
+        max_wait: float | None = None):
+        self.kavita = kavita
+        self.window = window
+        self.max_folders = max_folders
+        self.max_wait = max_wait if max_wait is not None else window * 4
+        self.logger = logging.getLogger(__name__)
+        self._pending: dict[int, set[str] | None] = {}
+        self._first_touch = 0.0
+        self._due = 0.0
+        self._task: asyncio.Task | None = None
+
+    def touch(self, library_id: int, folder: str | None = None):
+        """
+        Marks folder of a library as changed, or the whole library when no
+        folder is known.
+        """
+        if library_id not in self._pending:
+            self._pending[library_id] = set()
+        folders = self._pending[library_id]
+        if folder is None:
+            self._pending[library_id] = None
+        elif folders is not None:
+            folders.add(folder)
+
+        now = asyncio.get_running_loop().time()
+        if self._task is None:
+            self._first_touch = now
+            self._task = asyncio.create_task(self._run())
+        self._due = min(now + self.window, self._first_touch + self.max_wait)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while (remaining := self._due - loop.time()) > 0:
+            await asyncio.sleep(remaining)
+        self._task = None
+        await self.flush()
+
+    async def flush(self):
+        """Sends every pending scan right away."""
+        pending, self._pending = self._pending, {}
+        for library_id, folders in pending.items():
+            try:
+                if folders is None or len(
+                    folders := _minimal_folders(folders)) > self.max_folders:
+                    self.logger.info(f'Scanning library {library_id}')
+                    await self.kavita.scan_library(library_id)
+                    continue
+                for folder in folders:
+                    self.logger.info(f'Scanning folder {folder}')
+                    await self.kavita.scan_folder(folder)
+            except Exception as e:
+                self.logger.warning(f'Requesting a scan of library '
+                                    f'{library_id} failed: {e!r}')
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+def kavita_folder(library_folders: list[str], directory_name: str,
+    series: str) -> str | None:
+    """
+    Maps a series folder written under /libraries/<directory_name>/ to the
+    path Kavita knows it by, using the library's configured folders.
+    """
+    if not library_folders:
+        return None
+    for folder in library_folders:
+        if posixpath.basename(folder.rstrip('/')) == directory_name:
+            return posixpath.join(folder, series)
+    return posixpath.join(library_folders[0], series)
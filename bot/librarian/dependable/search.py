@@ -0,0 +1,271 @@
+import heapq
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter
+from typing import Iterable
+
+# Discord only ever shows this many autocomplete choices.
+DEFAULT_LIMIT = 25
+# How many trigram candidates are scored by edit distance.
+FUZZY_CANDIDATES = 100
+# Roughly how many postings can be unioned in the time one candidate key is
+# checked in Python.
+POSTINGS_PER_KEY_CHECK = 100
+# Upper bound on edits a fuzzy match may need, however long the query.
+MAX_EDITS = 3
+
+_separators = re.compile(r'[\W_]+')
+
+
+def normalize(text: str) -> str:
+    decomposed = unicodedata.normalize('NFKD', text)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return _separators.sub(' ', stripped.casefold()).strip()
+
+
+def _trigrams(key: str) -> set[str]:
+    padded = f' {key} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _distance(a: str, b: str, bound: int) -> int:
+    """
+    Levenshtein distance, only evaluating the band of cells within bound of
+    the diagonal and returning bound + 1 as soon as bound is exceeded.
+    """
+    too_far = bound + 1
+    if abs(len(a) - len(b)) > bound:
+        return too_far
+    if a == b:
+        return 0
+    previous = [j if j <= bound else too_far for j in range(len(b) + 1)]
+    for i, ca in enumerate(a, 1):
+        current = [too_far] * (len(b) + 1)
+        current[0] = i if i <= bound else too_far
+        best = current[0]
+        for j in range(max(1, i - bound), min(len(b), i + bound) + 1):
+            value = min(previous[j] + 1,
+                        current[j - 1] + 1,
+                        previous[j - 1] + (ca != b[j - 1]))
+            current[j] = value
+            if value < best:
+                best = value
+        if best > bound:
+            return too_far
+        previous = current
+    return min(previous[-1], too_far)
+
+
+class SearchIndex:
+    """
+    Ranked lookup over a list of names for autocomplete.
+
+    Results are ordered by whole-name prefix matches, then names where every
+    query word prefixes one of their words, then by edit distance. Entries
+    are addressed by integer ids so postings stay compact; removed names are
+    tombstoned and compacted away once they make up half of the index.
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._names: list[str | None] = []
+        self._keys: list[str] = []
+        self._ids: dict[str, int] = {}
+        self._sorted: list[tuple[str, int]] = []
+        self._tokens: dict[str, array] = {}
+        self._sorted_tokens: list[str] = []
+        self._grams: dict[str, array] = {}
+        self._removed = 0
+        self._build(names)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._ids
+
+    def _build(self, names: Iterable[str]):
+        self._reset()
+        for name in dict.fromkeys(names):
+            self._insert(name)
+        self._sorted.sort()
+        self._sorted_tokens.sort()
+
+    def _reset(self):
+        self._names.clear()
+        self._keys.clear()
+        self._ids.clear()
+        self._sorted.clear()
+        self._tokens.clear()
+        self._sorted_tokens.clear()
+        self._grams.clear()
+        self._removed = 0
+
+    def _insert(self, name: str, keep_sorted: bool = False) -> int:
+        key = normalize(name)
+        entry = len(self._names)
+        self._names.append(name)
+        self._keys.append(key)
+        self._ids[name] = entry
+
+        if keep_sorted:
+            insort(self._sorted, (key, entry))
+        else:
+            self._sorted.append((key, entry))
+
+        for token in set(key.split()):
+            if token not in self._tokens:
+                self._tokens[token] = array('I')
+                if keep_sorted:
+                    insort(self._sorted_tokens, token)
+                else:
+                    self._sorted_tokens.append(token)
+            self._tokens[token].append(entry)
+
+        for gram in _trigrams(key):
+            self._grams.setdefault(gram, array('I')).append(entry)
+        return entry
+
+    def add(self, name: str):
+        if name not in self._ids:
+            self._insert(name, keep_sorted=True)
+
+    def remove(self, name: str):
+        entry = self._ids.pop(name, None)
+        if entry is None:
+            return
+        self._names[entry] = None
+        self._removed += 1
+        if self._removed * 2 > len(self._names):
+            self._build(self.names)
+
+    def update(self, names: Iterable[str]) -> bool:
+        """
+        Bring the index in line with names, touching only what changed.
+        Returns whether anything was added or removed.
+        """
+        wanted = dict.fromkeys(names)
+        removed = [name for name in self._ids if name not in wanted]
+        added = [name for name in wanted if name not in self._ids]
+        if len(added) + len(removed) > len(wanted) // 2 + 1:
+            self._build(wanted)
+            return True
+        for name in removed:
+            self.remove(name)
+        for name in added:
+            self.add(name)
+        return bool(added or removed)
+
+    @property
+    def names(self) -> list[str]:
+        return [name for name in self._names if name is not None]
+
+    def _alive(self, entry: int) -> bool:
+        return self._names[entry] is not None
+
+    def _prefix_matches(self, query: str, limit: int) -> list[int]:
+        found: list[int] = []
+        position = bisect_left(self._sorted, (query,))
+        while position < len(self._sorted) and len(found) < limit:
+            key, entry = self._sorted[position]
+            if not key.startswith(query):
+                break
+            if self._alive(entry):
+                found.append(entry)
+            position += 1
+        return found
+
+    def _expand(self, token: str) -> list[str]:
+        start = bisect_left(self._sorted_tokens, token)
+        end = bisect_left(self._sorted_tokens, token + '\uffff', start)
+        return self._sorted_tokens[start:end]
+
+    def _token_matches(self, tokens: list[str]) -> set[int]:
+        expansions = []
+        for token in tokens:
+            expanded = self._expand(token)
+            weight = sum(len(self._tokens[indexed]) for indexed in expanded)
+            expansions.append((weight, token, expanded))
+        expansions.sort(key=lambda expansion: expansion[0])
+
+        # Start from the word with the fewest postings. Further words are
+        # intersected through their postings while that is cheaper than
+        # checking each remaining candidate key in Python.
+        _, _, expanded = expansions[0]
+        candidates: set[int] = set().union(
+            *(self._tokens[indexed] for indexed in expanded))
+        unchecked: list[str] = []
+        for weight, token, expanded in expansions[1:]:
+            if not candidates:
+                return candidates
+            if weight > len(candidates) * POSTINGS_PER_KEY_CHECK:
+                unchecked.append(token)
+                continue
+            candidates &= set().union(
+                *(self._tokens[indexed] for indexed in expanded))
+        if not unchecked:
+            return candidates
+        return {entry for entry in candidates
+                if all(any(word.startswith(token)
+                           for word in self._keys[entry].split())
+                       for token in unchecked)}
+
+    def _fuzzy_matches(self, query: str, tokens: list[str],
+        exclude: set[int], limit: int) -> list[int]:
+        bound = min(MAX_EDITS, max(1, (len(query) + 1) // 3))
+        # Grams shared by a large part of the index barely narrow anything
+        # down, so only the rarer ones are counted.
+        common = max(FUZZY_CANDIDATES, len(self._names) // 50)
+        rare = [self._grams.get(gram, ()) for gram in _trigrams(query)]
+        rare = [posting for posting in rare if len(posting) <= common]
+        # Each edit breaks at most three trigrams; the trailing padded gram
+        # never matches a longer name.
+        required = max(1, len(rare) - 3 * bound - 1)
+
+        shared: Counter[int] = Counter()
+        for posting in rare:
+            shared.update(posting)
+        candidates = heapq.nlargest(
+            FUZZY_CANDIDATES,
+            ((count, entry) for entry, count in shared.items()
+             if count >= required and entry not in exclude
+             and self._names[entry] is not None))
+
+        tokens = [token for token in tokens if len(token) >= 3] \
+            if len(tokens) == 1 else []
+        scored: list[tuple[int, str, int]] = []
+        for _, entry in candidates:
+            key = self._keys[entry]
+            score = _distance(query, key[:len(query)], bound)
+            for word in key.split() if tokens else ():
+                score = min(score, _distance(tokens[0], word, bound))
+            if score <= bound:
+                scored.append((score, key, entry))
+        return [entry for *_, entry in heapq.nsmallest(limit, scored)]
+
+    def search(self, query: str, limit: int = DEFAULT_LIMIT) -> list[str]:
+        query = normalize(query)
+        if not query:
+            return [self._names[entry] for entry in
+                    self._prefix_matches('', limit)]
+
+        results = self._prefix_matches(query, limit)
+        seen = set(results)
+
+        tokens = query.split()
+        if len(results) < limit:
+            matches = self._token_matches(tokens) - seen
+            ranked = heapq.nsmallest(
+                limit - len(results),
+                ((self._keys[entry], entry) for entry in matches
+                 if self._alive(entry)))
+            for _, entry in ranked:
+                results.append(entry)
+                seen.add(entry)
+
+        if len(results) < limit and len(query) >= 3:
+            results += self._fuzzy_matches(query, tokens, seen,
+                                           limit - len(results))
+
+        return [self._names[entry] for entry in results]
@@ -0,0 +1,75 @@
+from dataclasses import dataclass
+from os import environ
+
+from librarian.dependable.configuration import Configuration
+
+
+def parse_shard_ids(value: str | list[int]) -> list[int]:
+    """Parses shard ids given as a list or as ranges like '0-3,8'."""
+    if isinstance(value, list):
+        return [int(shard) for shard in value]
+    ids = []
+    for part in value.split(','):
+        first, _, last = part.strip().partition('-')
+        ids.extend(range(int(first), int(last or first) + 1))
+    return ids
+
+
+def _format_shard_ids(ids: list[int]) -> str:
+    return f'{ids[0]}-{ids[-1]}' if len(ids) > 1 else str(ids[0])
+
+
+@dataclass
+class ShardPlan:
+    """
+    Which shards this bot connects, and across how many processes. A count
+    of None lets Discord recommend one, which only works in one process.
+    """
+    count: int | None = None
+    ids: list[int] | None = None
+    processes: int = 1
+
+    def groups(self) -> list[list[int] | None]:
+        """The shard ids of each process, split into contiguous ranges."""
+        if self.processes <= 1:
+            return [self.ids]
+        ids = self.ids if self.ids is not None else list(range(self.count))
+        size, extra = divmod(len(ids), self.processes)
+        groups = []
+        start = 0
+        for process in range(min(self.processes, len(ids))):
+            end = start + size + (process < extra)
+            groups.append(ids[start:end])
+            start = end
+        return groups
+
+    def name(self, ids: list[int] | None) -> str:
+        """Identifies the process running ids in the shared stores."""
+        return 'main' if ids is None else f'shards {_format_shard_ids(ids)}'
+
+
+def shard_plan(config: Configuration) -> ShardPlan | None:
+    """
+    The sharding set up by the SHARD_COUNT, SHARD_IDS, SHARD_PROCESSES and
+    AUTOSHARD environment variables, falling back to the shard_count,
+    shard_ids, shard_processes and autoshard configuration keys. None means
+    a single, unsharded connection.
+    """
+    count = environ.get('SHARD_COUNT', config.get('shard_count'))
+    ids = environ.get('SHARD_IDS', config.get('shard_ids'))
+    processes = int(environ.get('SHARD_PROCESSES',
+                                config.get('shard_processes', 1)))
+    autoshard = environ.get('AUTOSHARD', str(config.get('autoshard', False)))
+    if count is None and ids is None and processes <= 1 and \
+            autoshard.lower() not in ('1', 'true', 'yes'):
+        return None
+
+    plan = ShardPlan(None if count is None else int(count),
+                     None if ids is None else parse_shard_ids(ids),
+                     processes)
+    if plan.count is None and (plan.ids is not None or plan.processes > 1):
+        raise ValueError('shard_ids and shard_processes need a shard_count')
+    if plan.ids is not None and not all(0 <= shard < plan.count
+                                        for shard in plan.ids):
+        raise ValueError(f'shard_ids must lie within 0-{plan.count - 1}')
+    return plan
@@ -0,0 +1,38 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+
+class SQLiteStore:
+    """
+    A lazily opened SQLite database in WAL mode, shared between threads
+    behind a lock and between processes through SQLite's own locking.
+    Subclasses set schema and block, so their methods are meant to run in
+    worker threads.
+    """
+    schema: str = ''
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._connection: sqlite3.Connection | None = None
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(self.path.parent, exist_ok=True)
+            self._connection = sqlite3.connect(self.path,
+                                               check_same_thread=False,
+                                               isolation_level=None)
+            # Other processes of a sharded bot may hold the write lock.
+            self._connection.execute('PRAGMA busy_timeout=10000')
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.executescript(self.schema)
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,272 @@
+import logging
+import os
+import shutil
+import struct
+import time
+import zipfile
+from collections import Counter
+from concurrent.futures import Executor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+from typing import Callable
+
+from librarian.dependable.exceptions import InvalidFileException
+from librarian.dependable.files import AtomicFile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VALIDATION_TIMEOUT = 120
+QUARANTINE_DIRECTORY = '.quarantine'
+
+# Leading bytes of the file types uploads are expected to be.
+_MAGIC = (
+    (b'PK\x03\x04', 'zip'),
+    (b'PK\x05\x06', 'zip'),
+    (b'Rar!\x1a\x07', 'rar'),
+    (b"7z\xbc\xaf'\x1c", '7z'),
+    (b'%PDF-', 'pdf'),
+)
+_IMAGE_MAGIC = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+)
+_EXTENSIONS = {
+    '.cbz': 'zip', '.zip': 'zip', '.epub': 'epub',
+    '.cbr': 'rar', '.rar': 'rar', '.cb7': '7z', '.7z': '7z',
+    '.pdf': 'pdf',
+}
+# What each expected type may really be: EPUBs are zips, and readers open
+# comics by their content, so a .cbr holding a zip works just as well.
+_ACCEPTED = {
+    'epub': ('zip',),
+    'rar': ('rar', 'zip'),
+}
+# Extensions of comic archives, which have to contain pages.
+_COMICS = ('.cbz', '.cbr', '.cb7')
+_EPUB_CONTAINER = 'META-INF/container.xml'
+_LOCAL_HEADER = struct.Struct('<4s22xHH')
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+# Bytes read from every member to sniff its image format.
+_SNIFF_SIZE = 32
+
+
+def sniff(head: bytes) -> str | None:
+    """The file type of an archive, judged by its first bytes."""
+    for magic, kind in _MAGIC:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def sniff_image(head: bytes) -> str | None:
+    for magic, kind in _IMAGE_MAGIC:
+        if head.startswith(magic):
+            return kind
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[4:8] == b'ftyp' and head[8:12] in (b'avif', b'avis'):
+        return 'avif'
+    if head[4:12] == b'ftypheic' or head[4:12] == b'ftypmif1':
+        return 'heic'
+    if head.startswith(b'\x00\x00\x00\x0cjXL ') or \
+            head.startswith(b'\xff\x0a'):
+        return 'jxl'
+    return None
+
+
+@dataclass
+class Validation:
+    kind: str | None
+    expected: str | None
+    pages: int | None = None
+    formats: dict[str, int] = field(default_factory=dict)
+    problems: list[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.problems
+
+    def summary(self) -> str:
+        if self.problems:
+            return '; '.join(self.problems)
+        parts = [(self.kind or 'unknown type').upper()]
+        if self.pages is not None:
+            formats = ', '.join(f'{name} {count}' for name, count
+                                in sorted(self.formats.items()))
+            parts.append(f'{self.pages} pages'
+                         + (f' ({formats})' if formats else ''))
+        return ', '.join(parts)
+
+
+def validate(path: Path | str, name: str) -> Validation:
+    """
+    Checks the file at path, to be stored under name, for being the
+    archive type its extension promises and, for zip based types, for an
+    intact central directory with readable members. Comic archives have to
+    contain pages. Runs in a worker process.
+    """
+    path = Path(path)
+    with open(path, 'rb') as file:
+        head = file.read(64)
+    suffix = PurePosixPath(name).suffix.lower()
+    expected = _EXTENSIONS.get(suffix)
+    result = Validation(kind=sniff(head), expected=expected)
+
+    if result.kind is None:
+        if expected is not None:
+            result.problems.append(
+                f'not a {expected.upper()} file'
+                + (' (empty)' if not head else ''))
+        return result
+    if expected is not None and result.kind not in _ACCEPTED.get(
+            expected, (expected,)):
+        result.problems.append(f'is a {result.kind.upper()} file, not '
+                               f'{expected.upper()}')
+        return result
+
+    if result.kind == 'zip':
+        _check_zip(path, result, suffix in _COMICS)
+    elif result.kind == 'pdf':
+        _check_pdf(path, result)
+    return result
+
+
+def _check_zip(path: Path, result: Validation, comic: bool):
+    size = path.stat().st_size
+    try:
+        archive = zipfile.ZipFile(path)
+    except (zipfile.BadZipFile, OSError) as e:
+        result.problems.append(f'damaged zip ({e})')
+        return
+
+    formats: Counter[str] = Counter()
+    with archive, open(path, 'rb') as raw:
+        members = archive.infolist()
+        # Whatever the mimetype member is compressed with, an EPUB is told
+        # apart by the members it has to contain.
+        container = _EPUB_CONTAINER in archive.NameToInfo
+        if result.expected == 'epub' or (
+                container and 'mimetype' in archive.NameToInfo):
+            result.kind = 'epub'
+            if not container:
+                result.problems.append(f'EPUB without {_EPUB_CONTAINER}')
+        for member in members:
+            if member.is_dir():
+                continue
+            # The central directory has to point at a matching local
+            # header, or readers give up on the member.
+            if member.header_offset + _LOCAL_HEADER.size \
+                    + member.compress_size > size:
+                result.problems.append(f'`{member.filename}` is cut off')
+                continue
+            raw.seek(member.header_offset)
+            signature, name_length, extra_length = _LOCAL_HEADER.unpack(
+                raw.read(_LOCAL_HEADER.size))
+            if signature != _LOCAL_HEADER_SIGNATURE or \
+                    member.header_offset + _LOCAL_HEADER.size + name_length \
+                    + extra_length + member.compress_size > size:
+                result.problems.append(f'`{member.filename}` is damaged')
+                continue
+
+            base = PurePosixPath(member.filename).name
+            if base.startswith('.') or member.filename.startswith(
+                    '__MACOSX/'):
+                continue
+            try:
+                with archive.open(member) as source:
+                    image = sniff_image(source.read(_SNIFF_SIZE))
+            except (zipfile.BadZipFile, NotImplementedError, OSError,
+                    RuntimeError) as e:
+                result.problems.append(f'`{member.filename}` is unreadable '
+                                       f'({e})')
+                continue
+            if image is not None:
+                formats[image] += 1
+
+    result.formats = dict(formats)
+    result.pages = sum(formats.values())
+    if comic and not result.pages and not result.problems:
+        result.problems.append('contains no images')
+
+
+def _check_pdf(path: Path, result: Validation):
+    with open(path, 'rb') as file:
+        file.seek(max(0, path.stat().st_size - 1024))
+        if b'%%EOF' not in file.read():
+            result.problems.append('PDF is cut off (no %%EOF)')
+
+
+def quarantine(path: Path, root: Path, library: str, series: str,
+    name: str) -> Path:
+    """Moves path into root/.quarantine/<library>/<series>/."""
+    directory = root / QUARANTINE_DIRECTORY / library / series
+    os.makedirs(directory, exist_ok=True)
+    target = directory / f'{time.strftime("%Y%m%d-%H%M%S")}-{name}'
+    shutil.move(path, target)
+    return target
+
+
+class Validator:
+    """
+    Commit hooks running validate() in a process pool on every file before
+    it is committed. Failing files are moved to the quarantine directory
+    and rejected with an InvalidFileException.
+
+    A check taking longer than timeout seconds fails the file. recycle is
+    then handed the pool, to stop the worker stuck on it, and returns the
+    pool to use from then on.
+    """
+    check = staticmethod(validate)
+
+    def __init__(self, executor: Executor, root: Path, library: str,
+        series: str, timeout: float = DEFAULT_VALIDATION_TIMEOUT,
+        recycle: Callable[[Executor], Executor] | None = None):
+        self.executor = executor
+        self.root = root
+        self.library = library
+        self.series = series
+        self.timeout = timeout
+        self.recycle = recycle
+        self.results: dict[str, Validation] = {}
+
+    def _validate(self, file: AtomicFile, name: str) -> Validation:
+        for attempt in range(2):
+            executor = self.executor
+            future = executor.submit(self.check, file.path, name)
+            try:
+                return future.result(self.timeout)
+            except TimeoutError:
+                future.cancel()
+                if self.recycle is not None:
+                    self.executor = self.recycle(executor)
+                return Validation(None, None, problems=[
+                    f'validation timed out after {self.timeout:g}s'])
+            except BrokenProcessPool:
+                # Another check timed out and its pool was torn down.
+                if attempt or self.recycle is None:
+                    raise
+                self.executor = self.recycle(executor)
+
+    def before_commit(self, file: AtomicFile) -> None:
+        file.flush()
+        name = file.destination.name
+        result = self._validate(file, name)
+        self.results[name] = result
+        if result.ok:
+            return
+        target = quarantine(file.path, self.root, self.library, self.series,
+                            name)
+        logger.warning(f'Quarantined {name} as {target}: {result.summary()}')
+        raise InvalidFileException(f'{result.summary()}, quarantined')
+
+    def after_commit(self, file: AtomicFile) -> None:
+        pass
+
+    def summary(self, name: str) -> str | None:
+        result = self.results.get(name)
+        return None if result is None or result.kind is None \
+            else result.summary()
@@ -0,0 +1,222 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+from pathlib import Path
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DELAY = 0.2
+DEFAULT_POLL_INTERVAL = 2.0
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+_MASK = (IN_CLOSE_WRITE | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO
+         | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+_EVENT = struct.Struct('iIII')
+
+Snapshot = dict[str, tuple[int, int, int]]
+
+
+def _libc() -> ctypes.CDLL | None:
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class Watcher:
+    """
+    Reports changes to the entries of a set of directories, not recursing
+    into subdirectories.
+
+    Uses inotify where the C library provides it, and otherwise compares
+    directory listings every poll_interval seconds. Changes are collected
+    for delay seconds, then callback receives the set of changed paths. A
+    watched directory itself is reported when it disappears or when
+    inotify dropped events, meaning its contents need a full rescan.
+    """
+
+    def __init__(self, callback: Callable[[set[Path]], Any],
+        delay: float = DEFAULT_DELAY,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        use_inotify: bool = True):
+        self.callback = callback
+        self.delay = delay
+        self.poll_interval = poll_interval
+        self._libc = _libc() if use_inotify else None
+        self._fd: int | None = None
+        self._directories: dict[Path, int | None] = {}
+        self._descriptors: dict[int, Path] = {}
+        self._snapshots: dict[Path, Snapshot] = {}
+        self._changed: set[Path] = set()
+        self._flush: asyncio.TimerHandle | None = None
+        self._poller: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # Set once inotify refused a watch for lack of watches left.
+        self.exhausted = False
+
+    @property
+    def backend(self) -> str:
+        return 'inotify' if self._fd is not None else 'polling'
+
+    @property
+    def directories(self) -> list[Path]:
+        return list(self._directories)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        if self._libc is not None:
+            fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd >= 0:
+                self._fd = fd
+                self._loop.add_reader(fd, self._read)
+            else:
+                logger.warning(f'inotify unavailable '
+                               f'({os.strerror(ctypes.get_errno())}), '
+                               f'polling instead')
+        for directory in list(self._directories):
+            self._watch(directory)
+        if self._fd is None:
+            self._poller = asyncio.create_task(self._poll())
+
+    def close(self):
+        if self._flush is not None:
+            self._flush.cancel()
+            self._flush = None
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+            os.close(self._fd)
+            self._fd = None
+        self._descriptors.clear()
+        self._directories = dict.fromkeys(self._directories)
+
+    def add(self, directory: Path | str):
+        directory = Path(directory)
+        if directory in self._directories:
+            return
+        self._directories[directory] = None
+        if self._loop is not None:
+            self._watch(directory)
+
+    def remove(self, directory: Path | str):
+        directory = Path(directory)
+        descriptor = self._directories.pop(directory, None)
+        self._snapshots.pop(directory, None)
+        if descriptor is not None:
+            self._descriptors.pop(descriptor, None)
+            self._libc.inotify_rm_watch(self._fd, descriptor)
+
+    def _watch(self, directory: Path):
+        if self._fd is None:
+            self._snapshots[directory] = _listing(directory)
+            return
+        descriptor = self._libc.inotify_add_watch(
+            self._fd, os.fsencode(directory), _MASK)
+        if descriptor < 0:
+            error = ctypes.get_errno()
+            if error != errno.ENOSPC:
+                logger.warning(f'Could not watch {directory}: '
+                               f'{os.strerror(error)}')
+            elif not self.exhausted:
+                logger.warning(f'Could not watch {directory}: out of inotify '
+                               f'watches (fs.inotify.max_user_watches)')
+            self.exhausted = self.exhausted or error == errno.ENOSPC
+            # Forgotten, so that adding it again retries.
+            self._directories.pop(directory, None)
+            return
+        self._directories[directory] = descriptor
+        self._descriptors[descriptor] = directory
+
+    def _read(self):
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[offset + _EVENT.size:
+                        offset + _EVENT.size + length].rstrip(b'\0')
+            offset += _EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                logger.warning('inotify queue overflowed, rescanning')
+                self._changed.update(self._directories)
+                continue
+            directory = self._descriptors.get(descriptor)
+            if directory is None:
+                continue
+            if mask & IN_IGNORED:
+                self._descriptors.pop(descriptor, None)
+                self._directories[directory] = None
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self._changed.add(directory)
+            elif name:
+                self._changed.add(directory / os.fsdecode(name))
+        self._schedule()
+
+    async def _poll(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            for directory in list(self._snapshots):
+                before = self._snapshots[directory]
+                after = await asyncio.to_thread(_listing, directory)
+                if directory not in self._snapshots:
+                    continue
+                self._snapshots[directory] = after
+                if not after and before and not directory.exists():
+                    self._changed.add(directory)
+                    continue
+                self._changed.update(
+                    directory / name for name in before.keys() | after.keys()
+                    if before.get(name) != after.get(name))
+            self._schedule()
+
+    def _schedule(self):
+        if self._changed and self._flush is None:
+            self._flush = self._loop.call_later(self.delay, self._report)
+
+    def _report(self):
+        self._flush = None
+        changed, self._changed = self._changed, set()
+        try:
+            self.callback(changed)
+        except Exception as e:
+            logger.error(f'Watcher callback failed: {e!r}')
+
+
+def _listing(directory: Path) -> Snapshot:
+    listing: Snapshot = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                listing[entry.name] = (stat.st_mtime_ns, stat.st_size,
+                                       stat.st_ino)
+    except OSError:
+        pass
+    return listing
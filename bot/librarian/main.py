@@ -3,16 +3,13 @@ from os import environ
 
 from disnake import Status, InteractionContextTypes
 
-from librarian.cogs.upload import Upload
-from librarian.cogs.management import Management
-from librarian.dependable.bot_overload import InteractionBot
+from librarian.dependable.bot_overload import (AutoShardedInteractionBot,
+                                               InteractionBot)
 from librarian.dependable.configuration import Configuration
+from librarian.dependable.sharding import ShardPlan, shard_plan
 
 
-def main() -> int:
-    logger = logging.getLogger('Librarian')
-    logging.basicConfig(level=logging.INFO)
-
+def _configuration(logger: logging.Logger) -> Configuration:
     config: Configuration | None = None
 
     try:
@@ -26,6 +23,66 @@ def main() -> int:
         if config is None:
             raise EnvironmentError('No configuration found')
         logger.info('Configuration loaded.')
+    return config
+
+
+def _run(config: Configuration, discord_token: str,
+    plan: ShardPlan | None, shard_ids: list[int] | None = None,
+    process: int = 0) -> int:
+    options = dict(status=Status.dnd,
+                   default_contexts=InteractionContextTypes(guild=True))
+    if plan is None:
+        bot = InteractionBot(config, **options)
+    else:
+        bot = AutoShardedInteractionBot(config,
+                                        shard_count=plan.count,
+                                        shard_ids=shard_ids,
+                                        instance=plan.name(shard_ids),
+                                        process=process,
+                                        **options)
+
+    # Cog modules are only imported now, once the bot exists.
+    bot.registry.load_all()
+    bot.run(discord_token)
+    return 0
+
+
+def _run_process(plan: ShardPlan, shard_ids: list[int], process: int):
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(f'Librarian ({plan.name(shard_ids)})')
+    raise SystemExit(_run(_configuration(logger), environ['DISCORD_TOKEN'],
+                          plan, shard_ids, process))
+
+
+def _supervise(plan: ShardPlan, logger: logging.Logger) -> int:
+    """Runs every group of shards in a process of its own."""
+    import multiprocessing
+
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for process, shard_ids in enumerate(plan.groups()):
+        child = context.Process(target=_run_process,
+                                args=(plan, shard_ids, process),
+                                name=plan.name(shard_ids))
+        child.start()
+        logger.info(f'Started {child.name} of {plan.count} as process '
+                    f'{child.pid}')
+        processes.append(child)
+
+    exit_code = 0
+    for child in processes:
+        child.join()
+        if child.exitcode:
+            logger.error(f'{child.name} exited with {child.exitcode}')
+            exit_code = 1
+    return exit_code
+
+
+def main() -> int:
+    logger = logging.getLogger('Librarian')
+    logging.basicConfig(level=logging.INFO)
+
+    config = _configuration(logger)
 
     discord_token = environ.get('DISCORD_TOKEN')
     if discord_token is None:
@@ -33,15 +90,13 @@ def main() -> int:
         logger.error('Exiting...')
         return 1
 
-    bot = InteractionBot(config,
-                         status=Status.dnd,
-                         default_contexts=InteractionContextTypes(guild=True)
-                         )
-
-    bot.add_cog(Management(bot))
-    bot.add_cog(Upload(bot))
-    bot.run(discord_token)
-    return 0
+    plan = shard_plan(config)
+    if plan is not None and len(plan.groups()) > 1:
+        # Every process loads the configuration itself and shares the
+        # stored state below CONFIG_DIR with the others.
+        return _supervise(plan, logger)
+    return _run(config, discord_token, plan,
+                plan.ids if plan is not None else None)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,22 @@
+"""A local aiohttp server standing in for the services the bot talks to."""
+import unittest
+
+from aiohttp import web
+
+
+class ServerTestCase(unittest.IsolatedAsyncioTestCase):
+    """Serves the application returned by app() on a free local port."""
+
+    def app(self) -> web.Application:
+        raise NotImplementedError
+
+    async def asyncSetUp(self):
+        self.runner = web.AppRunner(self.app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}'
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
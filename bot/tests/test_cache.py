@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+
+from librarian.dependable.cache import AsyncTTLCache
+
+
+class Backend:
+    """Answers fetches with the current value once released."""
+
+    def __init__(self, value: str):
+        self.value = value
+        self.release = asyncio.Event()
+        self.fetches = 0
+
+    async def fetch(self) -> str:
+        self.fetches += 1
+        value = self.value
+        await self.release.wait()
+        return value
+
+
+async def _fetched(backend: Backend, fetches: int):
+    for _ in range(100):
+        if backend.fetches >= fetches:
+            return
+        await asyncio.sleep(0)
+    raise AssertionError(f'{backend.fetches} fetches, not {fetches}')
+
+
+class InvalidateTest(unittest.IsolatedAsyncioTestCase):
+    async def test_fetch_from_before_is_not_cached(self):
+        backend = Backend('old')
+        cache = AsyncTTLCache('test', backend.fetch, ttl=60)
+        stale = asyncio.create_task(cache.get())
+        await _fetched(backend, 1)
+        backend.value = 'new'
+        cache.invalidate()
+        fresh = asyncio.create_task(cache.get())
+        await _fetched(backend, 2)
+        backend.release.set()
+        self.assertEqual(await stale, 'old')
+        self.assertEqual(await fresh, 'new')
+        self.assertEqual(backend.fetches, 2)
+        self.assertEqual(await cache.get(), 'new')
+
+    async def test_background_refresh_from_before_is_not_cached(self):
+        backend = Backend('old')
+        backend.release.set()
+        cache = AsyncTTLCache('test', backend.fetch, ttl=0)
+        self.assertEqual(await cache.get(), 'old')
+        backend.release.clear()
+        self.assertEqual(await cache.get(), 'old')
+        refresh = cache.refresh()
+        cache.invalidate()
+        backend.release.set()
+        await refresh
+        self.assertNotIn(None, cache)
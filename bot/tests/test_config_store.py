@@ -0,0 +1,46 @@
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from librarian.dependable.config_store import ConfigStore, DELETED
+
+
+class ConfigStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / 'config.json'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_compaction_keeps_the_journal(self):
+        store = ConfigStore(self.path, compact_after=3)
+        store.write({'a': 1, 'b': 2})
+        store.append({'a': 3})
+        store.append({'b': DELETED})
+        store.append({'c': 4, 'd': 5})
+        self.assertFalse(store.journal_path.exists())
+        self.assertEqual(ConfigStore(self.path).load(), {'a': 3, 'c': 4,
+                                                         'd': 5})
+
+    def test_compaction_keeps_entries_of_other_processes(self):
+        """Each store stands in for the store of one shard process."""
+        stores = [ConfigStore(self.path, compact_after=10)
+                  for _ in range(4)]
+        barrier = threading.Barrier(len(stores))
+
+        def journal(number: int, store: ConfigStore):
+            barrier.wait()
+            for key in range(100):
+                store.append({f'{number}-{key}': key})
+
+        threads = [threading.Thread(target=journal, args=(number, store))
+                   for number, store in enumerate(stores)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(ConfigStore(self.path).load(), {
+            f'{number}-{key}': key for number in range(len(stores))
+            for key in range(100)})
@@ -0,0 +1,63 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from librarian.dependable.config_store import ConfigStore
+from librarian.dependable.configuration import Configuration
+
+
+class ReloadTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = ConfigStore(Path(self.directory.name) / 'config.json')
+        self.store.write({'kavita_base_url': 'http://a', 'paste_timeout': 30})
+
+    async def asyncTearDown(self):
+        self.directory.cleanup()
+
+    def _configuration(self, **values) -> Configuration:
+        config = Configuration(self.store.load(), **values)
+        config.attach(self.store)
+        return config
+
+    def _edit(self, **values):
+        """A hand edit, or a save from another shard process."""
+        other = ConfigStore(self.store.path)
+        other.write({**other.load(), **values})
+
+    async def test_reload_keeps_unsaved_keys(self):
+        config = self._configuration()
+        config.set('kavita_base_url', 'http://b')
+        self._edit(paste_timeout=60)
+        self.assertEqual(await config.reload(), ['paste_timeout'])
+        self.assertEqual(config['kavita_base_url'], 'http://b')
+        self.assertEqual(config['paste_timeout'], 60)
+
+    async def test_reload_applies_keys_once_saved(self):
+        config = self._configuration()
+        config.set('kavita_base_url', 'http://b')
+        await config.save_async()
+        self._edit(kavita_base_url='http://c')
+        self.assertEqual(await config.reload(), ['kavita_base_url'])
+        self.assertEqual(config['kavita_base_url'], 'http://c')
+
+    async def test_reload_keeps_keys_waiting_for_write_behind(self):
+        config = self._configuration(config_write_behind=True,
+                                     config_write_behind_delay=60)
+        config.set('kavita_base_url', 'http://b')
+        self._edit(kavita_base_url='http://c')
+        await config.reload()
+        self.assertEqual(config['kavita_base_url'], 'http://b')
+        config.flush()
+        self.assertEqual(self.store.load()['kavita_base_url'], 'http://b')
+
+    async def test_save_replaces_the_write_behind(self):
+        config = self._configuration(config_write_behind=True,
+                                     config_write_behind_delay=60)
+        config.set('kavita_base_url', 'http://b')
+        await config.save_async()
+        self.assertIsNone(config._flush_handle)
+        self.assertFalse(self.store.journal_path.exists())
+        self.assertEqual(self.store.load()['kavita_base_url'], 'http://b')
+        self._edit(kavita_base_url='http://c')
+        self.assertEqual(await config.reload(), ['kavita_base_url'])
@@ -0,0 +1,64 @@
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from librarian.dependable.dedup import Deduplicator, HashIndex
+from librarian.dependable.exceptions import DuplicateFileException
+from librarian.dependable.files import AtomicFile, finalize
+
+
+class SlowIndex(HashIndex):
+    """Widens the gap between looking a digest up and recording it."""
+
+    def find(self, digest: str) -> Path | None:
+        found = super().find(digest)
+        time.sleep(0.05)
+        return found
+
+
+class DeduplicatorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        self.index = SlowIndex(self.root / 'hashes.sqlite3')
+
+    def tearDown(self):
+        self.index.close()
+        self.directory.cleanup()
+
+    def _store(self, name: str, mode: str, start: threading.Barrier
+    ) -> Path | Exception:
+        with AtomicFile(self.root / name) as file:
+            file.write(b'the same volume')
+            start.wait()
+            try:
+                return finalize(file, Deduplicator(self.index, mode,
+                                                   'manga', 'Series'))
+            except Exception as e:
+                return e
+
+    def _store_concurrently(self, mode: str, count: int = 4) -> list:
+        start = threading.Barrier(count)
+        with ThreadPoolExecutor(count) as executor:
+            return list(executor.map(
+                lambda number: self._store(f'volume {number}.cbz', mode,
+                                           start), range(count)))
+
+    def test_concurrent_duplicates_are_rejected(self):
+        results = self._store_concurrently('reject')
+        stored = [result for result in results if isinstance(result, Path)]
+        self.assertEqual(len(stored), 1)
+        self.assertTrue(all(isinstance(result, DuplicateFileException)
+                            for result in results
+                            if not isinstance(result, Path)))
+        self.assertEqual([path.name for path in self.root.glob('*.cbz')],
+                         [stored[0].name])
+
+    def test_concurrent_duplicates_are_linked(self):
+        results = self._store_concurrently('link')
+        self.assertTrue(all(isinstance(result, Path) for result in results))
+        inodes = {result.stat().st_ino for result in results}
+        self.assertEqual(len(inodes), 1)
@@ -0,0 +1,158 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from librarian.dependable.download import Downloader, _OrderedHash
+from librarian.dependable.exceptions import IncompleteFileException
+from librarian.dependable.files import AtomicFile
+from tests.server import ServerTestCase
+
+SIZE = 1024 * 1024
+
+
+class Digests:
+    """Commit hooks recording the digest of every committed file."""
+
+    def __init__(self):
+        self.digests: list[str] = []
+
+    def before_commit(self, file: AtomicFile) -> None:
+        pass
+
+    def after_commit(self, file: AtomicFile) -> None:
+        self.digests.append(file.digest)
+
+
+class DownloaderTest(ServerTestCase):
+    def app(self) -> web.Application:
+        self.payload = os.urandom(SIZE)
+        # Responses still to be cut off halfway through their body.
+        self.drops = 0
+        # How much of the body a cut response still delivers.
+        self.delivered = 0.5
+        self.ranges: list[str | None] = []
+
+        async def attachment(request: web.Request) -> web.StreamResponse:
+            self.ranges.append(request.headers.get('Range'))
+            start, end = 0, SIZE
+            status = 200
+            if 'Range' in request.headers:
+                first, _, last = request.headers['Range'] \
+                    .removeprefix('bytes=').partition('-')
+                start, end = int(first), int(last or SIZE - 1) + 1
+                status = 206
+            body = self.payload[start:end]
+            response = web.StreamResponse(status=status, headers={
+                'Content-Length': str(len(body)),
+                'Accept-Ranges': 'bytes'})
+            await response.prepare(request)
+            # The probe for range support is never cut.
+            if self.drops and request.headers.get('Range') != 'bytes=0-0':
+                self.drops -= 1
+                await response.write(body[:int(len(body) * self.delivered)])
+                request.transport.abort()
+                return response
+            await response.write(body)
+            return response
+
+        app = web.Application()
+        app.router.add_get('/attachment.cbz', attachment)
+        return app
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.session = aiohttp.ClientSession()
+        self.directory = tempfile.TemporaryDirectory()
+        self.destination = Path(self.directory.name) / 'attachment.cbz'
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        self.directory.cleanup()
+        await super().asyncTearDown()
+
+    def _downloader(self, **kwargs) -> Downloader:
+        return Downloader(self.session, backoff=0, **kwargs)
+
+    async def _download(self, downloader: Downloader,
+        size: int | None = SIZE, hooks: Digests | None = None) -> Path:
+        return await downloader.download(f'{self.url}/attachment.cbz',
+                                         self.destination, size, hooks)
+
+    def _leftovers(self) -> list[str]:
+        return os.listdir(self.directory.name)
+
+    async def test_streaming_resumes_after_disconnects(self):
+        self.drops = 2
+        path = await self._download(self._downloader())
+        self.assertEqual(path.read_bytes(), self.payload)
+        self.assertEqual(len(self.ranges), 3)
+        self.assertIsNone(self.ranges[0])
+        # Each retry picks up where the previous connection dropped.
+        self.assertTrue(all(header.startswith('bytes=') and
+                            not header.startswith('bytes=0-')
+                            for header in self.ranges[1:]))
+
+    async def test_segmented_resumes_after_disconnects(self):
+        downloader = self._downloader(segmented_threshold=0,
+                                      segment_size=SIZE // 4, segments=2,
+                                      buffer_size=16 * 1024)
+        self.drops = 2
+        hooks = Digests()
+        path = await self._download(downloader, hooks=hooks)
+        self.assertEqual(path.read_bytes(), self.payload)
+        self.assertEqual(hooks.digests,
+                         [hashlib.blake2b(self.payload).hexdigest()])
+        segment_starts = {int(header.removeprefix('bytes=').split('-')[0])
+                          for header in self.ranges[1:]}
+        # Resumed requests start inside a segment, not at its boundary.
+        self.assertTrue(any(start % (SIZE // 4) for start in segment_starts))
+
+    async def test_gives_up_after_retry_limit(self):
+        # Attempts only count while no data arrives at all.
+        self.drops = 100
+        self.delivered = 0
+        with self.assertRaises(aiohttp.ClientPayloadError):
+            await self._download(self._downloader(retries=2))
+        self.assertEqual(len(self.ranges), 3)
+        self.assertEqual(self._leftovers(), [])
+
+    async def test_size_mismatch_is_incomplete(self):
+        # Discord announced more than the CDN delivers.
+        with self.assertRaises(IncompleteFileException):
+            await self._download(self._downloader(), size=SIZE + 10)
+        self.assertEqual(self._leftovers(), [])
+
+
+class OrderedHashTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.file = AtomicFile(Path(self.directory.name) / 'file')
+        self.data = os.urandom(1000)
+        self.file.preallocate(len(self.data))
+
+    def tearDown(self):
+        self.file.discard()
+        self.directory.cleanup()
+
+    def _write(self, hashed: _OrderedHash):
+        # Blocks of two segments, interleaved as they arrive.
+        for start in (500, 0, 600, 100, 700, 800, 200, 900, 300, 400):
+            hashed.write_at(self.data[start:start + 100], start)
+        self.assertEqual(hashed.offset, len(self.data))
+        self.assertEqual(self.file.digest,
+                         hashlib.blake2b(self.data).hexdigest())
+
+    def test_blocks_ahead_are_held(self):
+        hashed = _OrderedHash(self.file, len(self.data), 64)
+        self._write(hashed)
+        self.assertEqual(hashed.read_back, 0)
+
+    def test_blocks_beyond_the_limit_are_read_back(self):
+        hashed = _OrderedHash(self.file, 200, 64)
+        self._write(hashed)
+        self.assertEqual(hashed.read_back, 300)
@@ -0,0 +1,74 @@
+import asyncio
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from librarian.dependable.jobs import Job, JobQueue, JobState, JobStore
+
+
+class FlakyStore(JobStore):
+    """Fails the first update calls like a store locked by another process."""
+
+    def __init__(self, path: Path, failures: int):
+        super().__init__(path)
+        self.failures = failures
+
+    def update(self, job: Job):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError('database is locked')
+        super().update(job)
+
+
+def _job(filename: str) -> Job:
+    return Job('manga', 'Series', '/tmp', filename, 'http://cdn/file')
+
+
+class JobQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = Path(self.directory.name) / 'jobs.sqlite3'
+
+    async def asyncTearDown(self):
+        self.directory.cleanup()
+
+    async def _queue(self, store: JobStore, handler) -> JobQueue:
+        queue = JobQueue(store, handler, workers=1)
+        await queue.start()
+        self.addAsyncCleanup(queue.close)
+        self.addCleanup(store.close)
+        return queue
+
+    async def test_result(self):
+        async def handler(job, _):
+            return job.filename
+
+        queue = await self._queue(JobStore(self.path), handler)
+        future = await queue.submit(_job('a.cbz'))
+        self.assertEqual(await asyncio.wait_for(future, 5), 'a.cbz')
+
+    async def test_store_error_fails_job_and_keeps_worker(self):
+        async def handler(job, _):
+            return job.filename
+
+        store = FlakyStore(self.path, failures=1)
+        queue = await self._queue(store, handler)
+        first = await queue.submit(_job('a.cbz'))
+        second = await queue.submit(_job('b.cbz'))
+        with self.assertRaises(sqlite3.OperationalError):
+            await asyncio.wait_for(first, 5)
+        self.assertEqual(await asyncio.wait_for(second, 5), 'b.cbz')
+
+    async def test_handler_error(self):
+        async def handler(job, _):
+            raise ValueError('broken archive')
+
+        store = JobStore(self.path)
+        queue = await self._queue(store, handler)
+        job = _job('a.cbz')
+        with self.assertRaises(ValueError):
+            await asyncio.wait_for(await queue.submit(job), 5)
+        await queue.idle()
+        self.assertEqual(job.state, JobState.FAILED)
+        self.assertEqual(job.error, 'broken archive')
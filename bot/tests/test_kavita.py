@@ -0,0 +1,82 @@
+import asyncio
+import base64
+import json
+import time
+
+from aiohttp import web
+
+from librarian.dependable.configuration import Configuration
+from librarian.dependable.kavita import Kavita, TOKEN_EXPIRY_MARGIN
+from tests.server import ServerTestCase
+
+
+def _token(number: int, lifetime: float) -> str:
+    claims = json.dumps({'exp': time.time() + lifetime, 'n': number})
+    payload = base64.urlsafe_b64encode(claims.encode()).rstrip(b'=')
+    return f'header.{payload.decode()}.signature'
+
+
+class KavitaTest(ServerTestCase):
+    # Seconds a token stays usable to the client.
+    lifetime = 600.0
+
+    def app(self) -> web.Application:
+        self.authentications = 0
+        self.valid: set[str] = set()
+
+        async def authenticate(request: web.Request) -> web.Response:
+            self.assertEqual(request.query['apiKey'], 'key')
+            self.authentications += 1
+            # Slow enough for every concurrent caller to be waiting on it.
+            await asyncio.sleep(0.05)
+            token = _token(self.authentications,
+                           self.lifetime + TOKEN_EXPIRY_MARGIN)
+            self.valid.add(token)
+            return web.json_response({'token': token})
+
+        async def libraries(request: web.Request) -> web.Response:
+            token = request.headers['Authorization'].removeprefix('Bearer ')
+            if token not in self.valid:
+                return web.Response(status=401)
+            return web.json_response([{'name': 'Manga', 'id': 1}])
+
+        app = web.Application()
+        app.router.add_post('/api/Plugin/authenticate', authenticate)
+        app.router.add_get('/api/Library/libraries', libraries)
+        return app
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.kavita = Kavita(Configuration(kavita_base_url=self.url,
+                                           kavita_api_key='key'))
+
+    async def asyncTearDown(self):
+        await self.kavita.close()
+        await super().asyncTearDown()
+
+    async def test_concurrent_callers_authenticate_once(self):
+        results = await asyncio.gather(
+            *(self.kavita.libraries() for _ in range(50)))
+        self.assertEqual(self.authentications, 1)
+        self.assertTrue(all(result == [{'name': 'Manga', 'id': 1}]
+                            for result in results))
+
+    async def test_token_is_reused(self):
+        await self.kavita.libraries()
+        await self.kavita.libraries()
+        self.assertEqual(self.authentications, 1)
+
+    async def test_rejected_token_is_refreshed_and_retried(self):
+        await self.kavita.libraries()
+        self.valid.clear()
+        results = await asyncio.gather(
+            *(self.kavita.libraries() for _ in range(10)))
+        self.assertEqual(self.authentications, 2)
+        self.assertEqual(results[0], [{'name': 'Manga', 'id': 1}])
+
+    async def test_expired_token_is_refreshed(self):
+        self.lifetime = 0.2
+        await self.kavita.libraries()
+        await asyncio.sleep(0.3)
+        await self.kavita.libraries()
+        self.assertEqual(self.authentications, 2)
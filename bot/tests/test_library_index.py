@@ -0,0 +1,85 @@
+import asyncio
+import ctypes
+import errno
+import tempfile
+import unittest
+from pathlib import Path
+
+from librarian.dependable.library_index import LibraryIndex
+
+
+class LimitedInotify:
+    """The C library, with room for only a few inotify watches."""
+
+    def __init__(self, libc, watches: int):
+        self.libc = libc
+        self.watches = watches
+
+    def __getattr__(self, name: str):
+        return getattr(self.libc, name)
+
+    def inotify_add_watch(self, fd: int, path: bytes, mask: int) -> int:
+        if not self.watches:
+            ctypes.set_errno(errno.ENOSPC)
+            return -1
+        self.watches -= 1
+        return self.libc.inotify_add_watch(fd, path, mask)
+
+    def inotify_rm_watch(self, fd: int, descriptor: int) -> int:
+        self.watches += 1
+        return self.libc.inotify_rm_watch(fd, descriptor)
+
+
+class LibraryIndexTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        for series in ('Berserk', 'Monster', 'One Piece', 'Vagabond'):
+            (self.root / 'manga' / series).mkdir(parents=True)
+        (self.root / 'manga' / 'Monster' / 'v01.cbz').write_bytes(b'x')
+        self.index = LibraryIndex(self.root)
+        if self.index._watcher._libc is None:
+            self.skipTest('inotify is not available')
+
+    async def asyncTearDown(self):
+        await self.index.close()
+        self.directory.cleanup()
+
+    async def _start(self):
+        self.index.start()
+        while not self.index.ready:
+            await asyncio.sleep(0.01)
+
+    async def _changed(self):
+        # Longer than the watcher's delay before reporting.
+        await asyncio.sleep(0.5)
+
+    async def test_walk_and_lookups(self):
+        await self._start()
+        self.assertTrue(self.index.exists('manga', 'Monster', 'v01.cbz'))
+        self.assertFalse(self.index.exists('manga', 'Monster', 'v02.cbz'))
+        self.assertEqual(self.index.count('manga', 'Monster'), 1)
+        self.assertEqual(self.index.search_series('manga', 'vaga'),
+                         ['Vagabond'])
+
+    async def test_changes_are_followed(self):
+        await self._start()
+        (self.root / 'manga' / 'Monster' / 'v02.cbz').write_bytes(b'x')
+        (self.root / 'manga' / 'Pluto').mkdir()
+        await self._changed()
+        self.assertTrue(self.index.exists('manga', 'Monster', 'v02.cbz'))
+        self.assertIn('Pluto', self.index.series('manga'))
+
+    async def test_running_out_of_watches_falls_back_once(self):
+        watcher = self.index._watcher
+        # Root, the library and two of the four series.
+        watcher._libc = LimitedInotify(watcher._libc, 4)
+        with self.assertLogs('librarian', 'WARNING') as logs:
+            await self._start()
+            await self.index.reconcile()
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(set(watcher.directories),
+                         {self.root, self.root / 'manga'})
+        (self.root / 'manga' / 'Pluto').mkdir()
+        await self._changed()
+        self.assertIn('Pluto', self.index.series('manga'))
@@ -0,0 +1,104 @@
+import unittest
+
+from aiohttp import web
+
+from librarian.dependable.configuration import Configuration
+from librarian.dependable.paste import Paste, TextTypes, _split
+from tests.server import ServerTestCase
+
+
+class PasteTest(ServerTestCase):
+    def app(self) -> web.Application:
+        # Per post: whether it was gzip compressed, and the content.
+        self.posts: list[tuple[bool, bytes]] = []
+        self.failures = 0
+        self.accept_gzip = True
+
+        async def post(request: web.Request) -> web.Response:
+            body = await request.read()
+            compressed = request.headers.get('Content-Encoding') == 'gzip'
+            if self.failures:
+                self.failures -= 1
+                return web.Response(status=503)
+            if compressed and not self.accept_gzip:
+                return web.Response(status=415)
+            self.posts.append((compressed, body))
+            return web.json_response({'key': f'paste{len(self.posts)}'})
+
+        # aiohttp decompresses request bodies itself.
+        app = web.Application()
+        app.router.add_post('/post', post)
+        return app
+
+    def _paste(self, **config) -> Paste:
+        paste = Paste(Configuration(paste_api_url=self.url,
+                                    paste_frontend_url='https://paste',
+                                    **config))
+        self.addAsyncCleanup(paste.close)
+        return paste
+
+    async def test_retries_server_errors(self):
+        self.failures = 1
+        url = await self._paste().paste('content')
+        self.assertEqual(url, 'https://paste/paste1')
+        self.assertEqual(self.posts, [(False, b'content')])
+
+    async def test_identical_content_is_pasted_once(self):
+        paste = self._paste()
+        first = await paste.paste('{"a": 1}', TextTypes.JSON)
+        second = await paste.paste('{"a": 1}', TextTypes.JSON)
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.posts), 1)
+        await paste.paste('{"a": 1}', TextTypes.PLAIN)
+        self.assertEqual(len(self.posts), 2)
+
+    async def test_remembered_urls_expire(self):
+        paste = self._paste(paste_cache_ttl=0)
+        await paste.paste('content')
+        await paste.paste('content')
+        self.assertEqual(len(self.posts), 2)
+
+    async def test_least_recently_used_is_forgotten(self):
+        paste = self._paste(paste_cache_size=2)
+        for content in ('a', 'b', 'a', 'c', 'a', 'b'):
+            await paste.paste(content)
+        self.assertEqual([body for _, body in self.posts],
+                         [b'a', b'b', b'c', b'b'])
+
+    async def test_oversize_content_is_split(self):
+        content = ''.join(f'line {number}\n' for number in range(30))
+        url = await self._paste(paste_max_size=100).paste(content)
+        *parts, (_, index) = self.posts
+        self.assertGreater(len(parts), 1)
+        self.assertEqual(b''.join(body for _, body in parts),
+                         content.encode())
+        self.assertTrue(all(len(body) <= 100 for _, body in parts))
+        self.assertEqual(url, f'https://paste/paste{len(self.posts)}')
+        self.assertIn(f'Part 1/{len(parts)}: https://paste/paste',
+                      index.decode())
+
+    async def test_gzip_falls_back_when_rejected(self):
+        self.accept_gzip = False
+        paste = self._paste(paste_gzip_threshold=10)
+        await paste.paste('x' * 100)
+        await paste.paste('y' * 100)
+        self.assertEqual(self.posts, [(False, b'x' * 100),
+                                      (False, b'y' * 100)])
+
+    async def test_large_bodies_are_compressed(self):
+        await self._paste(paste_gzip_threshold=10).paste('x' * 100)
+        self.assertEqual(self.posts, [(True, b'x' * 100)])
+
+
+class SplitTest(unittest.TestCase):
+    def test_split_keeps_characters_whole(self):
+        data = ('é' * 40 + '日本' * 20).encode()
+        parts = _split(data, 7)
+        self.assertEqual(b''.join(parts), data)
+        self.assertTrue(all(len(part) <= 7 for part in parts))
+        for part in parts:
+            part.decode()
+
+    def test_split_prefers_line_ends(self):
+        self.assertEqual(_split(b'aaa\nbbb\nccc', 9),
+                         [b'aaa\nbbb\n', b'ccc'])
@@ -0,0 +1,47 @@
+import io
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+from librarian.dependable.recompress import recompress
+
+
+def _page(size: int = 256) -> bytes:
+    from PIL import Image
+
+    image = Image.new('RGB', (size, size))
+    image.putdata([(x, y, (x * y) % 256) for y in range(size)
+                   for x in range(size)])
+    encoded = io.BytesIO()
+    image.save(encoded, 'PNG')
+    return encoded.getvalue()
+
+
+class RecompressTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.archive = Path(self.directory.name) / 'volume.cbz'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_pages_are_reencoded(self):
+        with zipfile.ZipFile(self.archive, 'w') as zip_file:
+            zip_file.writestr('001.png', _page())
+            zip_file.writestr('ComicInfo.xml', b'<ComicInfo/>')
+        result = recompress(self.archive)
+        self.assertEqual(result.pages, 1)
+        self.assertEqual(result.size, self.archive.stat().st_size)
+        self.assertLess(result.size, result.original_size)
+        with zipfile.ZipFile(self.archive) as zip_file:
+            self.assertEqual(zip_file.namelist(),
+                             ['001.webp', 'ComicInfo.xml'])
+
+    def test_archive_without_gains_is_kept(self):
+        with zipfile.ZipFile(self.archive, 'w') as zip_file:
+            zip_file.writestr('001.png', b'not an image')
+        content = self.archive.read_bytes()
+        result = recompress(self.archive)
+        self.assertEqual((result.pages, result.saved), (0, 0))
+        self.assertEqual(self.archive.read_bytes(), content)
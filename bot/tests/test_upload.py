@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+
+from librarian.cogs.upload import Upload
+
+
+class SeriesDirectoryTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name) / 'libraries'
+        self.root.mkdir()
+        self.upload = SimpleNamespace(_libraries_root=self.root)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def _series_directory(self, library: str, series: str) -> Path:
+        return await Upload._series_directory(self.upload, library, series)
+
+    async def test_creates_the_series(self):
+        directory = await self._series_directory('Manga', 'Series')
+        self.assertEqual(directory, self.root / 'manga' / 'Series')
+        self.assertTrue(directory.is_dir())
+
+    async def test_rejects_names_leaving_the_library(self):
+        for series in ('/etc', '..', '.', '', 'a/b', '../outside'):
+            with self.subTest(series=series), \
+                    self.assertRaises(ValueError):
+                await self._series_directory('manga', series)
+        with self.assertRaises(ValueError):
+            await self._series_directory('..', 'Series')
+        self.assertEqual(os.listdir(self.root), [])
+
+    async def test_rejects_symlinks_out_of_the_libraries(self):
+        outside = Path(self.directory.name) / 'outside'
+        outside.mkdir()
+        (self.root / 'manga').mkdir()
+        (self.root / 'manga' / 'Series').symlink_to(outside)
+        with self.assertRaises(ValueError):
+            await self._series_directory('manga', 'Series')
@@ -0,0 +1,143 @@
+import multiprocessing
+import tempfile
+import time
+import unittest
+import zipfile
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+
+from librarian.cogs.upload import _terminate_pool
+from librarian.dependable.exceptions import InvalidFileException
+from librarian.dependable.files import AtomicFile, finalize
+from librarian.dependable.validation import QUARANTINE_DIRECTORY, Validator, \
+    validate
+
+
+def _hang(path: Path, name: str):
+    time.sleep(60)
+
+
+class HangingValidator(Validator):
+    check = staticmethod(_hang)
+
+
+def _pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        1, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _zip(path: Path, members: dict[str, bytes],
+    compression: int = zipfile.ZIP_STORED) -> Path:
+    with zipfile.ZipFile(path, 'w', compression) as zip_file:
+        for name, content in members.items():
+            zip_file.writestr(name, content)
+    return path
+
+
+_PAGE = b'\x89PNG\r\n\x1a\n' + bytes(32)
+
+
+class ValidateTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_zip_under_comic_extensions(self):
+        archive = _zip(self.root / 'archive', {'001.png': _PAGE})
+        for name in ('volume.cbz', 'volume.cbr', 'volume.zip'):
+            result = validate(archive, name)
+            self.assertTrue(result.ok, f'{name}: {result.summary()}')
+            self.assertEqual(result.pages, 1)
+
+    def test_deflated_epub(self):
+        archive = _zip(self.root / 'archive', {
+            'mimetype': b'application/epub+zip',
+            'META-INF/container.xml': b'<container/>',
+            'OEBPS/chapter.xhtml': b'<html/>',
+        }, zipfile.ZIP_DEFLATED)
+        for name in ('book.epub', 'book.zip'):
+            result = validate(archive, name)
+            self.assertTrue(result.ok, f'{name}: {result.summary()}')
+            self.assertEqual(result.kind, 'epub')
+
+    def test_epub_without_container(self):
+        archive = _zip(self.root / 'archive', {'chapter.xhtml': b'<html/>'})
+        self.assertFalse(validate(archive, 'book.epub').ok)
+
+    def test_zip_without_pages(self):
+        archive = _zip(self.root / 'archive', {'book.epub': b'PK\x03\x04'})
+        self.assertTrue(validate(archive, 'books.zip').ok)
+        self.assertEqual(validate(archive, 'volume.cbz').summary(),
+                         'contains no images')
+
+    def test_mismatched_type(self):
+        archive = self.root / 'archive'
+        archive.write_bytes(b'Rar!\x1a\x07\x00')
+        self.assertEqual(validate(archive, 'volume.cbz').summary(),
+                         'is a RAR file, not ZIP')
+
+
+class ValidatorTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.root = Path(self.directory.name)
+        (self.root / 'manga' / 'Series').mkdir(parents=True)
+        self.pools = [_pool()]
+        self.recycled: list[Executor] = []
+        self.stopped: list[multiprocessing.Process] = []
+
+    def tearDown(self):
+        for pool in self.pools:
+            pool.shutdown(cancel_futures=True)
+        self.directory.cleanup()
+
+    def _recycle(self, pool: Executor) -> Executor:
+        self.recycled.append(pool)
+        self.stopped.extend(pool._processes.values())
+        _terminate_pool(pool)
+        self.pools.append(_pool())
+        return self.pools[-1]
+
+    def _store(self, validator: Validator, name: str, content: bytes):
+        with AtomicFile(self.root / 'manga' / 'Series' / name) as file:
+            file.write(content)
+            return finalize(file, validator)
+
+    def _validator(self, kind: type = Validator, timeout: float = 30
+    ) -> Validator:
+        return kind(self.pools[0], self.root, 'manga', 'Series', timeout,
+                    self._recycle)
+
+    def _quarantined(self) -> list[str]:
+        return [path.name.split('-', 2)[-1] for path
+                in (self.root / QUARANTINE_DIRECTORY).rglob('*')
+                if path.is_file()]
+
+    def test_valid_archive_is_stored(self):
+        archive = self.root / 'archive.cbz'
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('001.png', b'\x89PNG\r\n\x1a\n' + bytes(32))
+        path = self._store(self._validator(), 'volume.cbz',
+                           archive.read_bytes())
+        self.assertTrue(path.exists())
+        self.assertEqual(self.recycled, [])
+
+    def test_invalid_archive_is_quarantined(self):
+        with self.assertRaises(InvalidFileException):
+            self._store(self._validator(), 'volume.cbz', b'not a zip')
+        self.assertEqual(self._quarantined(), ['volume.cbz'])
+
+    def test_timeout_quarantines_and_recycles_the_pool(self):
+        validator = self._validator(HangingValidator, timeout=1)
+        with self.assertRaisesRegex(InvalidFileException, 'timed out'):
+            self._store(validator, 'volume.cbz', b'PK\x03\x04')
+        self.assertEqual(self._quarantined(), ['volume.cbz'])
+        self.assertEqual(self.recycled, [self.pools[0]])
+        self.assertIs(validator.executor, self.pools[1])
+        self.assertTrue(self.stopped)
+        for process in self.stopped:
+            process.join(5)
+            self.assertFalse(process.is_alive())